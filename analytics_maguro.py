@@ -9,6 +9,14 @@ import statsmodels.api as sm
 # --- モジュールのインポート ---
 from dataframe_loader import load_and_combine_market_data
 from data_preprocessor import preprocess_market_data
+from price_aggregation import aggregate_market_prices
+from quantile_sketch import save_sketches, rollup_sketches, box_stats_list
+from maguro_subset import extract_maguro_data
+from maguro_rollup import tag_maguro_hierarchy, maguro_rollup, hierarchy_grouping_sets, merge_sketches_by, rollup_table, MAGURO_HIERARCHY
+from tuna_forecast import run_tuna_forecasts
+from profiling import profile_section
+from export_api import export_results
+from market_calendar import aggregate_trading_day_prices, trading_day_gaps, rolling_trading_days
 
 # 日本語フォント設定
 try:
@@ -26,62 +34,33 @@ except ImportError:
 tokyo_file_paths = ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv']
 sapporo_file_path = 'Sapporo2014_2025.csv'
 osaka_file_path = 'Osaka2014_2025.csv'
+# マグロ抽出データ・集計結果の出力先 (BIツールなどで再利用する)。EXPORT_FORMAT が None の場合は出力しない
+EXPORT_FORMAT = 'parquet' # 'parquet' / 'csv' / 'xlsx'
+EXPORT_DIR = '分析結果_出力'
+# マグロの階層別集計で、階層 (マグロ全体 → 魚種グループ → 鮮度状態 → 市場 → 魚種) に加えて集計する列の組
+MAGURO_EXTRA_GROUPING_SETS = [('鮮度状態',), ('市場名_正規化',), ('魚種（商品名）',), ('市場名_正規化', '魚種（商品名）')]
 
 # --- 2. データの読み込み ---
+profile_section('2_load')
 print("--- 全市場データの読み込み開始 ---")
-df_raw_combined = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path)
+df_raw_combined = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path, encode_strings=True)
 if df_raw_combined.empty: exit("データフレームの読み込み失敗")
 print("--- 全市場データの読み込み完了 ---")
 
 # --- 3. データの前処理 ---
+profile_section('3_preprocess')
 print("\n--- 全市場データの前処理開始 ---")
 df_all_markets_cleaned = preprocess_market_data(df_raw_combined)
 if df_all_markets_cleaned.empty: exit("データの前処理失敗")
 print("--- 全市場データの前処理完了 ---")
 
 # --- 4. 「マグロ」関連データの抽出 (アプローチ1: 鮮度明確＋札幌・大阪特有) ---
+profile_section('4_extract_maguro')
 print("\n\n" + "="*20 + " マグロ関連データの抽出 (アプローチ1) " + "="*20)
-maguro_base_keywords_for_fresh_frozen = [
-    'まぐろ', 'きわだ', 'きはだ', 'めばち', 'いんど', 'みなみ', 
-    'まかじき', 'めかじき', 'びんちょう', 'びんなが', '本まぐろ', 'くろまぐろ'
-]
-sendo_keywords = ['生鮮', '冷凍']
-pattern_sendo = rf"({'|'.join(sendo_keywords)})" 
-pattern_maguro = rf"({'|'.join(maguro_base_keywords_for_fresh_frozen)})"
-
-df_maguro_sendo_clear = df_all_markets_cleaned[
-    df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False) &
-    df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_maguro, case=False, na=False)
-].copy()
-print(f"抽出された鮮度が明確なマグロ関連データの行数: {len(df_maguro_sendo_clear)}")
-
-sapporo_main_maguro_names = ['本まぐろ', 'めばち'] 
-df_sapporo_specific_maguro = df_all_markets_cleaned[
-    (df_all_markets_cleaned['市場名_正規化'] == '札幌') &
-    (df_all_markets_cleaned['魚種（商品名）'].isin(sapporo_main_maguro_names)) &
-    (~df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False))
-].copy()
-print(f"抽出された札幌市場特有マグロ行数: {len(df_sapporo_specific_maguro)}")
-
-osaka_main_maguro_names = ['くろまぐろ', 'きわだ'] 
-df_osaka_specific_maguro = df_all_markets_cleaned[
-    (df_all_markets_cleaned['市場名_正規化'] == '大阪（本場）') &
-    (df_all_markets_cleaned['魚種（商品名）'].isin(osaka_main_maguro_names)) &
-    (~df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False))
-].copy()
-print(f"抽出された大阪市場特有マグロ行数: {len(df_osaka_specific_maguro)}")
-
-dfs_to_concat = []
-if not df_maguro_sendo_clear.empty: dfs_to_concat.append(df_maguro_sendo_clear)
-if not df_sapporo_specific_maguro.empty: dfs_to_concat.append(df_sapporo_specific_maguro)
-if not df_osaka_specific_maguro.empty: dfs_to_concat.append(df_osaka_specific_maguro)
-
-if dfs_to_concat:
-    df_maguro_all = pd.concat(dfs_to_concat, ignore_index=True).drop_duplicates().reset_index(drop=True)
-else:
-    df_maguro_all = pd.DataFrame()
+df_maguro_all = extract_maguro_data(df_all_markets_cleaned)
 print(f"最終的なマグロ関連データの総行数: {len(df_maguro_all)}")
 if df_maguro_all.empty: exit("マグロ関連データなし")
+export_frames = {'マグロ_抽出データ': df_maguro_all} # ステップ10で出力する表 (名前 -> 表)
 
 print("最終マグロ魚種（商品名）ユニーク (上位20):\n", df_maguro_all['魚種（商品名）'].value_counts().nlargest(20))
 print("\n最終マグロ市場名_正規化ユニークと件数:\n", df_maguro_all['市場名_正規化'].value_counts())
@@ -115,17 +94,24 @@ if '日付' in df_maguro_all.columns and df_maguro_all['日付'].notna().any():
     df_maguro_ts = df_maguro_all.set_index('日付').copy()
 
 # --- 5. マグロデータに特化したEDA ---
+profile_section('5_eda_plots')
 print("\n\n" + "="*20 + " マグロデータのEDA " + "="*20)
-df_maguro_eda = df_maguro_all.dropna(subset=[quantity_col, price_col]).copy()
+df_maguro_eda = df_maguro_all.dropna(subset=[quantity_col, price_col])
 print("\n--- df_maguro_eda における市場別件数 (ステップ5直後) ---")
 if not df_maguro_eda.empty: print(df_maguro_eda['市場名_正規化'].value_counts(dropna=False))
 else: print("df_maguro_eda は空です。")
 
 if not df_maguro_eda.empty:
-    df_maguro_eda['鮮度状態'] = '不明'
-    df_maguro_eda.loc[df_maguro_eda['魚種（商品名）'].str.contains('生鮮', na=False), '鮮度状態'] = '生鮮'
-    df_maguro_eda.loc[df_maguro_eda['魚種（商品名）'].str.contains('冷凍', na=False), '鮮度状態'] = '冷凍'
-    print("\n鮮度状態のユニーク値と件数:\n", df_maguro_eda['鮮度状態'].value_counts(dropna=False))
+    df_maguro_eda = tag_maguro_hierarchy(df_maguro_eda)
+    # 階層のすべてのレベル・市場別・魚種別の集計表を1回の走査で作り、以降の表と箱ひげ図はここから求める
+    df_maguro_rollup, maguro_leaf_sketches = maguro_rollup(
+        df_maguro_eda, grouping_sets=hierarchy_grouping_sets() + MAGURO_EXTRA_GROUPING_SETS, quantity_col=quantity_col, price_col=price_col)
+    export_frames['マグロ_階層別集計'] = df_maguro_rollup
+    print("\n--- マグロ類の魚種グループ・鮮度状態別 集計 ---")
+    print(rollup_table(df_maguro_rollup, ['魚種グループ', '鮮度状態'])[['取引件数', '総取引数量_kg', '加重平均単価_円perKg', '単価_q0.5']].to_string())
+    # (市場, 魚種) ごとの単価スケッチ (最下層のスケッチを集約したもの) を保存する
+    maguro_price_sketches = {price_col: merge_sketches_by(maguro_leaf_sketches, MAGURO_HIERARCHY, ['市場名_正規化', '魚種（商品名）'])}
+    save_sketches(maguro_price_sketches, 'maguro_sketches.json')
 
     plt.figure(figsize=(12, 6))
     plt.subplot(1, 2, 1); sns.histplot(df_maguro_eda[quantity_col], bins=50, kde=False); plt.title(f'マグロ類 {quantity_col} の分布'); plt.xlabel('数量 (kg換算)'); plt.ylabel('頻度');
@@ -135,27 +121,36 @@ if not df_maguro_eda.empty:
     plt.tight_layout(); plt.show()
 
     plt.figure(figsize=(14, 7))
-    order = df_maguro_eda['魚種（商品名）'].value_counts().index
-    sns.boxplot(x='魚種（商品名）', y=price_col, data=df_maguro_eda, order=order, showfliers=False)
+    species_sketches = rollup_sketches(maguro_price_sketches[price_col], level=1)
+    df_maguro_species = rollup_table(df_maguro_rollup, ['魚種（商品名）'])
+    order = df_maguro_species['取引件数'].sort_values(ascending=False, kind='stable').index.tolist()
+    export_frames['マグロ_魚種別_集計'] = df_maguro_species
+    plt.gca().bxp(box_stats_list(species_sketches, order=order), showfliers=False)
     plt.title(f'マグロ類の魚種別 {price_col} 比較'); plt.xlabel('魚種（商品名）'); plt.ylabel(f'{price_col}'); plt.xticks(rotation=60, ha='right'); plt.tight_layout(); plt.show()
     
     plt.figure(figsize=(10, 6))
-    sns.boxplot(x='鮮度状態', y=price_col, data=df_maguro_eda, showfliers=False, order=['生鮮', '冷凍', '不明'])
+    freshness_sketches = rollup_sketches(maguro_leaf_sketches, level=MAGURO_HIERARCHY.index('鮮度状態'))
+    export_frames['マグロ_鮮度状態別_集計'] = rollup_table(df_maguro_rollup, ['鮮度状態'])
+    plt.gca().bxp(box_stats_list(freshness_sketches, order=['生鮮', '冷凍', '不明']), showfliers=False)
     plt.title(f'マグロ類の鮮度状態別 {price_col} 比較'); plt.xlabel('鮮度状態'); plt.ylabel(f'{price_col}'); plt.tight_layout(); plt.show()
 else:
     print(f"マグロEDAデータ ({quantity_col} or {price_col} NaNなし) が空のためEDAスキップ。")
 
 # --- 6. 市場別分析 ---
+profile_section('6_market_analysis')
 print("\n\n" + "="*20 + " マグロデータの市場別分析 " + "="*20)
 if not df_maguro_eda.empty:
     plt.figure(figsize=(12, 6))
-    order_market_price = df_maguro_eda.groupby('市場名_正規化')[price_col].median().sort_values(ascending=False).index
-    sns.boxplot(x='市場名_正規化', y=price_col, data=df_maguro_eda, order=order_market_price, showfliers=False)
+    market_sketches_maguro = rollup_sketches(maguro_price_sketches[price_col], level=0)
+    df_maguro_market = rollup_table(df_maguro_rollup, ['市場名_正規化'])
+    export_frames['マグロ_市場別_集計'] = df_maguro_market
+    plt.gca().bxp(box_stats_list(market_sketches_maguro), showfliers=False) # 中央値の降順
     plt.title(f'マグロ類の市場別 {price_col} 比較'); plt.xlabel('市場'); plt.ylabel(f'{price_col}'); plt.xticks(rotation=45, ha='right'); plt.tight_layout(); plt.show()
 
-    market_quantity_sum_maguro = df_maguro_eda.groupby('市場名_正規化')[quantity_col].sum().sort_values(ascending=False)
+    market_quantity_sum_maguro = df_maguro_market['総取引数量_kg'].rename(quantity_col).sort_values(ascending=False)
     print("\n--- マグロ類の市場別 総取引数量 (kg換算) ---")
     print(market_quantity_sum_maguro)
+    export_frames['マグロ_市場別_総取引数量'] = market_quantity_sum_maguro
     if not market_quantity_sum_maguro.empty:
         plt.figure(figsize=(10, 6))
         market_quantity_sum_maguro.plot(kind='bar')
@@ -164,6 +159,7 @@ else:
     print("マグロEDAデータが空のため市場別分析スキップ。")
 
 # --- 7. 詳細な時系列分析 ---
+profile_section('7_timeseries')
 print("\n\n" + "="*20 + " マグロデータの詳細時系列分析 " + "="*20)
 target_maguro_fish = 'まぐろ（生鮮）' 
 target_maguro_market = '東京中央' # 豊洲から東京中央へ変更
@@ -176,10 +172,21 @@ if not df_maguro_ts.empty and isinstance(df_maguro_ts.index, pd.DatetimeIndex):
         (df_maguro_ts[quantity_col].notna())
     ].copy()
 if not df_maguro_target_ts.empty:
+    # 数量加重平均単価の月次系列 (移動平均・季節調整の入力)
+    df_maguro_monthly_agg = aggregate_market_prices(df_maguro_target_ts.reset_index(), freq='M', group_keys=[]).set_index('日付')
     df_maguro_monthly = pd.DataFrame()
-    df_maguro_monthly['平均単価'] = df_maguro_target_ts[price_col].resample('M').mean()
-    df_maguro_monthly['総取引数量'] = df_maguro_target_ts[quantity_col].resample('M').sum()
+    df_maguro_monthly['平均単価'] = df_maguro_monthly_agg['加重平均単価_円perKg']
+    df_maguro_monthly['総取引数量'] = df_maguro_monthly_agg['総取引数量_kg']
     df_maguro_monthly.dropna(how='all', inplace=True)
+    export_frames[f'マグロ_月次_{target_maguro_market}_{target_maguro_fish}'] = df_maguro_monthly
+    # 市場の営業日にそろえた日次系列 (休市日は含まず、データのない営業日は 取引件数=0) と20営業日の移動平均
+    df_maguro_trading_daily = aggregate_trading_day_prices(df_maguro_target_ts.reset_index(), group_keys=['市場名_正規化'])
+    df_maguro_trading_daily = rolling_trading_days(df_maguro_trading_daily, ['市場名_正規化'], window=20)
+    df_maguro_trading_gaps = trading_day_gaps(df_maguro_trading_daily, ['市場名_正規化'])
+    print(f"{target_maguro_market}市場の{target_maguro_fish}: 営業日 {len(df_maguro_trading_daily)} 日のうちデータなし {(df_maguro_trading_daily['取引件数'] == 0).sum()} 日 "
+          f"(連続した欠け {len(df_maguro_trading_gaps)} 区間、最長 {df_maguro_trading_gaps['欠けた営業日数'].max() if len(df_maguro_trading_gaps) else 0} 営業日)")
+    export_frames[f'マグロ_営業日次_{target_maguro_market}_{target_maguro_fish}'] = df_maguro_trading_daily
+    export_frames[f'マグロ_データのない営業日_{target_maguro_market}_{target_maguro_fish}'] = df_maguro_trading_gaps
     if not df_maguro_monthly.empty:
         plt.figure(figsize=(15, 7)); df_maguro_monthly['平均単価'].plot(label='月次平均単価'); df_maguro_monthly['平均単価'].rolling(window=6).mean().plot(label='6ヶ月移動平均 (単価)');
         plt.title(f'{target_maguro_market}市場 {target_maguro_fish} {price_col} 推移'); plt.xlabel('日付'); plt.ylabel('単価'); plt.legend(); plt.grid(True); plt.show()
@@ -194,12 +201,30 @@ if not df_maguro_target_ts.empty:
 else: print(f"{target_maguro_market}市場の{target_maguro_fish}データなし、または時系列データなし")
 
 # --- 8. 相関分析 ---
+profile_section('8_correlation')
 print("\n\n" + "="*20 + " マグロデータの相関分析 " + "="*20)
 if not df_maguro_target_ts.empty and len(df_maguro_target_ts) > 1:
     plt.figure(figsize=(8, 6)); sns.scatterplot(x=price_col, y=quantity_col, data=df_maguro_target_ts.reset_index());
     plt.title(f'{target_maguro_market} {target_maguro_fish} - {price_col} と {quantity_col} の関係'); plt.xlabel(f'{price_col}'); plt.ylabel(f'{quantity_col}'); plt.grid(True); plt.show()
     correlation_maguro = df_maguro_target_ts[[price_col, quantity_col]].corr()
     print(f"\n--- {target_maguro_market} {target_maguro_fish} - {price_col} と {quantity_col} の相関係数 ---"); print(correlation_maguro)
+    export_frames[f'マグロ_相関係数_{target_maguro_market}_{target_maguro_fish}'] = correlation_maguro.rename_axis('項目')
 else: print(f"{target_maguro_market}市場の{target_maguro_fish}データなし/少数")
 
+# --- 9. 全市場・全マグロ魚種の翌月予測 ---
+profile_section('9_forecast')
+print("\n\n" + "="*20 + " マグロデータの翌月予測 (全市場・全魚種) " + "="*20)
+# (系列ごとの推定はプロセスプールで行う。Windows ではワーカーがこのスクリプトを読み込み直すため、メインプロセスでのみ実行する)
+if __name__ == '__main__':
+    df_maguro_forecast = run_tuna_forecasts(df_maguro_all)
+    if not df_maguro_forecast.empty:
+        print(df_maguro_forecast[['市場名_正規化', '魚種（商品名）', '予測対象', '予測月', '予測値', 'バックテストMAPE(%)']].to_string(index=False))
+    export_frames['マグロ_翌月予測'] = df_maguro_forecast
+
+# --- 10. 分析結果の出力 ---
+if EXPORT_FORMAT and __name__ == '__main__':
+    profile_section('10_export')
+    print("\n\n" + "="*20 + f" マグロ分析結果の出力 ({EXPORT_FORMAT}) " + "="*20)
+    export_results(export_frames, EXPORT_DIR, EXPORT_FORMAT)
+
 print("\n\nマグロ分析処理が完了しました。")
\ No newline at end of file
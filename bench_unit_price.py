@@ -0,0 +1,83 @@
+# bench_unit_price.py
+
+import contextlib
+import io
+import time
+
+import pandas as pd
+import numpy as np
+
+from dataframe_loader import load_and_combine_market_data
+from data_preprocessor import resolve_unit_price, price_unit_masks, _convert_column_types, _normalize_market_rows
+from market_sources import market_name_mapping
+from text_normalizer import normalize_text_columns
+
+# --- 設定 ---
+tokyo_file_paths = ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv']
+sapporo_file_path = 'Sapporo2014_2025.csv'
+osaka_file_path = 'Osaka2014_2025.csv'
+# 計測の繰り返し回数 (最小値を採用)
+N_REPEAT = 5
+# --- ここまで ---
+
+def unit_price_reference(df, is_en_per_kg, is_en_per_ton):
+    """旧実装 (.loc スライス + 入れ子の np.where) による 単価_円perKg の計算。"""
+    unit_price = pd.Series(np.nan, index=df.index)
+    unit_price.loc[is_en_per_kg] = np.where(
+        df.loc[is_en_per_kg, '中値（円）'].notna(),
+        df.loc[is_en_per_kg, '中値（円）'],
+        np.where(
+            df.loc[is_en_per_kg, '安値（円）'].notna(),
+            df.loc[is_en_per_kg, '安値（円）'],
+            np.nan
+        )
+    )
+    unit_price.loc[is_en_per_ton] = np.where(
+        df.loc[is_en_per_ton, '中値（円）'].notna(),
+        df.loc[is_en_per_ton, '中値（円）'] / 1000,
+        np.where(
+            df.loc[is_en_per_ton, '安値（円）'].notna(),
+            df.loc[is_en_per_ton, '安値（円）'] / 1000,
+            np.nan
+        )
+    )
+    return unit_price.to_numpy()
+
+def unit_price_kernel(df, is_en_per_kg, is_en_per_ton):
+    """新実装 (単位係数 + resolve_unit_price) による 単価_円perKg の計算。"""
+    price_divisor = np.full(len(df), np.nan)
+    price_divisor[is_en_per_kg.to_numpy()] = 1.0
+    price_divisor[is_en_per_ton.to_numpy()] = 1000.0
+    return resolve_unit_price(df['中値（円）'], df['安値（円）'], price_divisor)
+
+def best_time(func, *args):
+    """func を N_REPEAT 回実行し、最短の実行時間(秒)と最後の結果を返す。"""
+    timings = []
+    result = None
+    for _ in range(N_REPEAT):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+if __name__ == '__main__':
+    df_raw = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path)
+    if df_raw.empty: exit("データフレームの読み込み失敗")
+
+    # 前処理と同じ手順 (ステップ0〜6) で入力を準備し、価格単位の判定はステップ6と同じ price_unit_masks を使う
+    with contextlib.redirect_stdout(io.StringIO()):
+        _convert_column_types(df_raw)
+        normalize_text_columns(df_raw, cache_path=None)
+        df_raw = _normalize_market_rows(df_raw, market_name_mapping())
+    is_en_per_kg, is_en_per_ton = price_unit_masks(df_raw)
+
+    time_reference, result_reference = best_time(unit_price_reference, df_raw, is_en_per_kg, is_en_per_ton)
+    time_kernel, result_kernel = best_time(unit_price_kernel, df_raw, is_en_per_kg, is_en_per_ton)
+
+    print("\n" + "="*20 + " 単価_円perKg 計算ベンチマーク " + "="*20)
+    print(f"対象行数: {len(df_raw)} (円/kg: {is_en_per_kg.sum()}件, 円/トン: {is_en_per_ton.sum()}件)")
+    print(f"旧実装 (.loc + np.where): {time_reference * 1000:.2f} ms")
+    print(f"新実装 (単位係数カーネル): {time_kernel * 1000:.2f} ms")
+    if time_kernel > 0: print(f"速度比: {time_reference / time_kernel:.1f} 倍")
+    identical = np.array_equal(result_reference, result_kernel, equal_nan=True)
+    print(f"計算結果の一致: {'一致' if identical else '★不一致★'}")
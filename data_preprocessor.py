@@ -1,18 +1,65 @@
 # data_preprocessor.py
 
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
-def preprocess_market_data(df_initial):
+from lineage import data_columns
+from market_sources import market_name_mapping
+from memory_budget import get_memory_budget, duplicated_rows_spilled, frame_memory_mb
+from text_normalizer import DEFAULT_CACHE_PATH, normalize_text_columns
+from profiling import profiled, profile_stage
+
+def resolve_unit_price(mid_prices, low_prices, price_divisor):
     """
-    市場データのクリーニングと前処理を行う関数。
+    中値があれば中値、なければ安値を採用し、単位係数で割って円/kgの単価を返すカーネル。
+
+    Args:
+        mid_prices (array-like): 中値（円）。
+        low_prices (array-like): 安値（円）。
+        price_divisor (numpy.ndarray): 行ごとの単位係数 (円/kg=1, 円/トン=1000)。
+            NaNの行は単価もNaNになる。
+
+    Returns:
+        numpy.ndarray: 単価_円perKg。
     """
-    if df_initial.empty:
-        print("入力データフレームが空のため、前処理をスキップします。")
-        return df_initial
+    mid = np.asarray(mid_prices, dtype='float64')
+    low = np.asarray(low_prices, dtype='float64')
+    unit_price = np.where(np.isnan(mid), low, mid)
+    np.divide(unit_price, price_divisor, out=unit_price)
+    return unit_price
 
-    df = df_initial.copy()
+def price_unit_masks(df, price_unit_col='価格単位（円/kg、円/箱など）'):
+    """
+    ステップ6の価格単位の判定 (円/kg系統・円/トン系統) を行う。
+    df はステップ1 (全角/半角の統一) とステップ4 (市場名_正規化) を済ませたもの。
+    大阪（本場）の「くろまぐろ」「きわだ」で価格単位が空欄の行は円/kgとみなす。
 
+    Returns:
+        tuple[pandas.Series, pandas.Series]: (円/kg系統の行, 円/トン系統の行) のブール値。
+    """
+    price_units = df[price_unit_col].astype(str).str.lower()
+    # 円/kg 系統の同義語リスト
+    en_per_kg_synonyms = ['円/kg', '円/キロ', '/キロ', '円']
+    is_en_per_kg = price_units.isin(en_per_kg_synonyms)
+    # ★★★ 大阪市場の価格単位NaNを円/kgとみなす条件 ★★★
+    if '市場名_正規化' in df.columns and '魚種（商品名）' in df.columns:
+        is_en_per_kg |= (
+            (df['市場名_正規化'] == '大阪（本場）') &
+            (df['魚種（商品名）'].isin(['くろまぐろ', 'きわだ'])) &
+            (price_units.isin(['nan', 'NaN', ''])) # 価格単位が実質的に空の場合
+        )
+    # 円/トン 系統 (大阪のNaNケースは is_en_per_kg で処理されるので、ここはそのまま)
+    en_per_ton_synonyms = ['円/トン', '円/t']
+    is_en_per_ton = price_units.isin(en_per_ton_synonyms)
+    return is_en_per_kg, is_en_per_ton
+
+@profiled('step0_convert_types')
+def _convert_column_types(df):
+    """ステップ0: 日付列と数値列の型を変換する (df を直接更新)。"""
     print("\n\n" + "="*20 + " ステップ0: データ型再確認と日付変換 " + "="*20)
     if '日付' in df.columns:
         df['日付'] = pd.to_datetime(df['日付'], errors='coerce')
@@ -21,10 +68,22 @@ def preprocess_market_data(df_initial):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce')
 
+@profiled('step2-6_normalize_rows')
+def _normalize_market_rows(df, market_names=None, drop_duplicates=True):
+    """
+    ステップ2〜6: 重複行削除・「小計」除外・市場名/数量単位/価格単位の正規化を行う。
+    いずれも行単位 (重複削除は同一行どうし) の処理のため、市場名ごとに分割して実行しても結果は変わらない。
+    market_names は市場名 -> 市場名_正規化 の対応表 (None の場合は market_sources の登録から作る)。
+    drop_duplicates=False の場合、ステップ2 (重複削除済みのデータ) は行わない。
+    """
     print("\n\n" + "="*20 + " ステップ2: 完全な重複行の削除 " + "="*20)
-    initial_rows_before_dedup = len(df)
-    df.drop_duplicates(inplace=True)
-    print(f"完全な重複行を {initial_rows_before_dedup - len(df)}件 削除しました。 現在行数: {len(df)}")
+    if drop_duplicates:
+        initial_rows_before_dedup = len(df)
+        # 由来の列 (元ファイル・行番号) は行ごとに異なるため、重複の判定には含めない (最初に出現した行の由来が残る)
+        df.drop_duplicates(subset=data_columns(df), inplace=True)
+        print(f"完全な重複行を {initial_rows_before_dedup - len(df)}件 削除しました。 現在行数: {len(df)}")
+    else:
+        print(f"重複行は削除済みです。 現在行数: {len(df)}")
 
     print("\n\n" + "="*20 + " ステップ3: 「小計」行の除外 " + "="*20)
     if '魚種（商品名）' in df.columns:
@@ -34,17 +93,8 @@ def preprocess_market_data(df_initial):
 
     print("\n\n" + "="*20 + " ステップ4: 市場名の正規化 (東京市場統一) " + "="*20)
     if '市場名' in df.columns and '日付' in df.columns :
-        market_name_initial_mapping = {
-            '水産・築地': '築地', '水産・豊洲': '豊洲', '水産・足立': '足立', '水産・大田': '大田',
-            '大阪市中央卸売市場本場': '大阪'
-        }
-        df['市場名_temp'] = df['市場名'].replace(market_name_initial_mapping)
-        toyosu_start_date = pd.to_datetime('2018-10-11')
-        df['市場名_正規化'] = df['市場名_temp']
-        df.loc[df['市場名_temp'] == '築地', '市場名_正規化'] = '東京中央'
-        df.loc[df['市場名_temp'] == '豊洲', '市場名_正規化'] = '東京中央'
-        df.loc[df['市場名_temp'] == '大阪', '市場名_正規化'] = '大阪（本場）'
-        df.drop(columns=['市場名_temp'], inplace=True)
+        # 市場名の対応は各市場のデータソースの定義 (market_sources) に登録されたものを使う
+        df['市場名_正規化'] = df['市場名'].replace(market_name_mapping() if market_names is None else market_names)
         print("最終的な市場名_正規化 ユニーク値と件数:\n", df['市場名_正規化'].value_counts(dropna=False))
 
     print("\n\n" + "="*20 + " ステップ5: 数量単位の正規化 (元データ修正前提) " + "="*20)
@@ -64,10 +114,11 @@ def preprocess_market_data(df_initial):
         df[secondary_unit_col] = df[secondary_unit_col].astype(str).str.lower()
 
     # kg単位の同義語
-    kg_synonyms = ['kg', 'キロ', 'キログラム', 'ｋｇ', 'キログラム(kg)', 'ｋｇ(キログラム)', '1kg', '1ｋｇ', '1キログラム', '1ｋｇ(キログラム)']
+    # (全角/半角の表記ゆれはステップ1で統一済みのため、'ｋｇ' 'ｹｰｽ' などの別表記は不要)
+    kg_synonyms = ['kg', 'キロ', 'キログラム', 'キログラム(kg)', 'kg(キログラム)', '1kg', '1キログラム', '1kg(キログラム)']
     
     # その他の一般的な単位
-    other_units = ['箱', '尾', '束', '枚', 'ケース', '袋', 'パック', 'ｹｰｽ', 'p', 'CS', 'cs', 'はい', '連', 'ｶｰﾄﾝ', 'ｾｯﾄ', 'ネット', 'NETTO', 'kg以外', 'ｶｺﾞ']
+    other_units = ['箱', '尾', '束', '枚', 'ケース', '袋', 'パック', 'p', 'cs', 'はい', '連', 'カートン', 'セット', 'ネット', 'netto', 'kg以外', 'カゴ']
     
     # 優先順位1: primary_unit_col
     if primary_unit_col in df.columns:
@@ -86,7 +137,7 @@ def preprocess_market_data(df_initial):
         # あるいは元データ修正で「トン」という単位自体が適切なkg値と共に残っているかを想定。
         # もし「トン」という単位が残っていて、かつ卸売数量がトン数を示している場合は、
         # 手動修正で卸売数量をkg相当に直したという前提。
-        ton_synonyms = ['トン', 'ｔ', 't']
+        ton_synonyms = ['トン', 't']
         condition_is_ton_secondary = df[secondary_unit_col].isin(ton_synonyms) & df['数量単位_正規化'].isnull()
         df.loc[condition_is_ton_secondary, '数量単位_正規化'] = 'kg' # 単位はkgとして扱う
         # df.loc[condition_is_ton_secondary, '卸売数量_kg換算'] = df.loc[condition_is_ton_secondary, '卸売数量'] * 1000 # ← この行を削除またはコメントアウト
@@ -131,45 +182,16 @@ def preprocess_market_data(df_initial):
     if price_unit_col in df.columns:
         df[price_unit_col] = df[price_unit_col].astype(str).str.lower() # まず小文字化
         
-        # 円/kg 系統の同義語リスト
-        en_per_kg_synonyms = ['円/kg', '円/キロ', '/キロ', '円']
-        
-        # ★★★ 大阪市場の価格単位NaNを円/kgとみなす条件を追加 ★★★
-        condition_osaka_price_unit_nan = (
-            (df['市場名_正規化'] == '大阪（本場）') &
-            (df['魚種（商品名）'].isin(['くろまぐろ', 'きわだ'])) &
-            (df[price_unit_col].isin(['nan', 'NaN', ''])) # 価格単位が実質的に空の場合
-        )
-        # ★★★ ここまで ★★★
-
-        # is_en_per_kg の条件を更新
-        is_en_per_kg = df[price_unit_col].isin(en_per_kg_synonyms) | condition_osaka_price_unit_nan
-        
+        # 円/kg 系統 (大阪市場の価格単位NaNを含む) と 円/トン 系統の判定
+        is_en_per_kg, is_en_per_ton = price_unit_masks(df, price_unit_col)
         df.loc[is_en_per_kg, '価格単位_正規化'] = '円/kg'
-        
-        df.loc[is_en_per_kg, '単価_円perKg'] = np.where(
-            df.loc[is_en_per_kg, '中値（円）'].notna(),       
-            df.loc[is_en_per_kg, '中値（円）'],              
-            np.where(
-                df.loc[is_en_per_kg, '安値（円）'].notna(),   
-                df.loc[is_en_per_kg, '安値（円）'],          
-                np.nan                                    
-            )
-        )
-
-        # 円/トン 系統の処理 (これは変更なし)
-        en_per_ton_synonyms = ['円/トン', '円/ｔ']
-        is_en_per_ton = df[price_unit_col].isin(en_per_ton_synonyms) # 大阪のNaNケースは既にis_en_per_kgで処理されるので、ここはそのまま
         df.loc[is_en_per_ton, '価格単位_正規化'] = '円/kg' 
-        df.loc[is_en_per_ton, '単価_円perKg'] = np.where(
-            df.loc[is_en_per_ton, '中値（円）'].notna(),
-            df.loc[is_en_per_ton, '中値（円）'] / 1000,
-            np.where(
-                df.loc[is_en_per_ton, '安値（円）'].notna(),
-                df.loc[is_en_per_ton, '安値（円）'] / 1000,
-                np.nan
-            )
-        )
+
+        # 行ごとの単位係数 (円/kg=1, 円/トン=1000, それ以外=NaN) を作り、単価を1パスで決定する
+        price_divisor = np.full(len(df), np.nan)
+        price_divisor[is_en_per_kg.to_numpy()] = 1.0
+        price_divisor[is_en_per_ton.to_numpy()] = 1000.0
+        df['単価_円perKg'] = resolve_unit_price(df['中値（円）'], df['安値（円）'], price_divisor)
         
         en_per_mai_synonyms = ['円/枚']
         df.loc[df[price_unit_col].isin(en_per_mai_synonyms), '価格単位_正規化'] = '円/枚'
@@ -180,22 +202,123 @@ def preprocess_market_data(df_initial):
     print(df['価格単位_正規化'].value_counts(dropna=False))
     print("\n「単価_円perKg」の欠損数 (修正後):")
     print(df['単価_円perKg'].isnull().sum())
+    return df
+
+def _normalize_partition(df_part, market_names, drop_duplicates=True):
+    """プロセスプールのワーカーで _normalize_market_rows を実行する (ログ出力は抑制)。"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _normalize_market_rows(df_part, market_names, drop_duplicates)
+
+@profiled('step2-6_normalize_rows_parallel')
+def _normalize_market_rows_parallel(df, n_jobs, market_names, drop_duplicates=True):
+    """
+    元の市場名ごとに行を分割し、ステップ2〜6をプロセスプールで並列実行して元の行順に戻す。
+    市場名は行の値の一部なので、完全な重複行は必ず同じ分割に入り、
+    分割ごとの重複削除は全体での重複削除と一致する (最初に出現した行が残る点も同じ)。
+    """
+    market_positions = df.groupby('市場名', dropna=False, sort=False).indices.values()
+    # 行数の多い市場から、行数が最も少ないパーティションへ順に割り当てる
+    partitions = [[] for _ in range(min(n_jobs, len(market_positions)))]
+    partition_sizes = [0] * len(partitions)
+    for positions in sorted(market_positions, key=len, reverse=True):
+        target = partition_sizes.index(min(partition_sizes))
+        partitions[target].append(positions)
+        partition_sizes[target] += len(positions)
+    if len(partitions) <= 1:
+        return _normalize_market_rows(df, market_names, drop_duplicates)
+
+    original_index = df.index
+    df_parts = []
+    for part in partitions:
+        positions = np.sort(np.concatenate(part))
+        df_part = df.iloc[positions]
+        df_part.index = positions # 元の行位置を一時的なインデックスとして保持
+        df_parts.append(df_part)
+    print(f"市場名ごとに {len(df_parts)} パーティション (行数: {partition_sizes}) に分割し、並列で前処理します。")
+
+    with ProcessPoolExecutor(max_workers=len(df_parts)) as executor:
+        # ワーカーでは登録 (market_sources) が引き継がれない場合があるため、対応表を渡す
+        results = list(executor.map(_normalize_partition, df_parts, [market_names] * len(df_parts), [drop_duplicates] * len(df_parts)))
+
+    df_merged = pd.concat(results).sort_index()
+    df_merged.index = original_index[df_merged.index.to_numpy()]
+    print(f"並列前処理の結果を結合しました。 現在行数: {len(df_merged)}")
+    print("「数量単位_正規化」ユニーク値と件数:\n", df_merged['数量単位_正規化'].value_counts(dropna=False))
+    print("\n「価格単位_正規化」のユニーク値と件数 (修正後):")
+    print(df_merged['価格単位_正規化'].value_counts(dropna=False))
+    return df_merged
+
+@profiled()
+def preprocess_market_data(df_initial, n_jobs=1, normalization_cache_path=DEFAULT_CACHE_PATH, memory_budget=None):
+    """
+    市場データのクリーニングと前処理を行う関数。
+
+    Args:
+        df_initial (pandas.DataFrame): load_market_data / load_and_combine_market_data で結合した生データ。
+        n_jobs (int): 2以上の場合、ステップ2〜6を元の市場名ごとに分割してプロセスプールで並列実行する。
+            結果は逐次実行と完全に一致する。Windows ではスクリプト側を
+            if __name__ == '__main__': で保護した上で使用すること。
+        normalization_cache_path (str): ステップ1 (全角/半角の統一) の変換キャッシュの保存先。None の場合は保存しない。
+        memory_budget (MemoryBudget): メモリ予算。None の場合は memory_budget.get_memory_budget() の設定を使う。
+            予算がある場合は作業用のコピーの数値列を縮小し、予算に近づいたら重複削除前のデータをディスクに退避して、
+            1列ずつ読んで重複を判定してから重複のない行だけを読み戻す (結果は予算なしの場合と同じ値)。
+
+    Returns:
+        pandas.DataFrame: 前処理済みのデータ。
+    """
+    if df_initial.empty:
+        print("入力データフレームが空のため、前処理をスキップします。")
+        return df_initial
+
+    budget = memory_budget if memory_budget is not None else get_memory_budget()
+    df = df_initial.copy()
+    _convert_column_types(df)
+    if budget is not None:
+        budget.shrink(df, '前処理', '作業用のコピー', encode_strings=False)
+
+    print("\n\n" + "="*20 + " ステップ1: 全角/半角の表記ゆれの統一 " + "="*20)
+    with profile_stage('step1_normalize_width', rows=len(df)):
+        n_changed = normalize_text_columns(df, cache_path=normalization_cache_path)
+    print(f"全角/半角を統一した値: {n_changed}種類 (ユニーク値ごとに変換)")
+
+    deduplicated = False
+    if budget is not None and budget.under_pressure():
+        # 重複削除前のデータを退避し、手元には重複のない行だけを読み戻す (重複削除の作業領域と元のデータを同時に持たない)
+        subset = data_columns(df)
+        n_rows_before = len(df)
+        spilled = budget.spill(df, '前処理 (重複削除前)', '作業用のコピー')
+        del df
+        with profile_stage('step2_drop_duplicates_spilled', rows=n_rows_before):
+            df = spilled.load(~duplicated_rows_spilled(spilled, subset))
+        spilled.remove()
+        budget.hold(frame_memory_mb(df))
+        print(f"完全な重複行を {n_rows_before - len(df)}件 削除しました (退避したデータから判定)。 現在行数: {len(df)}")
+        deduplicated = True
+
+    market_names = market_name_mapping()
+    if n_jobs > 1 and '市場名' in df.columns:
+        df = _normalize_market_rows_parallel(df, n_jobs, market_names, drop_duplicates=not deduplicated)
+    else:
+        df = _normalize_market_rows(df, market_names, drop_duplicates=not deduplicated)
 
     print("\n\n" + "="*20 + " ステップ7: 主要キーでの重複の確認 " + "="*20)
     key_cols = ['日付', '市場名_正規化', '魚種（商品名）', '産地', '銘柄・規格（サイズ／グレード）', '販売方法']
-    df_temp_for_dup_check = df.copy()
+    # 欠損を埋めるのはキーの列だけなので、その列だけをコピーする
+    df_temp_for_dup_check = df[[col for col in key_cols if col in df.columns]].copy()
     for col in ['銘柄・規格（サイズ／グレード）', '販売方法', '産地', '魚種（商品名）']:
         if col in df_temp_for_dup_check.columns:
             df_temp_for_dup_check[col] = df_temp_for_dup_check[col].fillna('不明')
     valid_key_cols = [col for col in key_cols if col in df_temp_for_dup_check.columns]
     if valid_key_cols and len(valid_key_cols) == len(key_cols):
-        duplicate_groups = df_temp_for_dup_check.groupby(valid_key_cols).size()
+        duplicate_groups = df_temp_for_dup_check.groupby(valid_key_cols, observed=True).size()
         multi_transaction_keys = duplicate_groups[duplicate_groups > 1]
         if not multi_transaction_keys.empty:
             num_multi_transaction_records = df_temp_for_dup_check.set_index(valid_key_cols).index.isin(multi_transaction_keys.index).sum()
             print(f"指定キーでの複数取引レコード群: {len(multi_transaction_keys)} グループ, {num_multi_transaction_records} 件")
 
     print("\n\n" + "="*20 + " ステップ8: 不要/欠損過多列の扱い検討 " + "="*20)
+    primary_unit_col = '数量単位（kg、箱、尾など）'
+    price_unit_col = '価格単位（円/kg、円/箱など）'
     cols_to_drop = ['ID', '平均価格（円）', '備考（メモや特記事項など）', '卸売数量計']
     # secondary_unit_col を残すために、以下の行を修正
     cols_to_drop.extend([primary_unit_col, price_unit_col]) # secondary_unit_col を削除リストから除外
@@ -206,6 +329,8 @@ def preprocess_market_data(df_initial):
     print("削除後の列一覧:", df.columns.tolist())
 
     print("\nデータ前処理関数が完了しました。")
+    if budget is not None:
+        budget.report()
     return df
 
 if __name__ == '__main__':
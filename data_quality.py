@@ -0,0 +1,124 @@
+# data_quality.py
+
+import pandas as pd
+import numpy as np
+
+DEFAULT_QUALITY_KEYS = ['市場名_正規化', '魚種（商品名）', '数量単位_正規化']
+QUALITY_FLAG_COL = '品質フラグ'
+
+# 品質フラグ (ビットの組み合わせで1列に保存する)
+FLAG_INVALID_QUANTITY = 1   # 数量が負
+FLAG_INVALID_PRICE = 2      # 単価が0以下、または安値 > 高値
+FLAG_PRICE_OUTLIER = 4      # 単価がグループの中央値から大きく外れている
+FLAG_QUANTITY_OUTLIER = 8   # 数量がグループの中央値から大きく外れている
+FLAG_SUSPECT_TON_QUANTITY = 16  # 数量がグループの中央値の約1/1000 (トンの値がkgとして記録された疑い)
+FLAG_SUSPECT_TON_PRICE = 32     # 単価がグループの中央値の約1000倍 (円/トンが円/kgとして記録された疑い)
+
+FLAG_LABELS = {
+    FLAG_INVALID_QUANTITY: '数量が不正',
+    FLAG_INVALID_PRICE: '単価が不正',
+    FLAG_PRICE_OUTLIER: '単価の外れ値',
+    FLAG_QUANTITY_OUTLIER: '数量の外れ値',
+    FLAG_SUSPECT_TON_QUANTITY: 'トン/kg取り違え疑い (数量)',
+    FLAG_SUSPECT_TON_PRICE: 'トン/kg取り違え疑い (単価)',
+}
+
+# MAD を正規分布の標準偏差に換算する係数
+MAD_SCALE = 1.4826
+
+def _robust_zscores(log_values, group_codes, min_group_size):
+    """
+    グループごとの中央値・MAD による (対数値の) ロバスト z スコアと、中央値との差を返す。
+    グループの行数が min_group_size 未満、または MAD が 0 の場合は NaN。
+    """
+    grouped = log_values.groupby(group_codes)
+    medians = grouped.transform('median')
+    deviations = log_values - medians
+    mads = deviations.abs().groupby(group_codes).transform('median') * MAD_SCALE
+    counts = grouped.transform('count')
+    zscores = deviations / mads.where(mads > 0)
+    return zscores.where(counts >= min_group_size), deviations.where(counts >= min_group_size)
+
+def screen_data_quality(df, group_keys=None, threshold=5.0, min_group_size=10,
+                        price_col='単価_円perKg', quantity_col='卸売数量_kg換算'):
+    """
+    前処理済みデータの全行を、(市場, 魚種, 数量単位) ごとのロバスト統計量で評価し、品質フラグを付ける関数。
+    グループ分けは全データで1回だけ行い、中央値・MAD は groupby().transform で一括計算する。
+    単価・数量は対数で比較するため、1000倍のずれ (トン/kgの取り違え) は中央値との差が約3 (log10) になる。
+
+    Args:
+        df (pandas.DataFrame): preprocess_market_data の出力。
+        group_keys (list): 統計量を計算するグループ。None の場合は 市場名_正規化・魚種・数量単位_正規化。
+        threshold (float): 外れ値とみなすロバスト z スコアの絶対値。
+        min_group_size (int): 外れ値判定に必要なグループの最小行数。
+
+    Returns:
+        pandas.DataFrame: df に 品質フラグ (ビットの組み合わせ)・単価_ロバストz・数量_ロバストz・
+            単価数量比_ロバストz を追加したもの。
+    """
+    group_keys = [col for col in (DEFAULT_QUALITY_KEYS if group_keys is None else group_keys) if col in df.columns]
+    price = pd.to_numeric(df[price_col], errors='coerce') if price_col in df.columns else pd.Series(np.nan, index=df.index)
+    quantity = pd.to_numeric(df[quantity_col], errors='coerce') if quantity_col in df.columns else pd.Series(np.nan, index=df.index)
+
+    flags = np.zeros(len(df), dtype='uint8')
+    flags[(quantity < 0).to_numpy()] |= FLAG_INVALID_QUANTITY
+    flags[(price <= 0).to_numpy()] |= FLAG_INVALID_PRICE
+    if '安値（円）' in df.columns and '高値（円）' in df.columns:
+        flags[(df['安値（円）'] > df['高値（円）']).to_numpy()] |= FLAG_INVALID_PRICE
+
+    if group_keys:
+        group_codes = df.groupby(group_keys, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        group_codes = np.zeros(len(df), dtype='int64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_price = pd.Series(np.log10(price.where(price > 0)).to_numpy(), index=df.index)
+        log_quantity = pd.Series(np.log10(quantity.where(quantity > 0)).to_numpy(), index=df.index)
+    price_z, price_dev = _robust_zscores(log_price, group_codes, min_group_size)
+    quantity_z, quantity_dev = _robust_zscores(log_quantity, group_codes, min_group_size)
+    # 単価/数量の比: 数量だけがずれた行 (単位の取り違え) で大きく外れる
+    ratio_z, _ = _robust_zscores(log_price - log_quantity, group_codes, min_group_size)
+
+    flags[(price_z.abs() > threshold).to_numpy()] |= FLAG_PRICE_OUTLIER
+    flags[(quantity_z.abs() > threshold).to_numpy()] |= FLAG_QUANTITY_OUTLIER
+    # 中央値との差が 1000倍 (log10 で 3) ± 半桁 で、かつ外れ値であるもの
+    flags[((quantity_dev + 3).abs() < 0.5) & (ratio_z.abs() > threshold)] |= FLAG_SUSPECT_TON_QUANTITY
+    flags[((price_dev - 3).abs() < 0.5) & (price_z.abs() > threshold)] |= FLAG_SUSPECT_TON_PRICE
+
+    df_flagged = df.assign(**{
+        QUALITY_FLAG_COL: flags,
+        '単価_ロバストz': price_z.to_numpy(),
+        '数量_ロバストz': quantity_z.to_numpy(),
+        '単価数量比_ロバストz': ratio_z.to_numpy(),
+    })
+    print(f"品質チェック: {len(df)} 行中 {(flags > 0).sum()} 行にフラグを付けました。")
+    return df_flagged
+
+def has_flag(flags, flag):
+    """品質フラグ列 (Series または配列) のうち、指定したフラグが立っている行を True にする。"""
+    return (np.asarray(flags) & flag) != 0
+
+def summarize_quality_flags(df_flagged, group_col=None):
+    """フラグの種類ごとの件数 (group_col 指定時はその列ごと) を表にする。"""
+    flags = df_flagged[QUALITY_FLAG_COL].to_numpy()
+    df_bits = pd.DataFrame({label: has_flag(flags, flag) for flag, label in FLAG_LABELS.items()}, index=df_flagged.index)
+    if group_col is None:
+        return df_bits.sum().rename('件数').to_frame()
+    return df_bits.groupby(df_flagged[group_col], observed=True).sum()
+
+if __name__ == '__main__':
+    print("data_quality.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    df_test = pd.DataFrame({
+        '市場名_正規化': rng.choice(['東京中央', '札幌'], n_rows),
+        '魚種（商品名）': rng.choice(['まぐろ（生鮮）', 'さば'], n_rows),
+        '数量単位_正規化': 'kg',
+        '卸売数量_kg換算': rng.lognormal(6, 0.5, n_rows),
+        '単価_円perKg': rng.lognormal(7.5, 0.3, n_rows),
+    })
+    df_test.loc[:9, '卸売数量_kg換算'] /= 1000  # トンの値がkgとして記録された行
+    df_test.loc[10:14, '単価_円perKg'] *= 1000  # 円/トンが円/kgとして記録された行
+    df_test.loc[15, '単価_円perKg'] = -1.0
+    df_flagged_test = screen_data_quality(df_test)
+    print(summarize_quality_flags(df_flagged_test))
+    print(df_flagged_test.loc[:16, [QUALITY_FLAG_COL, '単価_ロバストz', '数量_ロバストz', '単価数量比_ロバストz']])
@@ -1,112 +1,115 @@
 # dataframe_loader.py
 
 import pandas as pd
+import numpy as np
 
-def load_and_combine_market_data(tokyo_files, sapporo_file, osaka_file):
+from lineage import DEFAULT_LINEAGE_PATH, LineageRegistry, add_lineage
+from market_sources import get_market_source, get_market_sources, read_market_sources
+from memory_budget import get_memory_budget
+from string_dictionary import encode_text_columns
+from profiling import profiled, profile_stage
+
+@profiled()
+def load_market_data(sources=None, encode_strings=False, max_workers=None, lineage=False, lineage_path=DEFAULT_LINEAGE_PATH,
+                     memory_budget=None):
     """
-    市場データを読み込み、結合して単一のDataFrameを返す関数。
+    登録済みの市場データソース (market_sources) を読み込み、結合して単一のDataFrameを返す関数。
+    ファイルはスレッドプールで並行して読み込み、市場ごとの列名・日付の書式・文字コードの違いは
+    各データソースの定義に従って共通形式にそろえる。
 
     Args:
-        tokyo_files (list): 東京市場のCSVファイルパスのリスト。
-        sapporo_file (str): 札幌市場のCSVファイルパス。
-        osaka_file (str): 大阪市場のCSVファイルパス。
+        sources (list): 読み込む MarketSource のリスト。None の場合は登録済みのすべて。
+        encode_strings (bool): True の場合、魚種・産地・銘柄などの文字列列を共通辞書の整数コード
+            (category 型) に変換する。比較・groupby がコード上で行われ、メモリも削減される。
+        max_workers (int): 同時に読み込むファイル数。None の場合はファイル数とCPU数の小さい方。
+        lineage (bool): True の場合、行ごとの由来 (元ファイル・行番号・取り込み実行) を整数コードの列で追加し、
+            コードの対応表を lineage_path に保存する (lineage.trace_rows で元ファイルの行に戻せる)。
+        memory_budget (MemoryBudget): メモリ予算。None の場合は memory_budget.get_memory_budget() (環境変数
+            MARKET_MEMORY_BUDGET) の設定を使い、それもなければ従来どおり読み込む。予算がある場合はファイルを1つずつ読み、
+            数値列の縮小・文字列列のカテゴリ化を行い、予算に近づいたら結合前のデータをディスクに退避する。
 
     Returns:
         pandas.DataFrame: 結合された市場データ。ファイル読み込みに失敗した場合は空のDataFrame。
     """
+    budget = memory_budget if memory_budget is not None else get_memory_budget()
     data_frames = []
-    loaded_files_count = 0
-
-    # 東京のデータを読み込んで結合
-    tokyo_dfs = []
-    print("--- 東京データの読み込み ---")
-    for file in tokyo_files:
-        try:
-            df_temp = pd.read_csv(file, low_memory=False)
-            print(f"正常に読み込みました: {file} (UTF-8 or auto-detected)")
-            tokyo_dfs.append(df_temp)
-            loaded_files_count +=1
-        except UnicodeDecodeError:
-            try:
-                df_temp = pd.read_csv(file, encoding='shift-jis', low_memory=False)
-                print(f"正常に読み込みました: {file} (Shift-JIS)")
-                tokyo_dfs.append(df_temp)
-                loaded_files_count +=1
-            except FileNotFoundError:
-                print(f"エラー: ファイルが見つかりません - {file}")
-            except Exception as e:
-                print(f"ファイルの読み込みに失敗しました ({file}): {e}")
-        except FileNotFoundError:
-            print(f"エラー: ファイルが見つかりません - {file}")
-        except Exception as e:
-            print(f"ファイルの読み込みに失敗しました ({file}): {e}")
-
-    if tokyo_dfs:
-        df_tokyo_combined = pd.concat(tokyo_dfs, ignore_index=True)
-        data_frames.append(df_tokyo_combined)
-        print("東京のデータを結合しました。")
+    current_source = None
+    registry = LineageRegistry.load(lineage_path) if lineage else None
+    run_code = registry.start_run('load_market_data') if lineage else None
+    if budget is None:
+        read_results = read_market_sources(sources, max_workers=max_workers)
     else:
-        print("東京のデータファイルが1つも読み込めませんでした。")
-
-    # 札幌のデータを読み込み
-    print("\n--- 札幌データの読み込み ---")
-    try:
-        df_sapporo = pd.read_csv(sapporo_file, low_memory=False)
-        print(f"正常に読み込みました: {sapporo_file} (UTF-8 or auto-detected)")
-        data_frames.append(df_sapporo)
-        loaded_files_count +=1
-    except UnicodeDecodeError:
-        try:
-            df_sapporo = pd.read_csv(sapporo_file, encoding='shift-jis', low_memory=False)
-            print(f"正常に読み込みました: {sapporo_file} (Shift-JIS)")
-            data_frames.append(df_sapporo)
-            loaded_files_count +=1
-        except FileNotFoundError:
-            print(f"エラー: ファイルが見つかりません - {sapporo_file}")
-        except Exception as e:
-            print(f"ファイルの読み込みに失敗しました ({sapporo_file}): {e}")
-    except FileNotFoundError:
-        print(f"エラー: ファイルが見つかりません - {sapporo_file}")
-    except Exception as e:
-        print(f"ファイルの読み込みに失敗しました ({sapporo_file}): {e}")
-
-    # 大阪のデータを読み込み
-    print("\n--- 大阪データの読み込み ---")
-    try:
-        df_osaka = pd.read_csv(osaka_file, low_memory=False)
-        print(f"正常に読み込みました: {osaka_file} (UTF-8 or auto-detected)")
-        data_frames.append(df_osaka)
-        loaded_files_count +=1
-    except UnicodeDecodeError:
-        try:
-            df_osaka = pd.read_csv(osaka_file, encoding='shift-jis', low_memory=False)
-            print(f"正常に読み込みました: {osaka_file} (Shift-JIS)")
-            data_frames.append(df_osaka)
-            loaded_files_count +=1
-        except FileNotFoundError:
-            print(f"エラー: ファイルが見つかりません - {osaka_file}")
-        except Exception as e:
-            print(f"ファイルの読み込みに失敗しました ({osaka_file}): {e}")
-    except FileNotFoundError:
-        print(f"エラー: ファイルが見つかりません - {osaka_file}")
-    except Exception as e:
-        print(f"ファイルの読み込みに失敗しました ({osaka_file}): {e}")
+        # 予算がある場合は、並行して読まずに1ファイルずつ読み込み・縮小してから次のファイルを読む
+        sources = get_market_sources() if sources is None else list(sources)
+        read_results = (result for source in sources for path in source.files
+                        for result in read_market_sources([source.with_files(path)], max_workers=1))
+    for source, path, df_file, message in read_results:
+        if source is not current_source:
+            print(f"\n--- {source.name}データの読み込み ---")
+            current_source = source
+        print(message)
+        if df_file is not None:
+            if lineage:
+                # CSV の1行目はヘッダーのため、データの先頭行は2行目
+                add_lineage(df_file, registry.file_code(path), run_code, np.arange(2, len(df_file) + 2))
+            if budget is not None:
+                # 予算がある場合は文字列列を常に符号化する (共通辞書のため、ファイルごとに符号化しても結合後と同じコードになる)
+                budget.shrink(df_file, '読み込み', path)
+                df_file = budget.keep_or_spill(df_file, '読み込み (結合前)', path)
+            data_frames.append(df_file)
+            del df_file
+    if lineage:
+        registry.save(lineage_path)
 
     # 全てのデータフレームを結合
-    if data_frames and loaded_files_count > 0:
-        df_combined = pd.concat(data_frames, ignore_index=True)
+    if data_frames:
+        n_files = len(data_frames)
+        if budget is None:
+            df_combined = pd.concat(data_frames, ignore_index=True)
+        else:
+            with profile_stage('concat_within_budget'):
+                df_combined = budget.concat(data_frames)
+            del data_frames
+        if encode_strings and budget is None:
+            print("文字列列を共通辞書で整数コード化します。")
+            with profile_stage('encode_strings', rows=len(df_combined)):
+                encode_text_columns(df_combined)
         print("\n" + "="*50 + "\n")
-        print(f"合計 {loaded_files_count} 個のファイルからデータを読み込み、結合しました。")
+        print(f"合計 {n_files} 個のファイルからデータを読み込み、結合しました。")
         print(f"結合後の総行数: {len(df_combined)}, 総列数: {len(df_combined.columns)}")
         print("結合後のデータの最初の数行と列名:")
         print(df_combined.head())
         print(df_combined.columns)
+        if budget is not None:
+            budget.report()
         return df_combined
     else:
         print("\n" + "="*50 + "\n")
         print("データファイルが一つも読み込めなかったか、結合に失敗しました。")
         return pd.DataFrame() # 空のDataFrameを返す
 
+def load_and_combine_market_data(tokyo_files, sapporo_file, osaka_file, encode_strings=False, lineage=False):
+    """
+    東京・札幌・大阪の市場データを読み込み、結合して単一のDataFrameを返す関数 (従来の呼び出し方)。
+    各市場のデータソースの定義 (market_sources) のファイルだけを差し替えて load_market_data を呼ぶ。
+
+    Args:
+        tokyo_files (list): 東京市場のCSVファイルパスのリスト。
+        sapporo_file (str): 札幌市場のCSVファイルパス。
+        osaka_file (str): 大阪市場のCSVファイルパス。
+        encode_strings (bool): load_market_data と同じ。
+        lineage (bool): load_market_data と同じ。
+
+    Returns:
+        pandas.DataFrame: 結合された市場データ。ファイル読み込みに失敗した場合は空のDataFrame。
+    """
+    sources = [
+        get_market_source('東京').with_files(tokyo_files),
+        get_market_source('札幌').with_files(sapporo_file),
+        get_market_source('大阪').with_files(osaka_file),
+    ]
+    return load_market_data(sources, encode_strings=encode_strings, lineage=lineage)
+
 if __name__ == '__main__':
     # このファイル単体で実行した場合のテスト用コード
     print("dataframe_loader.py を直接実行しています（テストモード）")
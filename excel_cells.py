@@ -0,0 +1,221 @@
+# excel_cells.py
+
+import hashlib
+import math
+import os
+import pickle
+from datetime import time
+
+import pandas as pd
+import numpy as np
+from pandas.io.parsers import TextParser
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# --- 設定 ---
+DEFAULT_CELL_CACHE_DIR = '.excel_cell_cache'
+# 日報のレイアウトで使う列 (A〜L列)。レイアウトの規則を変えてもこの範囲内ならキャッシュがそのまま使える
+MAX_EXTRACT_COLUMNS = 12
+# --- ここまで ---
+
+# 取り出し方 (セルの変換規則・列の範囲) を変えたら上げる (古いキャッシュは読み直す)
+CELL_CACHE_VERSION = 1
+
+def _convert_xls_cell(value, cell_type, datemode):
+    """xlrd のセルを pandas.read_excel (xlrd エンジン) と同じ規則で Python の値にする。"""
+    if cell_type == xlrd.XL_CELL_DATE:
+        try:
+            value = xlrd.xldate.xldate_as_datetime(value, datemode)
+        except OverflowError:
+            return value
+        # Excel は日付と時刻を区別しないため、起点日の値は時刻とみなす
+        if (not datemode and value.timetuple()[:3] == (1899, 12, 31)) or (datemode and value.timetuple()[:3] == (1904, 1, 1)):
+            value = time(value.hour, value.minute, value.second, value.microsecond)
+    elif cell_type == xlrd.XL_CELL_ERROR:
+        value = np.nan
+    elif cell_type == xlrd.XL_CELL_BOOLEAN:
+        value = bool(value)
+    elif cell_type == xlrd.XL_CELL_NUMBER and math.isfinite(value):
+        # 整数値の数値は int にする
+        if int(value) == value: value = int(value)
+    return value
+
+def _read_xls_rows(file_path, max_columns):
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        n_cols = min(sheet.ncols, max_columns)
+        rows = [
+            [_convert_xls_cell(value, cell_type, book.datemode)
+             for value, cell_type in zip(sheet.row_values(i, 0, n_cols), sheet.row_types(i, 0, n_cols))]
+            for i in range(sheet.nrows)
+        ]
+        return rows, sheet.ncols
+    finally:
+        book.release_resources()
+
+def _convert_xlsx_cell(cell):
+    """openpyxl のセルを pandas.read_excel (openpyxl エンジン) と同じ規則で Python の値にする。"""
+    if cell.value is None: return ''
+    if cell.data_type == 'e': return np.nan
+    if cell.data_type == 'n':
+        return int(cell.value) if int(cell.value) == cell.value else float(cell.value)
+    return cell.value
+
+def _read_xlsx_rows(file_path, max_columns):
+    book = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = book.worksheets[0]
+        sheet.reset_dimensions()
+        rows, last_row_with_data = [], -1
+        for row_number, row in enumerate(sheet.rows):
+            values = [_convert_xlsx_cell(cell) for cell in row]
+            while values and values[-1] == '':
+                values.pop()
+            if values: last_row_with_data = row_number
+            rows.append(values)
+        rows = rows[:last_row_with_data + 1]
+        n_cols = max((len(values) for values in rows), default=0)
+        rows = [(values + [''] * (n_cols - len(values)))[:max_columns] for values in rows]
+        return rows, n_cols
+    finally:
+        book.close()
+
+def read_sheet_rows(file_path, max_columns=MAX_EXTRACT_COLUMNS):
+    """
+    Excelファイルの先頭シートから、左端 max_columns 列のセルの値だけを取り出す関数。
+    セルの値の変換 (整数値の数値は int、エラーは NaN など) は pandas.read_excel と同じ。
+
+    Returns:
+        tuple: (行ごとの値のリスト, シートの列数)。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.xls' and xlrd is not None:
+        return _read_xls_rows(file_path, max_columns)
+    if ext in ('.xlsx', '.xlsm') and openpyxl is not None:
+        return _read_xlsx_rows(file_path, max_columns)
+    # 対応するライブラリがない場合は pandas に任せる
+    df_sheet = pd.read_excel(file_path, header=None)
+    rows = df_sheet.iloc[:, :max_columns].astype(object).where(df_sheet.iloc[:, :max_columns].notna(), '').values.tolist()
+    return rows, df_sheet.shape[1]
+
+def read_first_row(file_path, max_columns=MAX_EXTRACT_COLUMNS):
+    """
+    Excelファイルの先頭シートの1行目 (左端 max_columns 列) の値だけを返す関数。
+    日報の日付 (H1/I1/K1) の確認用で、シート全体のセルは変換しない。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.xls' and xlrd is not None:
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            sheet = book.sheet_by_index(0)
+            if sheet.nrows == 0: return []
+            n_cols = min(sheet.ncols, max_columns)
+            return [_convert_xls_cell(value, cell_type, book.datemode)
+                    for value, cell_type in zip(sheet.row_values(0, 0, n_cols), sheet.row_types(0, 0, n_cols))]
+        finally:
+            book.release_resources()
+    if ext in ('.xlsx', '.xlsm') and openpyxl is not None:
+        book = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+        try:
+            for row in book.worksheets[0].iter_rows(min_row=1, max_row=1, max_col=max_columns):
+                return [_convert_xlsx_cell(cell) for cell in row]
+            return []
+        finally:
+            book.close()
+    df_head = pd.read_excel(file_path, header=None, nrows=1)
+    return df_head.iloc[0, :max_columns].where(df_head.iloc[0, :max_columns].notna(), '').tolist() if len(df_head) else []
+
+def file_sha256(file_path):
+    """ファイル内容の sha256 (16進文字列) を返す。"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], f'{digest}.pkl')
+
+def load_sheet_rows(file_path, cache_dir=DEFAULT_CELL_CACHE_DIR, max_columns=MAX_EXTRACT_COLUMNS):
+    """
+    read_sheet_rows の結果を、ファイル内容の sha256 をキーにキャッシュして返す関数。
+    同じ内容のファイルは (ファイル名や場所が変わっても) Excel を開かずにキャッシュから読み込む。
+    cache_dir が None の場合はキャッシュしない。
+
+    Excel を開く時間 (xlrd のブック全体の書式 (XF) レコードの解析) は pd.read_excel と同じくかかるため、
+    初回 (キャッシュなし) の読み込みは pd.read_excel とほぼ同じ速さで、速くなるのは2回目以降 (キャッシュあり) だけ。
+    """
+    if cache_dir is None:
+        return read_sheet_rows(file_path, max_columns)
+    path = _cache_path(cache_dir, file_sha256(file_path))
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['version'] == CELL_CACHE_VERSION and cached['max_columns'] >= max_columns:
+                return [values[:max_columns] for values in cached['rows']], cached['n_cols']
+        except Exception:
+            pass # 壊れたキャッシュは読み直して上書きする
+    rows, n_cols = read_sheet_rows(file_path, max_columns)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': CELL_CACHE_VERSION, 'max_columns': max_columns, 'rows': rows, 'n_cols': n_cols}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return rows, n_cols
+
+def read_report_sheet(file_path, cache_dir=DEFAULT_CELL_CACHE_DIR, max_columns=MAX_EXTRACT_COLUMNS):
+    """
+    日報Excelの先頭シートを DataFrame にする関数。
+    pd.read_excel(file_path, header=None) の左端 max_columns 列と同じ値・型の DataFrame を返す
+    (列の型の判定も pandas と同じ処理で行う)。
+
+    Returns:
+        pandas.DataFrame: シートの内容 (列名・インデックスは0からの連番)。
+    """
+    rows, _ = load_sheet_rows(file_path, cache_dir, max_columns)
+    if not rows or not rows[0]:
+        return pd.DataFrame()
+    # read_excel と同じく空行も残す (行番号でセルを参照するため)
+    return TextParser(rows, header=None, skip_blank_lines=False).read()
+
+if __name__ == '__main__':
+    print("excel_cells.py を直接実行しています（テストモード）")
+    import glob
+    import tempfile
+    import time as time_module
+    report_files = sorted(glob.glob(os.path.join('./04_大阪市場日報データ（水産）', '**', '*.xls*'), recursive=True))[:200]
+    if not report_files:
+        print("日報ファイルが見つかりません。")
+    else:
+        def best_of(func, repeat=3):
+            # 1回ごとのばらつきが大きいため、repeat 回のうち最短の時間を使う
+            times = []
+            for _ in range(repeat):
+                start = time_module.perf_counter()
+                result = func()
+                times.append(time_module.perf_counter() - start)
+            return result, min(times)
+        expected, pandas_sec = best_of(lambda: [pd.read_excel(f, header=None).iloc[:, :MAX_EXTRACT_COLUMNS] for f in report_files])
+        print(f"pd.read_excel: {pandas_sec:.2f} 秒 ({len(report_files)} ファイル)")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cases = [
+                ('キャッシュなし (cache_dir=None)', lambda: [read_report_sheet(f, cache_dir=None) for f in report_files], 3),
+                ('初回 (キャッシュに書き込み)', lambda: [read_report_sheet(f, cache_dir=tmp_dir) for f in report_files], 1),
+                ('2回目以降 (キャッシュあり)', lambda: [read_report_sheet(f, cache_dir=tmp_dir) for f in report_files], 3),
+            ]
+            for label, func, repeat in cases:
+                actual, sec = best_of(func, repeat)
+                print(f"{label}: {sec:.2f} 秒 (pd.read_excel の {pandas_sec / sec:.2f} 倍の速さ)")
+                for f, df_expected, df_actual in zip(report_files, expected, actual):
+                    pd.testing.assert_frame_equal(df_actual, df_expected, obj=f)
+        print("pd.read_excel と同じ結果であることを確認しました。")
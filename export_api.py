@@ -0,0 +1,226 @@
+# export_api.py
+
+import gzip
+import bz2
+import lzma
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# --- 設定 ---
+DEFAULT_EXPORT_DIR = '分析結果_出力'
+DEFAULT_CHUNK_ROWS = 100_000  # 1回に変換・書き込みする行数 (メモリ上の変換コピーはこの行数分だけ)
+# --- ここまで ---
+
+EXPORT_FORMATS = ['parquet', 'csv', 'xlsx']
+EXTENSIONS = {'parquet': '.parquet', 'csv': '.csv', 'xlsx': '.xlsx'}
+# CSV の圧縮形式 -> (ファイルを開く関数, 拡張子)
+CSV_COMPRESSIONS = {'gzip': (gzip.open, '.gz'), 'bz2': (bz2.open, '.bz2'), 'xz': (lzma.open, '.xz')}
+PARQUET_COMPRESSIONS = ['snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none']
+EXCEL_MAX_ROWS = 1_048_575  # 1シートの最大行数 (見出し行を除く)。超える分は次のシートに書く
+MANIFEST_NAME = 'export_manifest.json'
+
+def infer_export_format(path):
+    """ファイル名の拡張子から出力形式を判定する ('.csv.gz' などの圧縮拡張子は除いて判定)。"""
+    root, ext = os.path.splitext(path.lower())
+    if ext in [suffix for _, suffix in CSV_COMPRESSIONS.values()]:
+        ext = os.path.splitext(root)[1]
+    for file_format, suffix in EXTENSIONS.items():
+        if ext == suffix: return file_format
+    raise ValueError(f"出力形式を判定できません: {path} (拡張子は {', '.join(EXTENSIONS.values())})")
+
+def iter_row_chunks(df, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """df を chunk_rows 行ずつに分けて返す (位置による切り出しのため、元の df はコピーしない)。"""
+    chunk_rows = max(int(chunk_rows), 1)
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def _parquet_schema(df):
+    """
+    df 全体から parquet のスキーマを決める (チャンクごとに型がぶれないようにする)。
+    文字列と数値が混在する object 列は文字列の列にする。
+    """
+    fields = []
+    for col in df.columns:
+        if df[col].dtype != object:
+            # 型の決まっている列は空の切り出しから判定する (値は変換しない)
+            fields.append(pa.Schema.from_pandas(df[[col]].iloc[:0], preserve_index=False).field(0))
+            continue
+        try:
+            value_type = pa.infer_type(df[col].to_numpy(), from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            value_type = pa.string()
+        fields.append(pa.field(str(col), value_type))
+    return pa.schema(fields)
+
+def _to_record_batch(df_chunk, schema):
+    arrays = []
+    for field in schema:
+        values = df_chunk[field.name]
+        if pa.types.is_string(field.type) and values.dtype == object:
+            values = values.map(lambda value: value if value is None or isinstance(value, str) or pd.isna(value) else str(value))
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _write_parquet(df, path, compression, chunk_rows):
+    schema = _parquet_schema(df)
+    # チャンクごとに Arrow 形式に変換して行グループとして書き込む (変換後のコピーは常に1チャンク分)
+    with pq.ParquetWriter(path, schema, compression=compression or 'snappy') as writer:
+        for df_chunk in iter_row_chunks(df, chunk_rows):
+            writer.write_batch(_to_record_batch(df_chunk, schema))
+
+def _write_csv(df, path, compression, chunk_rows):
+    opener = CSV_COMPRESSIONS[compression][0] if compression else open
+    # BOM はファイルの先頭に1回だけ書かれる (Excel で開いても文字化けしない)
+    with opener(path, 'wt', encoding='utf_8_sig', newline='') as f:
+        for i, df_chunk in enumerate(iter_row_chunks(df, chunk_rows)):
+            df_chunk.to_csv(f, index=False, header=(i == 0))
+        if len(df) == 0:
+            df.to_csv(f, index=False)
+
+def _write_xlsx(df, path, chunk_rows, sheet_name):
+    if xlsxwriter is not None:
+        # constant_memory: 書き込んだ行はすぐにファイルへ出し、ブック全体をメモリに持たない
+        writer = pd.ExcelWriter(path, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}})
+    else:
+        print("xlsxwriter がないため openpyxl で保存します (ブック全体をメモリ上に作成します)。")
+        writer = pd.ExcelWriter(path, engine='openpyxl')
+    with writer:
+        if len(df) == 0:
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        for sheet_number, sheet_start in enumerate(range(0, len(df), EXCEL_MAX_ROWS)):
+            df_sheet = df.iloc[sheet_start:sheet_start + EXCEL_MAX_ROWS]
+            name = sheet_name if sheet_number == 0 else f'{sheet_name}_{sheet_number + 1}'
+            for i, df_chunk in enumerate(iter_row_chunks(df_sheet, chunk_rows)):
+                # 先頭チャンクのみ見出し行を書き、以降はその下の行に続けて書く
+                df_chunk.to_excel(writer, sheet_name=name, index=False, header=(i == 0),
+                                  startrow=0 if i == 0 else i * chunk_rows + 1)
+
+def export_frame(df, path, file_format=None, compression=None, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_name='データ'):
+    """
+    DataFrame を chunk_rows 行ずつ変換してファイルに書き込む関数。
+    変換中のコピーは1チャンク分だけのため、全期間のデータでもメモリ上にフレームを2つ持たずに出力できる。
+
+    Args:
+        df (pandas.DataFrame): 出力するデータ (インデックスは出力しない)。
+        path (str): 出力先のパス。
+        file_format (str): 'parquet' / 'csv' / 'xlsx'。None の場合は拡張子から判定する。
+            parquet 用・Excel 用のライブラリがない場合は CSV で保存する (拡張子も .csv にする)。
+        compression (str): parquet は 'snappy' (既定) / 'zstd' / 'gzip' など、CSV は 'gzip' / 'bz2' / 'xz'
+            (拡張子 .gz などを付ける)。xlsx では使わない。
+        chunk_rows (int): 1回に書き込む行数。
+        sheet_name (str): xlsx のシート名 (1,048,575 行を超える場合は シート名_2, _3, ... に続ける)。
+
+    Returns:
+        str: 保存したファイルのパス。
+    """
+    file_format = file_format or infer_export_format(path)
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {file_format} (対応: {', '.join(EXPORT_FORMATS)})")
+    if (file_format == 'parquet' and pa is None) or (file_format == 'xlsx' and xlsxwriter is None and openpyxl is None):
+        print(f"{file_format} 用のライブラリがないため、CSV形式で保存します。")
+        path = os.path.splitext(path)[0] + EXTENSIONS['csv']
+        file_format, compression = 'csv', None
+    if file_format == 'parquet' and compression is not None and compression not in PARQUET_COMPRESSIONS:
+        raise ValueError(f"parquet の圧縮形式は {', '.join(PARQUET_COMPRESSIONS)} のいずれかです: {compression}")
+    if file_format == 'csv' and compression is not None:
+        if compression not in CSV_COMPRESSIONS:
+            raise ValueError(f"CSV の圧縮形式は {', '.join(CSV_COMPRESSIONS)} のいずれかです: {compression}")
+        suffix = CSV_COMPRESSIONS[compression][1]
+        if not path.endswith(suffix): path += suffix
+
+    if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        if file_format == 'parquet':
+            _write_parquet(df, tmp_path, compression, chunk_rows)
+        elif file_format == 'csv':
+            _write_csv(df, tmp_path, compression, chunk_rows)
+        else:
+            _write_xlsx(df, tmp_path, chunk_rows, sheet_name)
+        os.replace(tmp_path, path) # 書き込みが終わってから置き換える (途中のファイルを読まれないように)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+    return path
+
+def _as_export_frame(data):
+    """Series や集計結果 (キーがインデックスの表) を、インデックスを列にした DataFrame にする。"""
+    df = data.to_frame() if isinstance(data, pd.Series) else data
+    index = df.index
+    if not isinstance(index, pd.MultiIndex) and index.name is None and pd.api.types.is_integer_dtype(index.dtype):
+        return df # 行番号だけのインデックス (前処理済みデータなどの大きな表) はそのまま出力する (コピーしない)
+    return df.reset_index()
+
+def export_results(frames, output_dir=DEFAULT_EXPORT_DIR, file_format='parquet', compression=None,
+                   chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    名前付きの表 (前処理済みデータ・マグロ抽出データ・集計結果など) をまとめて出力する関数。
+    各表は {output_dir}/{名前}.{拡張子} に保存し、一覧を export_manifest.json に書く (BIツールの取り込み用)。
+
+    Args:
+        frames (dict): 名前 -> DataFrame または Series。空・None の表は出力しない。
+
+    Returns:
+        list: 出力した表ごとの情報 (名前・パス・行数・列名) のリスト。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = []
+    for name, data in frames.items():
+        if data is None or len(data) == 0:
+            print(f"  {name}: データがないため出力しません。")
+            continue
+        df = _as_export_frame(data)
+        path = export_frame(df, os.path.join(output_dir, f'{name}{EXTENSIONS[file_format]}'), file_format,
+                            compression=compression, chunk_rows=chunk_rows)
+        manifest.append({'name': name, 'path': os.path.basename(path), 'rows': len(df), 'columns': [str(col) for col in df.columns]})
+        print(f"  -> 保存しました: {path} ({len(df)} 行)")
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    existing = []
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            existing = [entry for entry in json.load(f) if entry['path'] not in {entry['path'] for entry in manifest}]
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(existing + manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+if __name__ == '__main__':
+    print("export_api.py を直接実行しています（テストモード）")
+    import tempfile
+    rng = np.random.default_rng(0)
+    n_rows = 250_000
+    df_test = pd.DataFrame({
+        '日付': pd.Timestamp('2014-01-01') + pd.to_timedelta(rng.integers(0, 4000, n_rows), unit='D'),
+        '市場名_正規化': pd.Categorical(rng.choice(['東京中央', '札幌', '大阪（本場）'], n_rows)),
+        '魚種（商品名）': rng.choice(['まぐろ（生鮮）', 'めばち（冷凍）', 'さば'], n_rows).astype(object),
+        '卸売数量_kg換算': rng.gamma(2.0, 100.0, n_rows),
+        '単価_円perKg': np.where(rng.random(n_rows) < 0.05, np.nan, rng.gamma(5.0, 500.0, n_rows)),
+        '備考（メモや特記事項など）': np.where(rng.random(n_rows) < 0.5, None, 1.5).astype(object), # 数値と欠損の混在
+    })
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_format, compression, reader in [
+            ('parquet', 'zstd', pd.read_parquet),
+            ('csv', 'gzip', lambda path: pd.read_csv(path, encoding='utf_8_sig', parse_dates=['日付'])),
+        ]:
+            path = export_frame(df_test, os.path.join(tmp_dir, f'テスト{EXTENSIONS[file_format]}'), file_format,
+                                compression=compression, chunk_rows=60_000)
+            df_read = reader(path)
+            pd.testing.assert_frame_equal(df_read, df_test, check_dtype=False, check_categorical=False)
+            print(f"{file_format} ({compression}): {os.path.getsize(path) / 1e6:.1f} MB, 読み戻した内容が一致しました。")
+        print(export_results({'月次集計': df_test.groupby('市場名_正規化', observed=True)['卸売数量_kg換算'].sum()}, tmp_dir, 'csv'))
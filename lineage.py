@@ -0,0 +1,110 @@
+# lineage.py
+
+import json
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+DEFAULT_LINEAGE_PATH = 'lineage_registry.json'
+
+# 行ごとの由来 (すべて整数コード、1行あたり 12 バイト)
+LINEAGE_FILE_COL = '由来_ファイル'  # LineageRegistry.files の番号
+LINEAGE_ROW_COL = '由来_行'         # 元ファイルの行番号 (CSV はヘッダーを1行目として数えた行番号 (空行は数えない)、Excel はシートの行番号)
+LINEAGE_RUN_COL = '由来_実行'       # LineageRegistry.runs の番号 (どの読み込みで取り込んだか)
+LINEAGE_COLUMNS = [LINEAGE_FILE_COL, LINEAGE_ROW_COL, LINEAGE_RUN_COL]
+
+class LineageRegistry:
+    """
+    由来コードの対応表 (ファイル番号 -> パス、実行番号 -> 実行日時・コマンド)。
+    既存のファイルの番号は変わらないため、過去に保存したデータの由来コードもそのまま引ける。
+    """
+
+    def __init__(self):
+        self.files = []
+        self.file_codes = {}
+        self.runs = []
+
+    def file_code(self, file_path):
+        path = os.path.abspath(file_path)
+        code = self.file_codes.get(path)
+        if code is None:
+            code = len(self.files)
+            self.files.append(path)
+            self.file_codes[path] = code
+        return code
+
+    def start_run(self, note=None):
+        """取り込みの実行を登録し、実行番号を返す。"""
+        self.runs.append({
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'command': ' '.join(sys.argv), 'note': note,
+        })
+        return len(self.runs) - 1
+
+    def save(self, path=DEFAULT_LINEAGE_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'runs': self.runs}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path=DEFAULT_LINEAGE_PATH):
+        """保存済みの対応表を読み込む (なければ新規作成)。"""
+        registry = LineageRegistry()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            for file_path in saved['files']:
+                registry.file_code(file_path)
+            registry.runs = saved['runs']
+        return registry
+
+def add_lineage(df, file_code, run_code, row_numbers):
+    """df に由来の列を追加する (df を直接更新)。row_numbers は行ごとの元ファイルの行番号。"""
+    df[LINEAGE_FILE_COL] = np.full(len(df), file_code, dtype='int32')
+    df[LINEAGE_ROW_COL] = np.asarray(row_numbers, dtype='int32')
+    df[LINEAGE_RUN_COL] = np.full(len(df), run_code, dtype='int32')
+    return df
+
+def data_columns(df):
+    """由来の列を除いた列 (重複判定などに使う)。"""
+    return [col for col in df.columns if col not in LINEAGE_COLUMNS]
+
+def has_lineage(df):
+    return all(col in df.columns for col in LINEAGE_COLUMNS)
+
+def trace_rows(df_rows, registry=None, registry_path=DEFAULT_LINEAGE_PATH):
+    """
+    行の由来コードを、元ファイルのパス・行番号・取り込み日時に戻す関数。
+
+    Returns:
+        pandas.DataFrame: df_rows と同じインデックスで 元ファイル・元ファイルの行・取込日時 の列を持つ表
+            (df_rows にない由来の列は含まない)。
+    """
+    if LINEAGE_FILE_COL not in df_rows.columns:
+        print("由来の列がありません (load_market_data(lineage=True) で読み込んでください)。")
+        return pd.DataFrame(index=df_rows.index)
+    registry = LineageRegistry.load(registry_path) if registry is None else registry
+    files = np.asarray(registry.files + [None], dtype='object')
+    run_times = np.asarray([run['started_at'] for run in registry.runs] + [None], dtype='object')
+    # 由来が不明 (集計で複数のファイルにまたがる場合の -1) は末尾の None になる
+    df_trace = pd.DataFrame({'元ファイル': files[df_rows[LINEAGE_FILE_COL].to_numpy()]}, index=df_rows.index)
+    if LINEAGE_ROW_COL in df_rows.columns:  # 集計結果には行番号はない
+        df_trace['元ファイルの行'] = df_rows[LINEAGE_ROW_COL].to_numpy()
+    if LINEAGE_RUN_COL in df_rows.columns:
+        df_trace['取込日時'] = run_times[df_rows[LINEAGE_RUN_COL].to_numpy()]
+    return df_trace
+
+if __name__ == '__main__':
+    print("lineage.py を直接実行しています（テストモード）")
+    test_registry = LineageRegistry()
+    run = test_registry.start_run('テスト')
+    df_a = add_lineage(pd.DataFrame({'魚種（商品名）': ['まぐろ（生鮮）', 'さば']}), test_registry.file_code('Tokyo2014_2019.csv'), run, [2, 3])
+    df_b = add_lineage(pd.DataFrame({'魚種（商品名）': ['めばち（冷凍）']}), test_registry.file_code('Sapporo2014_2025.csv'), run, [2])
+    df_test = pd.concat([df_a, df_b], ignore_index=True)
+    print(df_test)
+    print(f"由来の列のメモリ: {df_test[LINEAGE_COLUMNS].memory_usage(index=False).sum() / len(df_test):.0f} バイト/行")
+    print(pd.concat([df_test, trace_rows(df_test, test_registry)], axis=1))
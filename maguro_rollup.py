@@ -0,0 +1,202 @@
+# maguro_rollup.py
+
+import pandas as pd
+import numpy as np
+
+from quantile_sketch import KLLSketch
+
+# --- 設定 ---
+# 魚種グループの判定規則 (上から順に、最初にキーワードが含まれたグループにする)
+SPECIES_GROUP_RULES = [
+    ('本まぐろ', ['くろまぐろ', '本まぐろ']),
+    ('みなみまぐろ', ['みなみ', 'いんど']),
+    ('めばち', ['めばち']),
+    ('きはだ', ['きわだ', 'きはだ']),
+    ('びんなが', ['びんなが', 'びんちょう']),
+    ('かじき類', ['まかじき', 'めかじき']),
+]
+OTHER_SPECIES_GROUP = 'まぐろ (魚種の区別なし)'
+# --- ここまで ---
+
+TOTAL_LABEL = 'マグロ全体'
+FRESHNESS_LABELS = ['生鮮', '冷凍', '不明']
+# マグロ全体 → 魚種グループ → 鮮度状態 → 市場 → 魚種 の階層 (上位から順)
+MAGURO_HIERARCHY = ['魚種グループ', '鮮度状態', '市場名_正規化', '魚種（商品名）']
+ROLLUP_LEVEL_COL = '集計レベル'
+ROLLUP_QUANTILES = (0.25, 0.5, 0.75)
+
+def tag_maguro_hierarchy(df):
+    """
+    マグロ関連データに 魚種グループ・鮮度状態 の列 (カテゴリ型) を付けた DataFrame を返す関数。
+    魚種名の判定はユニークな魚種名ごとに1回だけ行い、行へは整数コードで配る。
+    鮮度状態は魚種名に '冷凍' があれば冷凍、'生鮮' があれば生鮮、どちらもなければ不明。
+    """
+    codes, uniques = pd.factorize(df['魚種（商品名）'])
+    names = pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype(str)
+    group_names = [group for group, _ in SPECIES_GROUP_RULES]
+    species_group = np.select([names.str.contains('|'.join(keywords), regex=True) for _, keywords in SPECIES_GROUP_RULES],
+                              group_names, default=OTHER_SPECIES_GROUP)
+    freshness = np.select([names.str.contains('冷凍'), names.str.contains('生鮮')], ['冷凍', '生鮮'], default='不明')
+    # 魚種名が欠損の行 (コード -1) は末尾に追加した 分類なし/不明 を参照する
+    species_group = np.append(species_group, OTHER_SPECIES_GROUP)[codes]
+    freshness = np.append(freshness, '不明')[codes]
+    return df.assign(**{
+        '魚種グループ': pd.Categorical(species_group, categories=group_names + [OTHER_SPECIES_GROUP]),
+        '鮮度状態': pd.Categorical(freshness, categories=FRESHNESS_LABELS),
+    })
+
+def hierarchy_grouping_sets(hierarchy=None):
+    """階層の上位からの部分列 ((), (魚種グループ,), (魚種グループ, 鮮度状態), ...) を返す (ROLLUP と同じ集計の組)。"""
+    hierarchy = list(MAGURO_HIERARCHY if hierarchy is None else hierarchy)
+    return [tuple(hierarchy[:depth]) for depth in range(len(hierarchy) + 1)]
+
+def _leaf_statistics(df, hierarchy, quantity_col, price_col, k):
+    """最下層のグループ (階層のすべての列の組) ごとの統計量とスケッチを、データを1回 groupby して求める。"""
+    grouped = df.groupby(hierarchy, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    df_leaf_keys = grouped.size().index.to_frame(index=False)
+
+    quantity = df[quantity_col].to_numpy(dtype='float64', na_value=np.nan)
+    price = df[price_col].to_numpy(dtype='float64', na_value=np.nan)
+    has_both = ~np.isnan(quantity) & ~np.isnan(price)
+    df_work = pd.DataFrame({
+        '_グループ': codes, '_数量': quantity, '_単価': price,
+        '_取引金額': np.where(has_both, price * quantity, np.nan), '_金額対象数量': np.where(has_both, quantity, np.nan),
+    })
+    df_work = df_work[codes >= 0] # キーが欠損の行 (groupby で除かれる行) は集計しない
+    df_stats = df_work.groupby('_グループ', sort=True).agg(
+        取引件数=('_数量', 'size'), 総取引数量_kg=('_数量', 'sum'),
+        _取引金額=('_取引金額', 'sum'), _金額対象数量=('_金額対象数量', 'sum'),
+        _単価件数=('_単価', 'count'), _単価平均=('_単価', 'mean'), _単価分散=('_単価', 'var'),
+        最安値_円perKg=('_単価', 'min'), 最高値_円perKg=('_単価', 'max'),
+    ).reindex(range(len(df_leaf_keys)))
+    # 分散は (件数 - 1) を掛けた偏差平方和にしておくと、上位のグループへそのまま足し合わせられる
+    df_stats['_単価偏差平方和'] = df_stats['_単価分散'].fillna(0.0) * (df_stats['_単価件数'] - 1).clip(lower=0)
+    df_leaf = pd.concat([df_leaf_keys, df_stats.drop(columns='_単価分散').reset_index(drop=True)], axis=1)
+
+    sketches = {}
+    for key, idx in grouped.indices.items():
+        sketch = KLLSketch(k=k).update(price[idx])
+        if sketch.n > 0: sketches[key if isinstance(key, tuple) else (key,)] = sketch
+    return df_leaf, sketches
+
+def merge_sketches_by(sketches, hierarchy, keys):
+    """最下層のスケッチ ({階層のキーのタプル: KLLSketch}) を keys の列の値ごとにマージする (keys が空なら全体で1つ)。"""
+    positions = [list(hierarchy).index(key) for key in keys]
+    merged = {}
+    for leaf_key, sketch in sketches.items():
+        key = tuple(leaf_key[position] for position in positions)
+        merged[key] = sketch if key not in merged else merged[key].merge(sketch)
+    return merged
+
+def maguro_rollup(df, grouping_sets=None, hierarchy=None, quantity_col='卸売数量_kg換算', price_col='単価_円perKg', k=200):
+    """
+    マグロ関連データの 取引件数・総取引数量・単価の統計量 を、階層のすべてのレベル
+    (マグロ全体 → 魚種グループ → 鮮度状態 → 市場 → 魚種) について一度に集計する関数 (SQL の GROUPING SETS に相当)。
+    データの走査は最下層のグループを求める1回だけで、上位のレベルは最下層の集計結果
+    (件数・合計・偏差平方和・最小/最大・分位点スケッチ) を足し合わせて求める。
+
+    Args:
+        df (pandas.DataFrame): extract_maguro_data の出力 (魚種グループ・鮮度状態 の列がなければ付ける)。
+        grouping_sets (list): 集計する列の組のリスト。None の場合は階層の上位からの部分列 (hierarchy_grouping_sets)。
+            階層の列であれば、('市場名_正規化',) のように階層をまたぐ組も指定できる。
+        hierarchy (list): 最下層のグループを決める列。None の場合は MAGURO_HIERARCHY。
+
+    Returns:
+        tuple: (集計表, 最下層のスケッチ)
+            集計表は 集計レベル・階層の列 (その組で集計しない列は NaN)・取引件数・総取引数量_kg・
+            加重平均単価_円perKg・単純平均単価_円perKg・単価標準偏差・最安値/最高値・単価の分位点。
+            最下層のスケッチは {階層のキーのタプル: KLLSketch} (merge_sketches_by で任意の組に集約できる)。
+    """
+    hierarchy = list(MAGURO_HIERARCHY if hierarchy is None else hierarchy)
+    grouping_sets = hierarchy_grouping_sets(hierarchy) if grouping_sets is None else [tuple(keys) for keys in grouping_sets]
+    unknown_cols = sorted({key for keys in grouping_sets for key in keys} - set(hierarchy))
+    if unknown_cols:
+        raise ValueError(f"grouping_sets の列が階層にありません: {unknown_cols}")
+    if df.empty:
+        return pd.DataFrame(), {}
+    if not {'魚種グループ', '鮮度状態'} <= set(df.columns):
+        df = tag_maguro_hierarchy(df)
+
+    df_leaf, sketches = _leaf_statistics(df, hierarchy, quantity_col, price_col, k)
+    df_leaf['_単価合計'] = df_leaf['_単価平均'].fillna(0.0) * df_leaf['_単価件数']
+    sum_cols = ['取引件数', '総取引数量_kg', '_取引金額', '_金額対象数量', '_単価件数', '_単価合計', '_単価偏差平方和']
+
+    tables = []
+    for keys in grouping_sets:
+        keys = list(keys)
+        group_labels = [df_leaf[key] for key in keys] if keys else [np.zeros(len(df_leaf), dtype='int64')]
+        grouped = df_leaf.groupby(group_labels, observed=True, sort=True)
+        df_level = grouped[sum_cols].sum()
+        df_level['最安値_円perKg'] = grouped['最安値_円perKg'].min()
+        df_level['最高値_円perKg'] = grouped['最高値_円perKg'].max()
+        # 偏差平方和の合成: 各グループの偏差平方和 + 件数 × (グループ平均 - 全体平均)^2
+        level_mean = grouped['_単価合計'].transform('sum') / grouped['_単価件数'].transform('sum').where(lambda n: n > 0)
+        between = (df_leaf['_単価件数'] * (df_leaf['_単価平均'] - level_mean) ** 2).fillna(0.0)
+        df_level['_単価偏差平方和'] += between.groupby(group_labels, observed=True, sort=True).sum().to_numpy()
+
+        price_count = df_level['_単価件数'].where(df_level['_単価件数'] > 0)
+        df_level['加重平均単価_円perKg'] = df_level['_取引金額'] / df_level['_金額対象数量'].where(df_level['_金額対象数量'] > 0)
+        df_level['単純平均単価_円perKg'] = df_level['_単価合計'] / price_count
+        df_level['単価標準偏差'] = np.sqrt(df_level['_単価偏差平方和'] / (price_count - 1).where(price_count > 1))
+
+        level_sketches = merge_sketches_by(sketches, hierarchy, keys)
+        index_keys = list(df_level.index) if keys else [()]
+        quantiles = np.array([
+            level_sketches[key if isinstance(key, tuple) else (key,)].quantiles(ROLLUP_QUANTILES)
+            if (key if isinstance(key, tuple) else (key,)) in level_sketches else np.full(len(ROLLUP_QUANTILES), np.nan)
+            for key in index_keys
+        ]).reshape(len(df_level), len(ROLLUP_QUANTILES))
+        for position, q in enumerate(ROLLUP_QUANTILES):
+            df_level[f'単価_q{q:g}'] = quantiles[:, position]
+
+        df_level = df_level.reset_index(drop=True)
+        for position, col in enumerate(hierarchy):
+            df_level.insert(position, col, [key[keys.index(col)] if isinstance(key, tuple) else key for key in index_keys]
+                            if col in keys else np.nan)
+        df_level.insert(0, ROLLUP_LEVEL_COL, '・'.join(keys) if keys else TOTAL_LABEL)
+        tables.append(df_level)
+
+    output_cols = [ROLLUP_LEVEL_COL] + hierarchy + [
+        '取引件数', '総取引数量_kg', '加重平均単価_円perKg', '単純平均単価_円perKg', '単価標準偏差',
+        '最安値_円perKg', '最高値_円perKg'] + [f'単価_q{q:g}' for q in ROLLUP_QUANTILES]
+    df_rollup = pd.concat(tables, ignore_index=True)[output_cols]
+    df_rollup['取引件数'] = df_rollup['取引件数'].astype('int64')
+    print(f"マグロの階層別集計: {len(df_rollup)} 行 ({len(grouping_sets)} 通りの集計, 最下層 {len(df_leaf)} グループ)")
+    return df_rollup, sketches
+
+def rollup_table(df_rollup, keys):
+    """maguro_rollup の集計表から、keys の組で集計した行だけを keys をインデックスにして返す。"""
+    keys = list(keys)
+    level = '・'.join(keys) if keys else TOTAL_LABEL
+    df_level = df_rollup[df_rollup[ROLLUP_LEVEL_COL] == level]
+    # 集計表の列は 集計レベル・階層の列・統計量 の順
+    hierarchy = list(df_rollup.columns[1:df_rollup.columns.get_loc('取引件数')])
+    df_level = df_level.drop(columns=[ROLLUP_LEVEL_COL] + [col for col in hierarchy if col not in keys])
+    return df_level.set_index(keys) if keys else df_level.reset_index(drop=True)
+
+if __name__ == '__main__':
+    print("maguro_rollup.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    n_rows = 300000
+    df_test = pd.DataFrame({
+        '市場名_正規化': rng.choice(['東京中央', '札幌', '大阪（本場）'], n_rows),
+        '魚種（商品名）': rng.choice(['まぐろ（生鮮）', 'まぐろ（冷凍）', 'めばち（冷凍）', 'めばち', '本まぐろ', 'くろまぐろ', 'きわだ', None], n_rows),
+        '単価_円perKg': rng.lognormal(7.5, 0.6, n_rows),
+        '卸売数量_kg換算': rng.lognormal(4, 1, n_rows),
+    })
+    df_test.loc[rng.random(n_rows) < 0.05, '単価_円perKg'] = np.nan
+    df_rollup, leaf_sketches = maguro_rollup(df_test, grouping_sets=hierarchy_grouping_sets() + [('市場名_正規化',), ('魚種（商品名）',)])
+    print(rollup_table(df_rollup, ['魚種グループ', '鮮度状態']).round(1).to_string())
+
+    # 各レベルの値が、行データを直接 groupby した結果と一致することを確認する
+    df_tagged = tag_maguro_hierarchy(df_test).dropna(subset=['魚種（商品名）'])
+    for keys in [['魚種グループ'], ['魚種グループ', '鮮度状態'], ['市場名_正規化'], ['魚種（商品名）']]:
+        df_expected = df_tagged.groupby(keys, observed=True)['単価_円perKg'].agg(['size', 'mean', 'std', 'min', 'max'])
+        df_actual = rollup_table(df_rollup, keys).loc[df_expected.index]
+        for expected_col, actual_col in [('size', '取引件数'), ('mean', '単純平均単価_円perKg'), ('std', '単価標準偏差'),
+                                          ('min', '最安値_円perKg'), ('max', '最高値_円perKg')]:
+            np.testing.assert_allclose(df_actual[actual_col].to_numpy(dtype='float64'), df_expected[expected_col].to_numpy(dtype='float64'), rtol=1e-9)
+    df_total = rollup_table(df_rollup, [])
+    assert df_total['取引件数'].iloc[0] == len(df_tagged)
+    print("\n直接 groupby した結果と一致することを確認しました。")
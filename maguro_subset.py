@@ -0,0 +1,47 @@
+# maguro_subset.py
+
+import pandas as pd
+import numpy as np
+
+from lineage import data_columns
+from profiling import profiled
+
+MAGURO_BASE_KEYWORDS = [
+    'まぐろ', 'きわだ', 'きはだ', 'めばち', 'いんど', 'みなみ',
+    'まかじき', 'めかじき', 'びんちょう', 'びんなが', '本まぐろ', 'くろまぐろ'
+]
+SENDO_KEYWORDS = ['生鮮', '冷凍']
+SAPPORO_MAIN_MAGURO_NAMES = ['本まぐろ', 'めばち']
+OSAKA_MAIN_MAGURO_NAMES = ['くろまぐろ', 'きわだ']
+
+# (?:...) にすると str.contains の「match groups」警告が出ない (一致する行は同じ)
+pattern_sendo = rf"(?:{'|'.join(SENDO_KEYWORDS)})"
+pattern_maguro = rf"(?:{'|'.join(MAGURO_BASE_KEYWORDS)})"
+
+@profiled()
+def extract_maguro_data(df_cleaned):
+    """
+    前処理済みデータから「マグロ」関連データを抽出する関数 (アプローチ1: 鮮度明確＋札幌・大阪特有)。
+    analytics_maguro.py / verify_sapporo_data.py で3つの部分集合を作って結合していた処理と同じ結果を、
+    魚種名の判定を1回ずつ行うだけで返す (行の順序も、鮮度明確 → 札幌 → 大阪 の順で同じ)。
+
+    Returns:
+        pandas.DataFrame: マグロ関連データ (インデックスは0からの連番)。
+    """
+    if df_cleaned.empty or '魚種（商品名）' not in df_cleaned.columns:
+        return pd.DataFrame()
+    species = df_cleaned['魚種（商品名）'].fillna('')
+    has_sendo = species.str.contains(pattern_sendo, case=False, na=False)
+    is_sendo_clear = has_sendo & species.str.contains(pattern_maguro, case=False, na=False)
+    market = df_cleaned['市場名_正規化']
+    is_sapporo_specific = (market == '札幌') & df_cleaned['魚種（商品名）'].isin(SAPPORO_MAIN_MAGURO_NAMES) & ~has_sendo
+    is_osaka_specific = (market == '大阪（本場）') & df_cleaned['魚種（商品名）'].isin(OSAKA_MAIN_MAGURO_NAMES) & ~has_sendo
+    print(f"抽出された鮮度が明確なマグロ関連データの行数: {is_sendo_clear.sum()}")
+    print(f"抽出された札幌市場特有マグロ行数: {is_sapporo_specific.sum()}")
+    print(f"抽出された大阪市場特有マグロ行数: {is_osaka_specific.sum()}")
+
+    # 3つの条件は互いに重ならないため、条件の番号で安定ソートすれば部分集合を順に結合したのと同じ並びになる
+    subset_order = np.select([is_sendo_clear, is_sapporo_specific, is_osaka_specific], [0, 1, 2], default=-1)
+    positions = np.flatnonzero(subset_order >= 0)
+    df_maguro = df_cleaned.iloc[positions[subset_order[positions].argsort(kind='stable')]]
+    return df_maguro.drop_duplicates(subset=data_columns(df_maguro)).reset_index(drop=True)
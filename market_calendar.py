@@ -0,0 +1,363 @@
+# market_calendar.py
+
+import copy
+from datetime import date, timedelta
+
+import pandas as pd
+import numpy as np
+
+from price_aggregation import aggregate_market_prices
+
+# --- 設定 ---
+CALENDAR_START_YEAR = 2010  # 営業日の索引を作る範囲 (範囲外の日付を使うと自動で広げる)
+CALENDAR_END_YEAR = 2030
+# --- ここまで ---
+
+TRADING_DAY_COL = '営業日'       # その日が市場の営業日か (休市日の取引は False)
+TRADING_DAY_NUMBER_COL = '営業日番号'  # 市場の営業日の通し番号 (休市日は -1)。差がそのまま営業日数になる
+
+def _nth_weekday(year, month, weekday, n):
+    """year 年 month 月の第 n weekday (0=月曜) の日付。"""
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+def _vernal_equinox_day(year):
+    return int(20.8431 + 0.242194 * (year - 1980) - (year - 1980) // 4)
+
+def _autumnal_equinox_day(year):
+    return int(23.2488 + 0.242194 * (year - 1980) - (year - 1980) // 4)
+
+def _holidays_of_year(year):
+    """振替休日・国民の休日を除く year 年の祝日 (日付 -> 名称)。2000年以降の祝日法に従う。"""
+    holidays = {
+        date(year, 1, 1): '元日',
+        _nth_weekday(year, 1, 0, 2): '成人の日',
+        date(year, 2, 11): '建国記念の日',
+        date(year, 3, _vernal_equinox_day(year)): '春分の日',
+        date(year, 4, 29): '昭和の日' if year >= 2007 else 'みどりの日',
+        date(year, 5, 3): '憲法記念日',
+        date(year, 5, 5): 'こどもの日',
+        _nth_weekday(year, 9, 0, 3): '敬老の日',
+        date(year, 9, _autumnal_equinox_day(year)): '秋分の日',
+        date(year, 11, 3): '文化の日',
+        date(year, 11, 23): '勤労感謝の日',
+    }
+    if year >= 2007: holidays[date(year, 5, 4)] = 'みどりの日'
+    if year <= 2018: holidays[date(year, 12, 23)] = '天皇誕生日'
+    if year >= 2020: holidays[date(year, 2, 23)] = '天皇誕生日'
+    # 東京オリンピック・パラリンピックの年は海の日・山の日・スポーツの日が移動した
+    moved = {2020: (date(2020, 7, 23), date(2020, 8, 10), date(2020, 7, 24)),
+             2021: (date(2021, 7, 22), date(2021, 8, 8), date(2021, 7, 23))}
+    if year in moved:
+        sea_day, mountain_day, sports_day = moved[year]
+    else:
+        sea_day = _nth_weekday(year, 7, 0, 3)
+        mountain_day = date(year, 8, 11) if year >= 2016 else None
+        sports_day = _nth_weekday(year, 10, 0, 2)
+    holidays[sea_day] = '海の日'
+    if mountain_day is not None: holidays[mountain_day] = '山の日'
+    holidays[sports_day] = 'スポーツの日' if year >= 2020 else '体育の日'
+    if year == 2019:
+        holidays[date(2019, 5, 1)] = '天皇の即位の日'
+        holidays[date(2019, 10, 22)] = '即位礼正殿の儀の行われる日'
+    return holidays
+
+def japanese_holidays(start_year, end_year):
+    """
+    start_year〜end_year 年の日本の祝日 (振替休日・国民の休日を含む) を返す関数。
+
+    Returns:
+        pandas.Series: 祝日の名称 (インデックスは日付、昇順)。
+    """
+    holidays = {}
+    for year in range(start_year, end_year + 1):
+        holidays.update(_holidays_of_year(year))
+    for day in sorted(holidays):
+        # 国民の休日: 前日と翌日が祝日の平日
+        between = day + timedelta(days=2)
+        if between in holidays and day + timedelta(days=1) not in holidays and (day + timedelta(days=1)).weekday() != 6:
+            holidays[day + timedelta(days=1)] = '国民の休日'
+    for day in sorted(holidays):
+        # 振替休日: 日曜の祝日の後の最初の祝日でない日
+        if day.weekday() == 6:
+            substitute = day + timedelta(days=1)
+            while substitute in holidays: substitute += timedelta(days=1)
+            holidays[substitute] = '振替休日'
+    return pd.Series(list(holidays.values()), index=pd.DatetimeIndex(list(holidays)), dtype='object').sort_index()
+
+class MarketCalendar:
+    """
+    1つの市場の営業日の定義と、その営業日の索引 (作成後はキャッシュして使い回す)。
+
+    Args:
+        name (str): 市場名_正規化 (例: '東京中央')。
+        closed_weekdays (tuple): 定休の曜日 (0=月曜 … 6=日曜)。
+        closed_on_holidays (bool): 祝日を休市日にするか。
+        year_end_closed (tuple): 年末年始の休市期間 ((開始の月, 日), (終了の月, 日))。None の場合はなし。
+        extra_closed_dates (list): 臨時の休市日 (水曜の休開市日など)。
+        extra_open_dates (list): 祝日・定休日の臨時開市日。
+    """
+
+    def __init__(self, name, closed_weekdays=(6,), closed_on_holidays=True, year_end_closed=((12, 31), (1, 4)),
+                 extra_closed_dates=(), extra_open_dates=()):
+        self.name = name
+        self.closed_weekdays = tuple(closed_weekdays)
+        self.closed_on_holidays = closed_on_holidays
+        self.year_end_closed = year_end_closed
+        self.extra_closed_dates = pd.DatetimeIndex(list(extra_closed_dates)).normalize()
+        self.extra_open_dates = pd.DatetimeIndex(list(extra_open_dates)).normalize()
+        self._days = None
+        self._years = None
+
+    def with_name(self, name):
+        """同じ規則で名前だけを変えた暦を返す (索引は作り直す)。"""
+        market_calendar = copy.copy(self)
+        market_calendar.name = name
+        market_calendar._days = None
+        market_calendar._years = None
+        return market_calendar
+
+    def _build(self, start_year, end_year):
+        days = pd.date_range(f'{start_year}-01-01', f'{end_year}-12-31', freq='D')
+        closed = np.isin(days.dayofweek, self.closed_weekdays)
+        if self.closed_on_holidays:
+            closed |= days.isin(japanese_holidays(start_year, end_year).index)
+        if self.year_end_closed is not None:
+            (start_month, start_day), (end_month, end_day) = self.year_end_closed
+            month_day = days.month * 100 + days.day
+            closed |= (month_day >= start_month * 100 + start_day) | (month_day <= end_month * 100 + end_day)
+        closed |= days.isin(self.extra_closed_dates)
+        closed &= ~days.isin(self.extra_open_dates)
+        self._days = days[~closed]
+        self._years = (start_year, end_year)
+
+    def _ensure_years(self, start_year, end_year):
+        if self._years is None or start_year < self._years[0] or end_year > self._years[1]:
+            current = self._years or (CALENDAR_START_YEAR, CALENDAR_END_YEAR)
+            self._build(min(start_year, current[0]), max(end_year, current[1]))
+
+    def trading_days(self, start=None, end=None):
+        """start〜end (両端を含む) の営業日の DatetimeIndex。省略時は索引の全範囲。"""
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        self._ensure_years(start.year if start is not None else CALENDAR_START_YEAR,
+                           end.year if end is not None else CALENDAR_END_YEAR)
+        lo = 0 if start is None else self._days.searchsorted(start.normalize(), side='left')
+        hi = len(self._days) if end is None else self._days.searchsorted(end.normalize(), side='right')
+        return self._days[lo:hi]
+
+    def trading_day_numbers(self, dates):
+        """
+        日付ごとの営業日番号 (索引の先頭からの通し番号) を返す。休市日・欠損は -1。
+        2つの日付の番号の差が、その間の営業日数になる (休市日を数えない日数)。
+        """
+        dates = pd.DatetimeIndex(dates).normalize()
+        valid = dates[dates.notna()]
+        if len(valid):
+            self._ensure_years(valid.min().year, valid.max().year)
+        positions = self._days.searchsorted(dates)
+        in_range = positions < len(self._days)
+        numbers = np.full(len(dates), -1, dtype='int64')
+        hit = in_range & dates.notna()
+        hit[hit] = self._days[positions[hit]] == dates[hit]
+        numbers[hit] = positions[hit]
+        return numbers
+
+    def is_trading_day(self, dates):
+        return self.trading_day_numbers(dates) >= 0
+
+_CALENDARS = {}
+DEFAULT_CALENDAR = MarketCalendar('既定')
+
+def register_market_calendar(market_calendar):
+    """市場の暦を登録する (同じ市場名の登録は置き換える)。"""
+    _CALENDARS[market_calendar.name] = market_calendar
+    return market_calendar
+
+def get_market_calendar(market=None):
+    """市場名_正規化 の暦を返す (登録のない市場は既定の暦: 日曜・祝日・12/31〜1/4 休市)。"""
+    return _CALENDARS.get(market, DEFAULT_CALENDAR)
+
+def find_missing_trading_days(dates, market=None, start=None, end=None):
+    """
+    取引 (または日報) のあった日付と市場の営業日を比べ、データのない営業日を返す関数。
+    start/end を省略した場合は、dates の最初の日〜最後の日の範囲で調べる。
+
+    Returns:
+        pandas.DatetimeIndex: データのない営業日 (昇順)。
+    """
+    observed = pd.DatetimeIndex(pd.Series(dates).dropna().unique()).normalize()
+    if start is None and end is None and len(observed) == 0:
+        return pd.DatetimeIndex([])
+    days = get_market_calendar(market).trading_days(observed.min() if start is None else start,
+                                                   observed.max() if end is None else end)
+    return days[~days.isin(observed)]
+
+def _series_trading_days(days, first, last):
+    """
+    営業日の配列 days から、系列ごとの期間 [first, last] の営業日をまとめて取り出す (ループなし)。
+
+    Returns:
+        tuple: (系列の番号の配列, 営業日番号の配列)
+    """
+    lo = days.searchsorted(first, side='left')
+    hi = days.searchsorted(last, side='right')
+    lengths = np.maximum(hi - lo, 0)
+    series = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return series, np.repeat(lo, lengths) + offsets
+
+def align_to_trading_days(df_daily, key_cols, date_col='日付', market_col='市場名_正規化', market=None,
+                          start=None, end=None):
+    """
+    日次の系列 (aggregate_market_prices(freq='D') の出力など) を、市場の営業日にそろえる関数。
+    系列ごとに最初の日〜最後の日 (start/end 指定時はその範囲) のすべての営業日の行を持つ表にし、
+    データのない営業日は値が NaN の行になる。休市日のデータは残し、営業日=False を付ける。
+
+    Args:
+        key_cols (list): 系列のキー (市場名_正規化 を含む場合は市場ごとの暦を使う)。
+        market (str): key_cols に市場の列がない場合に使う暦の市場名。
+
+    Returns:
+        pandas.DataFrame: key_cols・日付・営業日・営業日番号 と df_daily の値の列 (キー・日付の順に並ぶ)。
+    """
+    key_cols = list(key_cols)
+    df_daily = df_daily[df_daily[date_col].notna()]
+    if df_daily.empty:
+        return df_daily.assign(**{TRADING_DAY_COL: pd.Series(dtype='bool'), TRADING_DAY_NUMBER_COL: pd.Series(dtype='int64')})
+    dates = df_daily[date_col].dt.normalize()
+    if key_cols:
+        grouped = df_daily.groupby(key_cols, observed=True, sort=False, dropna=False)
+        series_codes = grouped.ngroup().to_numpy()
+        df_keys = grouped.size().index.to_frame(index=False) # ngroup の番号順 (出現順) のキー
+    else:
+        series_codes, df_keys = np.zeros(len(df_daily), dtype='int64'), pd.DataFrame(index=[0])
+    first = dates.groupby(series_codes).min().to_numpy() if start is None else np.full(len(df_keys), pd.Timestamp(start).to_datetime64())
+    last = dates.groupby(series_codes).max().to_numpy() if end is None else np.full(len(df_keys), pd.Timestamp(end).to_datetime64())
+    first, last = pd.DatetimeIndex(first), pd.DatetimeIndex(last)
+    markets = df_keys[market_col].astype('object').to_numpy() if market_col in key_cols else np.full(len(df_keys), market, dtype='object')
+
+    frames = []
+    for market_name in pd.unique(markets):
+        # 市場ごとに営業日の索引を1回だけ引き、その市場のすべての系列の営業日を一括で作る
+        in_market = np.flatnonzero(markets == market_name)
+        market_calendar = get_market_calendar(market_name)
+        days = market_calendar.trading_days(first[in_market].min(), last[in_market].max())
+        series, positions = _series_trading_days(days, first[in_market], last[in_market])
+        frames.append(pd.DataFrame({'_系列': in_market[series], date_col: days[positions]}))
+    df_grid = pd.concat(frames, ignore_index=True)
+
+    df_values = df_daily.drop(columns=key_cols + [date_col]).assign(_系列=series_codes, **{date_col: dates.to_numpy()})
+    df_aligned = df_grid.merge(df_values, on=['_系列', date_col], how='outer', sort=False)
+    df_aligned = df_aligned.sort_values(['_系列', date_col], kind='stable', ignore_index=True)
+    codes = df_aligned['_系列'].to_numpy()
+    for col in key_cols:
+        df_aligned[col] = df_keys[col].iloc[codes].reset_index(drop=True) # category 型などの型を保つ
+    aligned_markets = markets[codes]
+    numbers = np.full(len(df_aligned), -1, dtype='int64')
+    for market_name in pd.unique(aligned_markets):
+        in_market = aligned_markets == market_name
+        numbers[in_market] = get_market_calendar(market_name).trading_day_numbers(df_aligned.loc[in_market, date_col])
+    df_aligned[TRADING_DAY_COL] = numbers >= 0
+    df_aligned[TRADING_DAY_NUMBER_COL] = numbers
+    value_cols = [col for col in df_values.columns if col not in ('_系列', date_col)]
+    return df_aligned[key_cols + [date_col, TRADING_DAY_COL, TRADING_DAY_NUMBER_COL] + value_cols]
+
+def aggregate_trading_day_prices(df, group_keys=None, date_col='日付', price_col='単価_円perKg',
+                                 quantity_col='卸売数量_kg換算', market=None):
+    """
+    前処理済みデータを日次で集計し (aggregate_market_prices と同じ集計)、市場の営業日にそろえる関数。
+    取引のない営業日は 取引件数=0・単価が NaN の行になり、休市日は行を作らない
+    (休市日に取引がある場合はその行を 営業日=False で残す)。
+
+    Returns:
+        pandas.DataFrame: align_to_trading_days の出力。
+    """
+    group_keys = ['市場名_正規化', '魚種（商品名）'] if group_keys is None else list(group_keys)
+    df_daily = aggregate_market_prices(df, freq='D', group_keys=group_keys, date_col=date_col,
+                                       price_col=price_col, quantity_col=quantity_col)
+    if df_daily.empty: return df_daily
+    # aggregate_market_prices は全体1系列の場合に取引のない日の行も作るため、取引のある日だけにしてからそろえる
+    df_daily = df_daily[df_daily['取引件数'] > 0]
+    df_aligned = align_to_trading_days(df_daily, group_keys, date_col=date_col, market=market)
+    df_aligned['取引件数'] = df_aligned['取引件数'].fillna(0).astype('int64')
+    df_aligned['総取引数量_kg'] = df_aligned['総取引数量_kg'].fillna(0.0)
+    return df_aligned
+
+def trading_day_gaps(df_aligned, key_cols, value_col='取引件数'):
+    """
+    align_to_trading_days の出力から、データのない営業日 (value_col が NaN または 0) を取り出す関数。
+    連続する欠けは1行にまとめ、欠けた営業日数を付ける。
+
+    Returns:
+        pandas.DataFrame: key_cols・開始日・終了日・欠けた営業日数。
+    """
+    key_cols = list(key_cols)
+    df_open = df_aligned[df_aligned[TRADING_DAY_COL]]
+    missing = (df_open[value_col].isna() | (df_open[value_col] == 0)).to_numpy()
+    if not missing.any():
+        return pd.DataFrame(columns=key_cols + ['開始日', '終了日', '欠けた営業日数'])
+    df_missing = df_open[missing]
+    numbers = df_missing[TRADING_DAY_NUMBER_COL].to_numpy()
+    # 営業日番号が1つ飛び以上、または系列が変わったところで新しい欠けの区間にする
+    same_series = np.ones(len(df_missing), dtype='bool')
+    for col in key_cols:
+        values = df_missing[col].to_numpy()
+        same_series[1:] &= values[1:] == values[:-1]
+    same_series[0] = False
+    new_run = ~same_series | (np.diff(numbers, prepend=numbers[0] - 2) != 1)
+    run_id = np.cumsum(new_run)
+    return (df_missing.assign(_区間=run_id)
+            .groupby('_区間', sort=False)
+            .agg(**{col: (col, 'first') for col in key_cols},
+                 開始日=('日付', 'first'), 終了日=('日付', 'last'), 欠けた営業日数=('日付', 'size'))
+            .reset_index(drop=True))
+
+def rolling_trading_days(df_aligned, key_cols, value_col='加重平均単価_円perKg', window=20, min_periods=None):
+    """
+    営業日にそろえた系列の移動平均・移動標準偏差・有効件数を、系列ごとに window 営業日のウィンドウで計算する関数。
+    ウィンドウは常に window 営業日 (休市日を数えず、データのない営業日も1日として数える) になる。
+
+    Returns:
+        pandas.DataFrame: df_aligned の営業日の行に {window}営業日平均・{window}営業日標準偏差・{window}営業日件数 を加えた表。
+    """
+    min_periods = max(window // 2, 1) if min_periods is None else min_periods
+    df_open = df_aligned[df_aligned[TRADING_DAY_COL]].reset_index(drop=True)
+    grouped = df_open.groupby(list(key_cols), observed=True, sort=False)[value_col] if key_cols else df_open[value_col]
+    rolling = grouped.rolling(window, min_periods=min_periods)
+    # groupby().rolling() の結果はキーが先頭のインデックスになるため、元の行番号で並べ直す
+    def restore(result):
+        return result.reset_index(level=list(range(len(key_cols))), drop=True).sort_index() if key_cols else result
+    df_open[f'{window}営業日平均'] = restore(rolling.mean())
+    df_open[f'{window}営業日標準偏差'] = restore(rolling.std())
+    df_open[f'{window}営業日件数'] = restore(grouped.rolling(window, min_periods=0).count()).astype('int64')
+    return df_open
+
+# --- 標準の市場 (水曜の休開市日などは extra_closed_dates、臨時開市は extra_open_dates で追加する) ---
+for _market_name in ['東京中央', '足立', '大田', '札幌', '大阪（本場）']:
+    register_market_calendar(MarketCalendar(_market_name))
+
+if __name__ == '__main__':
+    print("market_calendar.py を直接実行しています（テストモード）")
+    holidays_2019 = japanese_holidays(2019, 2019)
+    print(holidays_2019['2019-04-27':'2019-05-07'])
+    expected = ['2019-04-29', '2019-04-30', '2019-05-01', '2019-05-02', '2019-05-03', '2019-05-04', '2019-05-05', '2019-05-06']
+    assert list(holidays_2019['2019-04-27':'2019-05-07'].index.strftime('%Y-%m-%d')) == expected
+    print(f"2015年〜2024年の祝日: {len(japanese_holidays(2015, 2024))} 日")
+
+    tokyo = get_market_calendar('東京中央')
+    print(f"東京中央 2024年1月の営業日: {len(tokyo.trading_days('2024-01-01', '2024-01-31'))} 日 (先頭: {tokyo.trading_days('2024-01-01', '2024-01-31')[0].date()})")
+    rng = np.random.default_rng(0)
+    open_days = tokyo.trading_days('2024-01-01', '2024-03-31')
+    observed = open_days.delete([5, 6, 20])  # 3営業日分の日報が欠けた例
+    df_test = pd.DataFrame({
+        '日付': np.repeat(observed, 2), '市場名_正規化': '東京中央',
+        '魚種（商品名）': np.tile(['まぐろ（生鮮）', 'さば'], len(observed)),
+        '単価_円perKg': rng.gamma(5.0, 600.0, len(observed) * 2), '卸売数量_kg換算': rng.gamma(2.0, 100.0, len(observed) * 2),
+    })
+    df_test.loc[len(df_test)] = [pd.Timestamp('2024-02-11'), '東京中央', 'さば', 500.0, 10.0]  # 休市日 (日曜・祝日) の取引
+    print("データのない営業日:", list(find_missing_trading_days(df_test['日付'], '東京中央').strftime('%m-%d')))
+    df_aligned = aggregate_trading_day_prices(df_test)
+    print(df_aligned[~df_aligned[TRADING_DAY_COL]])
+    print(trading_day_gaps(df_aligned, ['市場名_正規化', '魚種（商品名）']))
+    print(rolling_trading_days(df_aligned, ['市場名_正規化', '魚種（商品名）'], window=5).head(8))
@@ -0,0 +1,176 @@
+# market_query.py
+
+import argparse
+import glob
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from osaka_store import DEFAULT_STORE_PATH, read_report_partitions, to_typed_report_frame
+
+# --- 設定 ---
+DEFAULT_DB_PATH = 'market_data.sqlite'
+tokyo_file_paths = ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv']
+sapporo_file_path = 'Sapporo2014_2025.csv'
+osaka_file_path = 'Osaka2014_2025.csv'
+osaka_report_folder_path = './04_大阪市場日報データ（水産）'
+# --- ここまで ---
+
+MARKET_TABLE = 'market_data'
+OSAKA_TABLE = 'osaka_reports'
+
+# テーブルごとに作成するインデックス (日付・市場・魚種での絞り込みと集計用)
+TABLE_INDEXES = {
+    MARKET_TABLE: [
+        ['日付'], ['市場名_正規化'], ['魚種（商品名）'],
+        ['市場名_正規化', '魚種（商品名）', '日付'],
+    ],
+    OSAKA_TABLE: [['日付'], ['品目'], ['元ファイル']],
+}
+
+# よく使う集計の例 (CLI の example サブコマンドで実行できる)
+EXAMPLE_QUERIES = {
+    'monthly_counts': (
+        "指定月の市場別件数",
+        """SELECT "市場名_正規化", COUNT(*) AS 件数 FROM market_data
+           WHERE "日付" >= :start AND "日付" < :end
+           GROUP BY "市場名_正規化" ORDER BY 件数 DESC""",
+        {'start': '2023-05-01', 'end': '2023-06-01'},
+    ),
+    'sapporo_ton_tuna_share': (
+        "札幌のトン単位行に占めるマグロ類の割合",
+        """SELECT SUM(CASE WHEN "魚種（商品名）" LIKE '%まぐろ%' OR "魚種（商品名）" LIKE '%めばち%' THEN 1 ELSE 0 END) * 1.0
+                  / COUNT(*) AS マグロ割合, COUNT(*) AS トン単位行数
+           FROM market_data
+           WHERE "市場名_正規化" = '札幌' AND lower("数量単位（トン、箱、尾など）") IN ('トン', 't')""",
+        {},
+    ),
+    'top_species_kg': (
+        "総取引数量(kg)上位10魚種",
+        """SELECT "魚種（商品名）", SUM("卸売数量_kg換算") AS 総取引数量_kg FROM market_data
+           GROUP BY "魚種（商品名）" ORDER BY 総取引数量_kg DESC LIMIT 10""",
+        {},
+    ),
+}
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _to_sql_frame(df):
+    df_out = df.copy()
+    for col in df_out.columns:
+        if pd.api.types.is_datetime64_any_dtype(df_out[col]):
+            # ISO形式の文字列にすると、文字列比較がそのまま日付比較になる
+            df_out[col] = df_out[col].dt.strftime('%Y-%m-%d')
+    return df_out
+
+def _write_table(conn, df, table_name, chunksize=50000):
+    """DataFrame をテーブルとして書き込み (既存テーブルは置き換え)、インデックスを作成する。"""
+    df_out = _to_sql_frame(df)
+    df_out.to_sql(table_name, conn, if_exists='replace', index=False, chunksize=chunksize)
+    for i, index_cols in enumerate(TABLE_INDEXES.get(table_name, [])):
+        if not all(col in df_out.columns for col in index_cols): continue
+        index_name = f"idx_{table_name}_{i}"
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(index_name)} ON {_quote(table_name)} ({', '.join(_quote(c) for c in index_cols)})")
+    print(f"テーブル {table_name} を作成しました: {len(df_out)} 行")
+
+def build_market_database(df_cleaned, db_path=DEFAULT_DB_PATH, df_osaka_reports=None):
+    """
+    前処理済みデータ (と大阪日報の取り込み結果) を SQLite データベースに登録する関数。
+    日付・市場・魚種にインデックスを張るため、以降の集計は pandas での再読み込みなしにSQLで行える。
+
+    Args:
+        df_cleaned (pandas.DataFrame): preprocess_market_data の出力。
+        db_path (str): データベースファイルのパス。
+        df_osaka_reports (pandas.DataFrame): 大阪日報の取り込み結果 (main.py の出力を結合したもの)。任意。
+    """
+    start = time.perf_counter()
+    with sqlite3.connect(db_path) as conn:
+        _write_table(conn, df_cleaned, MARKET_TABLE)
+        if df_osaka_reports is not None and not df_osaka_reports.empty:
+            _write_table(conn, df_osaka_reports, OSAKA_TABLE)
+        conn.execute("ANALYZE")
+    print(f"データベースを作成しました: {db_path} ({time.perf_counter() - start:.1f} 秒)")
+
+def append_osaka_report(df_report, db_path=DEFAULT_DB_PATH):
+    """
+    1ファイル分の日報 (osaka_watcher の取り込み結果) を osaka_reports テーブルに追記する関数。
+    build_market_database と同じ型 (日付は ISO 形式、数量・価格は数値) にそろえ、
+    同じ元ファイルの行は置き換える (取り込み直しても行が重複しない)。
+    """
+    df_out = _to_sql_frame(to_typed_report_frame(df_report))
+    with sqlite3.connect(db_path) as conn:
+        table_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (OSAKA_TABLE,)).fetchone()
+        if table_exists and '元ファイル' in df_out.columns:
+            conn.execute(f"DELETE FROM {_quote(OSAKA_TABLE)} WHERE {_quote('元ファイル')} IN ({', '.join('?' * df_out['元ファイル'].nunique())})",
+                         [str(name) for name in df_out['元ファイル'].unique()])
+        # 削除と追記は同じトランザクション (追記に失敗した場合は削除も取り消される)
+        df_out.to_sql(OSAKA_TABLE, conn, if_exists='append', index=False)
+
+def load_osaka_report_csvs(folder_path=osaka_report_folder_path, store_path=DEFAULT_STORE_PATH):
+    """
+    大阪日報の取り込み結果を読み込む。年別の型付きファイル (osaka_store) があればそれを、
+    なければ年別CSV ({年}大阪.csv) を読み込んで結合する。
+    """
+    if os.path.isdir(store_path):
+        df_store = read_report_partitions(store_path)
+        if not df_store.empty:
+            print(f"大阪日報の年別ファイルを読み込みました ({len(df_store)} 行)。")
+            return df_store
+    csv_files = sorted(glob.glob(os.path.join(folder_path, '*年大阪*.csv')))
+    dfs = []
+    for file in csv_files:
+        try:
+            dfs.append(to_typed_report_frame(pd.read_csv(file, encoding='utf_8_sig')))
+        except Exception as e:
+            print(f"  -> エラー: {file} の読み込みに失敗しました - {e}")
+    if not dfs: return pd.DataFrame()
+    print(f"大阪日報CSVを {len(dfs)} ファイル読み込みました。")
+    return pd.concat(dfs, ignore_index=True)
+
+def query_market_data(sql, db_path=DEFAULT_DB_PATH, params=None):
+    """SQL を実行して結果を DataFrame で返す。"""
+    if not os.path.exists(db_path):
+        print(f"エラー: データベースが見つかりません - {db_path} (先に build を実行してください)")
+        return pd.DataFrame()
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query(sql, conn, params=params or {})
+
+def _run_and_print(sql, db_path, params=None):
+    start = time.perf_counter()
+    df_result = query_market_data(sql, db_path, params)
+    print(df_result.to_string(index=False))
+    print(f"\n({len(df_result)} 行, {(time.perf_counter() - start) * 1000:.1f} ms)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='市場データに対するSQLクエリ')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='データベースファイルのパス')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='CSVを読み込み前処理してデータベースを作成する')
+    sql_parser = subparsers.add_parser('sql', help='SQLを実行する')
+    sql_parser.add_argument('query', help='実行するSQL (列名は "日付" のようにダブルクォートで囲む)')
+    example_parser = subparsers.add_parser('example', help='集計例を実行する')
+    example_parser.add_argument('name', choices=sorted(EXAMPLE_QUERIES))
+    subparsers.add_parser('tables', help='テーブル一覧を表示する')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from dataframe_loader import load_and_combine_market_data
+        from data_preprocessor import preprocess_market_data
+        df_raw_combined = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path)
+        if df_raw_combined.empty: exit("データフレームの読み込み失敗")
+        df_cleaned = preprocess_market_data(df_raw_combined)
+        build_market_database(df_cleaned, args.db, load_osaka_report_csvs())
+    elif args.command == 'sql':
+        _run_and_print(args.query, args.db)
+    elif args.command == 'example':
+        description, sql, params = EXAMPLE_QUERIES[args.name]
+        print(f"--- {description} ---")
+        _run_and_print(sql, args.db, params)
+    elif args.command == 'tables':
+        _run_and_print("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name", args.db)
+
+if __name__ == '__main__':
+    main()
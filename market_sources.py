@@ -0,0 +1,166 @@
+# market_sources.py
+
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# 全市場で共通のデータ形式 (読み込み後はこの列順にそろえる)
+SHARED_COLUMNS = [
+    'ID', '日付', '市場名', '魚種（商品名）', '産地', '銘柄・規格（サイズ／グレード）', '販売方法',
+    '卸売数量', '数量単位（kg、箱、尾など）', '数量単位（トン、箱、尾など）',
+    '安値（円）', '中値（円）', '高値（円）', '平均価格（円）', '価格単位（円/kg、円/箱など）',
+    '備考（メモや特記事項など）', '卸売数量計',
+]
+
+class MarketSource:
+    """
+    1つの市場のデータソースの定義。
+
+    Args:
+        name (str): 市場の名前 (登録名、表示用)。
+        files (list): CSVファイルのパス (記載順に読み込んで結合する)。
+        encodings (tuple): 試す文字コード (読み込めるまで順に試す)。
+        column_mapping (dict): 元ファイルの列名 -> 共通形式の列名。
+        date_format (str): 日付列の書式 (例: '%Y/%m/%d')。None の場合は読み込み時には変換しない
+            (前処理のステップ0で自動判定して変換する)。
+        market_names (dict): 元データの市場名 -> 市場名_正規化 (前処理のステップ4で使う)。
+        default_market (str): 元ファイルに市場名がない (または空の) 行に設定する市場名。None の場合は設定しない。
+    """
+
+    def __init__(self, name, files, encodings=('utf-8', 'shift-jis'), column_mapping=None,
+                 date_format=None, market_names=None, default_market=None):
+        self.name = name
+        self.files = [files] if isinstance(files, str) else list(files)
+        self.encodings = tuple(encodings)
+        self.column_mapping = dict(column_mapping or {})
+        self.date_format = date_format
+        self.market_names = dict(market_names or {})
+        self.default_market = default_market
+
+    def with_files(self, files):
+        """ファイルだけを差し替えた定義を返す (登録済みの定義は変更しない)。"""
+        source = copy.copy(self)
+        source.files = [files] if isinstance(files, str) else list(files)
+        return source
+
+_REGISTRY = {}
+
+def register_market_source(source):
+    """
+    市場のデータソースを登録する。同じ名前の登録は置き換える。
+    市場名の正規化が他の市場の登録と矛盾する (同じ元の名前を別の名前にする) 場合は ValueError。
+    """
+    for other in _REGISTRY.values():
+        if other.name == source.name: continue
+        for raw_name, normalized in source.market_names.items():
+            if other.market_names.get(raw_name, normalized) != normalized:
+                raise ValueError(f"市場名 '{raw_name}' の正規化が {other.name} の登録と異なります: "
+                                 f"{other.market_names[raw_name]} / {normalized}")
+    _REGISTRY[source.name] = source
+    return source
+
+def get_market_sources(names=None):
+    """登録済みのデータソースを登録順に返す (names を指定した場合はその順)。"""
+    if names is None: return list(_REGISTRY.values())
+    return [_REGISTRY[name] for name in names]
+
+def get_market_source(name):
+    return _REGISTRY[name]
+
+def market_name_mapping(sources=None):
+    """全データソースの市場名の正規化を1つの対応表にまとめる (前処理のステップ4で使う)。"""
+    mapping = {}
+    for source in (get_market_sources() if sources is None else sources):
+        mapping.update(source.market_names)
+    return mapping
+
+def read_source_file(source, path):
+    """
+    データソースの1ファイルを読み込み、共通形式にそろえる。
+    共通形式の列は SHARED_COLUMNS の順に (元ファイルにない列は空欄で) 並べ、それ以外の列はその後ろに残す。
+
+    Returns:
+        tuple: (DataFrame または None, 表示用メッセージ)。
+    """
+    df = None
+    for encoding in source.encodings:
+        try:
+            df = pd.read_csv(path, encoding=encoding, low_memory=False)
+            message = f"正常に読み込みました: {path} ({encoding})"
+            break
+        except UnicodeDecodeError:
+            continue
+        except FileNotFoundError:
+            return None, f"エラー: ファイルが見つかりません - {path}"
+        except Exception as e:
+            return None, f"ファイルの読み込みに失敗しました ({path}): {e}"
+    if df is None:
+        return None, f"ファイルの読み込みに失敗しました ({path}): 文字コード {', '.join(source.encodings)} で読めません"
+
+    if source.column_mapping:
+        df = df.rename(columns=source.column_mapping)
+    # 共通形式にない列は除外せず、共通形式の列の後ろに元の順で残す (従来の読み込みと同じく結合時に他の市場では空欄)
+    extra_columns = [col for col in df.columns if col not in SHARED_COLUMNS]
+    if extra_columns:
+        message += f" (共通形式にない列: {extra_columns})"
+    df = df.reindex(columns=SHARED_COLUMNS + extra_columns)
+    if source.date_format is not None:
+        df['日付'] = pd.to_datetime(df['日付'], format=source.date_format, errors='coerce')
+    if source.default_market is not None:
+        df['市場名'] = df['市場名'].fillna(source.default_market)
+    return df, message
+
+def read_market_sources(sources=None, max_workers=None):
+    """
+    データソースのファイルをスレッドプールで並行して読み込む。
+    結果はデータソース・ファイルの登録順に並べて返す (読み込みの完了順には依存しない)。
+
+    Returns:
+        list: (データソース, パス, DataFrame または None, メッセージ) のリスト。
+    """
+    sources = get_market_sources() if sources is None else list(sources)
+    jobs = [(source, path) for source in sources for path in source.files]
+    if not jobs: return []
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda job: read_source_file(*job), jobs))
+    return [(source, path, df, message) for (source, path), (df, message) in zip(jobs, results)]
+
+# --- 標準の市場 (新しい市場は register_market_source で追加する) ---
+register_market_source(MarketSource(
+    '東京', ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv'],
+    # 築地・豊洲は同じ東京中央卸売市場として扱う
+    market_names={
+        '水産・築地': '東京中央', '水産・豊洲': '東京中央', '築地': '東京中央', '豊洲': '東京中央',
+        '水産・足立': '足立', '水産・大田': '大田',
+    },
+))
+register_market_source(MarketSource('札幌', ['Sapporo2014_2025.csv']))
+register_market_source(MarketSource(
+    '大阪', ['Osaka2014_2025.csv'],
+    market_names={'大阪市中央卸売市場本場': '大阪（本場）', '大阪': '大阪（本場）'},
+))
+
+if __name__ == '__main__':
+    print("market_sources.py を直接実行しています（テストモード）")
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 列名・日付の書式・文字コードが異なる市場を追加する例
+        nagoya_path = os.path.join(tmp_dir, 'Nagoya2020_2025.csv')
+        pd.DataFrame({
+            '取引日': ['2024/01/05', '2024/01/06'], '品名': ['まぐろ（生鮮）', 'さば'],
+            '数量': [120.0, 300.0], '単位': ['kg', 'kg'], '中値': [4200, 600], '価格単位': ['円/kg', '円/kg'],
+        }).to_csv(nagoya_path, index=False, encoding='shift-jis')
+        nagoya = register_market_source(MarketSource(
+            '名古屋', [nagoya_path], encodings=('shift-jis',),
+            column_mapping={'取引日': '日付', '品名': '魚種（商品名）', '数量': '卸売数量',
+                            '単位': '数量単位（kg、箱、尾など）', '中値': '中値（円）',
+                            '価格単位': '価格単位（円/kg、円/箱など）'},
+            date_format='%Y/%m/%d', default_market='名古屋', market_names={'名古屋': '名古屋（本場）'},
+        ))
+        for source, path, df_source, message in read_market_sources([nagoya]):
+            print(message)
+            print(df_source[['日付', '市場名', '魚種（商品名）', '卸売数量', '中値（円）']])
+        print("市場名の対応表:", market_name_mapping())
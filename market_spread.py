@@ -0,0 +1,242 @@
+# market_spread.py
+
+import itertools
+import time
+
+import pandas as pd
+import numpy as np
+
+from price_aggregation import aggregate_market_prices
+
+DEFAULT_SPREAD_MARKETS = ['東京中央', '大阪（本場）', '札幌']
+
+class PriceCube:
+    """
+    市場・魚種別の日次加重平均単価を、日付 × 市場 × 魚種 の密な配列に並べたもの。
+    日付軸はいずれかの市場で取引のあった日 (休市日は含まない)、取引のない箇所は NaN。
+    """
+
+    def __init__(self, prices, dates, markets, species):
+        self.prices = prices
+        self.dates = dates
+        self.markets = list(markets)
+        self.species = list(species)
+
+    @property
+    def market_pairs(self):
+        """市場の組 (i, j) の一覧 (i < j)。"""
+        return list(itertools.combinations(range(len(self.markets)), 2))
+
+    def pair_labels(self):
+        return [(self.markets[i], self.markets[j]) for i, j in self.market_pairs]
+
+def build_price_cube(df_cleaned, markets=None, min_markets=2,
+                     market_col='市場名_正規化', species_col='魚種（商品名）'):
+    """
+    前処理済みデータから PriceCube を作る関数。
+    min_markets 以上の市場で取引のある魚種 (共通の魚種) だけを対象にする。
+    """
+    markets = list(DEFAULT_SPREAD_MARKETS if markets is None else markets)
+    df_daily = aggregate_market_prices(df_cleaned, freq='D', group_keys=[market_col, species_col])
+    if df_daily.empty:
+        return PriceCube(np.empty((0, 0, 0)), pd.DatetimeIndex([]), [], [])
+    df_daily = df_daily[df_daily[market_col].isin(markets) & df_daily['加重平均単価_円perKg'].notna()]
+    markets = [market for market in markets if market in set(df_daily[market_col])]
+
+    n_markets_per_species = df_daily.groupby(species_col, observed=True)[market_col].nunique()
+    species = sorted(n_markets_per_species[n_markets_per_species >= min_markets].index)
+    df_daily = df_daily[df_daily[species_col].isin(species)]
+    dates = pd.DatetimeIndex(np.sort(df_daily['日付'].unique()))
+
+    prices = np.full((len(dates), len(markets), len(species)), np.nan)
+    t = dates.get_indexer(df_daily['日付'])
+    m = pd.Index(markets).get_indexer(df_daily[market_col])
+    s = pd.Index(species).get_indexer(df_daily[species_col])
+    prices[t, m, s] = df_daily['加重平均単価_円perKg'].to_numpy(dtype='float64')
+    print(f"日次価格配列を作成しました: {len(dates)} 日 × {len(markets)} 市場 × {len(species)} 魚種")
+    return PriceCube(prices, dates, markets, species)
+
+def _log_prices(prices):
+    """対数価格。0 以下の価格 (入力の誤り) は取引のない日と同じく NaN にする (-inf が累積和に広がらないように)。"""
+    return np.log(np.where(prices > 0, prices, np.nan))
+
+def compute_spreads(cube, log=True):
+    """
+    すべての市場の組・魚種について、日次スプレッド (市場i - 市場j) を一括で計算する。
+    log=True の場合は対数価格の差 (≒ 価格差の比率)。
+
+    Returns:
+        numpy.ndarray: 形状 (日数, 市場の組の数, 魚種数)。どちらかの市場で取引がない日は NaN。
+    """
+    values = _log_prices(cube.prices) if log else cube.prices
+    pairs = np.array(cube.market_pairs, dtype='int64').reshape(-1, 2)
+    return values[:, pairs[:, 0], :] - values[:, pairs[:, 1], :]
+
+def _rolling_sum(values, window):
+    """時間軸 (axis=0) 方向の移動合計。累積和の差で求めるため、ウィンドウ幅によらず O(日数)。"""
+    cumulative = np.cumsum(values, axis=0)
+    shifted = np.zeros_like(cumulative)
+    shifted[window:] = cumulative[:-window]
+    return cumulative - shifted
+
+def rolling_zscores(spreads, window=20, min_periods=None):
+    """
+    スプレッドの移動 z スコア ((当日値 - 過去 window 日の平均) / 標準偏差)。
+    平均・標準偏差は当日を含まない直前 window 日 (取引のない日を除く) から求める。
+    """
+    min_periods = window // 2 if min_periods is None else min_periods
+    valid = ~np.isnan(spreads)
+    filled = np.where(valid, spreads, 0.0)
+    # 1日ずらして当日を含まないウィンドウにする
+    lagged = np.concatenate([np.zeros_like(filled[:1]), filled[:-1]])
+    lagged_valid = np.concatenate([np.zeros_like(valid[:1]), valid[:-1]]).astype('float64')
+    count = _rolling_sum(lagged_valid, window)
+    total = _rolling_sum(lagged, window)
+    total_sq = _rolling_sum(lagged * lagged, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        variance = (total_sq - count * mean * mean) / (count - 1)
+        std = np.sqrt(np.maximum(variance, 0.0))
+        zscores = (spreads - mean) / std
+    zscores[(count < max(min_periods, 2)) | ~(std > 0)] = np.nan
+    return zscores
+
+def lagged_cross_correlations(cube, max_lag=5):
+    """
+    市場の組・魚種ごとに、日次対数リターンのラグ付き相関を一括で計算する。
+    ラグ L の値は corr(市場i の t 日目, 市場j の t+L 日目) で、L > 0 で相関が高ければ市場i が先行している。
+
+    Returns:
+        tuple: (ラグの配列, 相関の配列 形状 (ラグ数, 市場の組の数, 魚種数), 観測数の配列 同形状)
+    """
+    returns = np.diff(_log_prices(cube.prices), axis=0)
+    pairs = np.array(cube.market_pairs, dtype='int64').reshape(-1, 2)
+    returns_i = returns[:, pairs[:, 0], :]
+    returns_j = returns[:, pairs[:, 1], :]
+    n_days = returns.shape[0]
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlations = np.full((len(lags),) + returns_i.shape[1:], np.nan)
+    counts = np.zeros(correlations.shape, dtype='int64')
+    for k, lag in enumerate(lags):
+        if abs(lag) >= n_days: continue
+        if lag >= 0:
+            x, y = returns_i[:n_days - lag], returns_j[lag:]
+        else:
+            x, y = returns_i[-lag:], returns_j[:n_days + lag]
+        valid = ~(np.isnan(x) | np.isnan(y))
+        n = valid.sum(axis=0)
+        x = np.where(valid, x, 0.0)
+        y = np.where(valid, y, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_x = x.sum(axis=0) / n
+            mean_y = y.sum(axis=0) / n
+            cov = (x * y).sum(axis=0) / n - mean_x * mean_y
+            var_x = (x * x).sum(axis=0) / n - mean_x * mean_x
+            var_y = (y * y).sum(axis=0) / n - mean_y * mean_y
+            corr = cov / np.sqrt(var_x * var_y)
+        corr[(n < 3) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+        correlations[k] = np.clip(corr, -1.0, 1.0)
+        counts[k] = n
+    return lags, correlations, counts
+
+def summarize_spreads(cube, spreads, zscores, lags, correlations):
+    """市場の組 × 魚種ごとに、スプレッドの統計量と最も相関の高いラグをまとめた表を作る。"""
+    rows = []
+    valid = ~np.isnan(spreads)
+    n_valid = valid.sum(axis=0)
+    filled = np.where(valid, spreads, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_spread = filled.sum(axis=0) / n_valid
+        std_spread = np.sqrt(np.maximum((filled * filled).sum(axis=0) - n_valid * mean_spread ** 2, 0.0) / (n_valid - 1))
+    # 最新の z スコア (各系列で値のある最後の日)
+    has_z = ~np.isnan(zscores)
+    last_index = zscores.shape[0] - 1 - np.argmax(has_z[::-1], axis=0)
+    latest_z = np.take_along_axis(zscores, last_index[np.newaxis], axis=0)[0]
+    latest_z[~has_z.any(axis=0)] = np.nan
+    abs_corr = np.where(np.isnan(correlations), -1.0, np.abs(correlations))
+    best = abs_corr.argmax(axis=0)
+    best_corr = np.take_along_axis(correlations, best[np.newaxis], axis=0)[0]
+
+    for p, (market_a, market_b) in enumerate(cube.pair_labels()):
+        for s, species in enumerate(cube.species):
+            if n_valid[p, s] == 0: continue
+            rows.append({
+                '市場A': market_a, '市場B': market_b, '魚種（商品名）': species,
+                '共通取引日数': int(n_valid[p, s]),
+                '平均対数スプレッド': mean_spread[p, s],
+                '対数スプレッド標準偏差': std_spread[p, s],
+                '最新zスコア': latest_z[p, s],
+                '最大相関ラグ': int(lags[best[p, s]]) if not np.isnan(best_corr[p, s]) else np.nan,
+                '最大相関': best_corr[p, s],
+            })
+    return pd.DataFrame(rows)
+
+def analyze_market_spreads(df_cleaned, markets=None, window=20, max_lag=5):
+    """
+    前処理済みデータから、市場間スプレッド・z スコア・ラグ付き相関をまとめて計算する関数。
+
+    Args:
+        df_cleaned (pandas.DataFrame): preprocess_market_data の出力。
+        markets (list): 比較する市場 (市場名_正規化)。None の場合は東京中央・大阪（本場）・札幌。
+        window (int): z スコアの移動ウィンドウ (取引日数)。
+        max_lag (int): ラグ付き相関で調べる最大ラグ (取引日数)。
+
+    Returns:
+        tuple: (PriceCube, スプレッド配列, zスコア配列, 市場の組 × 魚種の要約DataFrame)
+    """
+    start = time.perf_counter()
+    cube = build_price_cube(df_cleaned, markets)
+    if cube.prices.size == 0 or len(cube.markets) < 2:
+        print("比較できる市場・魚種がないため、スプレッド分析をスキップします。")
+        return cube, np.empty((0, 0, 0)), np.empty((0, 0, 0)), pd.DataFrame()
+    spreads = compute_spreads(cube)
+    zscores = rolling_zscores(spreads, window=window)
+    lags, correlations, _ = lagged_cross_correlations(cube, max_lag=max_lag)
+    df_summary = summarize_spreads(cube, spreads, zscores, lags, correlations)
+    print(f"市場間スプレッドを計算しました: {len(cube.market_pairs)} 組 × {len(cube.species)} 魚種 ({time.perf_counter() - start:.2f} 秒)")
+    return cube, spreads, zscores, df_summary
+
+def spread_frame(cube, spreads, zscores, species):
+    """指定した魚種のスプレッドと z スコアを、日付インデックスの DataFrame にする (グラフ用)。"""
+    s = cube.species.index(species)
+    columns = {}
+    for p, (market_a, market_b) in enumerate(cube.pair_labels()):
+        columns[f'{market_a}-{market_b}'] = spreads[:, p, s]
+        columns[f'{market_a}-{market_b}_z'] = zscores[:, p, s]
+    return pd.DataFrame(columns, index=cube.dates)
+
+if __name__ == '__main__':
+    print("market_spread.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    test_dates = pd.bdate_range('2015-01-01', '2024-12-31')
+    n_species = 40
+    # 東京の価格に対し、大阪は1日遅れ・札幌は独立に動く系列を作る
+    log_tokyo = np.cumsum(rng.normal(0, 0.02, (len(test_dates) + 1, n_species)), axis=0) + 8.0
+    series = {
+        '東京中央': log_tokyo[1:],
+        '大阪（本場）': log_tokyo[:-1] + 0.05 + rng.normal(0, 0.005, (len(test_dates), n_species)),
+        '札幌': np.cumsum(rng.normal(0, 0.02, (len(test_dates), n_species)), axis=0) + 8.0,
+    }
+    frames = []
+    for market, log_prices in series.items():
+        frames.append(pd.DataFrame({
+            '日付': np.repeat(test_dates, n_species),
+            '市場名_正規化': market,
+            '魚種（商品名）': np.tile([f'魚種{i:02d}' for i in range(n_species)], len(test_dates)),
+            '単価_円perKg': np.exp(log_prices).ravel(),
+            '卸売数量_kg換算': 100.0,
+        }))
+    df_test = pd.concat(frames, ignore_index=True)
+    cube, spreads, zscores, df_summary = analyze_market_spreads(df_test)
+    print(df_summary.groupby(['市場A', '市場B'])[['平均対数スプレッド', '最大相関ラグ', '最大相関']].mean())
+
+    # 0 以下の価格は欠損として扱い、-inf が z スコア・要約に広がらないこと
+    df_bad = df_test.copy()
+    bad_rows = (df_bad['市場名_正規化'] == '大阪（本場）') & (df_bad['魚種（商品名）'] == '魚種00')
+    df_bad.loc[df_bad.index[bad_rows][[5, 50]], '単価_円perKg'] = [0.0, -120.0]
+    _, _, zscores_bad, df_summary_bad = analyze_market_spreads(df_bad)
+    assert np.isfinite(df_summary_bad['平均対数スプレッド']).all()
+    assert not np.isinf(zscores_bad).any()
+    n_finite, n_expected = np.isfinite(zscores_bad[30:]).sum(), np.isfinite(zscores[30:]).sum()
+    assert n_finite >= n_expected * 0.99, (n_finite, n_expected)
+    print("0 以下の価格を欠損として扱うことを確認しました。")
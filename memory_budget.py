@@ -0,0 +1,352 @@
+# memory_budget.py
+
+import os
+import pickle
+import re
+import sys
+
+import pandas as pd
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from lineage import LINEAGE_FILE_COL, LINEAGE_ROW_COL, LINEAGE_RUN_COL
+from string_dictionary import DEFAULT_TEXT_COLUMNS, encode_text_columns
+
+# 環境変数で有効化する (スクリプトの変更は不要)
+#   MARKET_MEMORY_BUDGET     メモリ予算 (例: 2GB, 512MB。単位なしは MB)。未設定の場合は従来どおり
+#   MARKET_MEMORY_SPILL_DIR  中間データの退避先 (既定 .memory_spill)
+# --- 設定 ---
+DEFAULT_SPILL_DIR = os.environ.get('MARKET_MEMORY_SPILL_DIR', '.memory_spill')
+# 保持しているデータの見積もりが予算のこの割合を超えたら、縮小・退避を始める (残りは処理中の一時データ用)
+PRESSURE_RATIO = 0.5
+# 数量は集計で合計するため、値が float32 で表せても float64 のままにする
+KEEP_FLOAT64_COLUMNS = ['卸売数量', '卸売数量計', '卸売数量_kg換算']
+# 予算がある場合に共通辞書でカテゴリ型にする列 (前処理で文字列に戻す単位の列も、読み込みから前処理までの間は縮小できる)
+BUDGET_TEXT_COLUMNS = DEFAULT_TEXT_COLUMNS + ['販売方法', '数量単位（kg、箱、尾など）', '数量単位（トン、箱、尾など）', '価格単位（円/kg、円/箱など）']
+# 退避したファイルを読み戻した後も残す (調査用)
+KEEP_SPILL_FILES = False
+# --- ここまで ---
+
+_LINEAGE_COLUMNS = [LINEAGE_FILE_COL, LINEAGE_ROW_COL, LINEAGE_RUN_COL]
+_SIZE_PATTERN = re.compile(r'^\s*([\d.]+)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+_SIZE_UNITS_MB = {'k': 1 / 1024, '': 1, 'm': 1, 'g': 1024, 't': 1024**2}
+
+def parse_memory_size(text):
+    """'2GB' / '512MB' / '1.5g' / '800' (MB) などのメモリ量を MB にする。空なら None。"""
+    if text is None or str(text).strip() == '': return None
+    match = _SIZE_PATTERN.match(str(text))
+    if not match:
+        raise ValueError(f"メモリ量の書式が正しくありません: {text} (例: 2GB, 512MB)")
+    return float(match.group(1)) * _SIZE_UNITS_MB[match.group(2).lower()]
+
+def frame_memory_mb(df):
+    """DataFrame のメモリ使用量 (文字列の中身を含む) の MB。"""
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+def _peak_rss_mb():
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024  # macOS はバイト、Linux は KB
+
+def downcast_numeric_columns(df, keep_float64=None):
+    """
+    数値列を、値が変わらない範囲で小さい型にする (df を直接更新する)。
+    整数列は値の範囲に収まる最小の整数型、浮動小数点列は float32 で全く同じ値になる場合だけ float32 にする。
+    由来の列 (lineage) と keep_float64 の列 (既定は KEEP_FLOAT64_COLUMNS) は変更しない。
+
+    Returns:
+        float: 削減した MB。
+    """
+    keep_float64 = set(KEEP_FLOAT64_COLUMNS if keep_float64 is None else keep_float64) | set(_LINEAGE_COLUMNS)
+    saved = 0
+    for col in df.columns:
+        if col in keep_float64: continue
+        dtype = df[col].dtype
+        if pd.api.types.is_bool_dtype(dtype) or not isinstance(dtype, np.dtype): continue
+        if pd.api.types.is_integer_dtype(dtype):
+            downcast = pd.to_numeric(df[col], downcast='integer' if pd.api.types.is_signed_integer_dtype(dtype) else 'unsigned')
+        elif dtype == np.float64:
+            values = df[col].to_numpy()
+            values32 = values.astype('float32')
+            if not np.array_equal(values32.astype('float64'), values, equal_nan=True): continue
+            downcast = pd.Series(values32, index=df.index, name=col)
+        else:
+            continue
+        if downcast.dtype != dtype:
+            saved += (dtype.itemsize - downcast.dtype.itemsize) * len(df)
+            df[col] = downcast
+    return saved / 1024**2
+
+class SpilledFrame:
+    """
+    ディスクに退避した DataFrame。Parquet (pyarrow がある場合) なら列ごとに読み戻せる。
+    Parquet で書けない列 (型の混在した object 列など) がある場合は pickle で退避する。
+    Parquet から読み戻した object 列の欠損は None になるため、read_csv と同じ NaN に戻す。
+    """
+
+    def __init__(self, path, file_format, label, columns, index, n_rows, size_mb):
+        self.path = path
+        self.file_format = file_format
+        self.label = label
+        self.columns = columns
+        self.index = index
+        self.n_rows = n_rows
+        self.size_mb = size_mb
+
+    @staticmethod
+    def write(df, path_stem, label):
+        size_mb = frame_memory_mb(df)
+        os.makedirs(os.path.dirname(path_stem) or '.', exist_ok=True)
+        if pq is not None:
+            path = path_stem + '.parquet'
+            try:
+                # インデックスは呼び出し側で保持する (行の絞り込み後に元のラベルを付け直すため)
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + '.tmp')
+                os.replace(path + '.tmp', path)
+                return SpilledFrame(path, 'parquet', label, df.columns, df.index, len(df), size_mb)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                if os.path.exists(path + '.tmp'): os.remove(path + '.tmp')
+        path = path_stem + '.pkl'
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(df.reset_index(drop=True), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        return SpilledFrame(path, 'pickle', label, df.columns, df.index, len(df), size_mb)
+
+    def _read_table(self, columns=None):
+        return pq.read_table(self.path, columns=columns)
+
+    @staticmethod
+    def _restore_object_nans(series):
+        if series.dtype == object and series.isna().any():
+            return series.where(series.notna(), np.nan)
+        return series
+
+    def load_column(self, col):
+        """1列だけを読み戻す (Parquet の場合は他の列を読まない)。"""
+        if self.file_format == 'parquet':
+            series = self._restore_object_nans(self._read_table([col]).to_pandas()[col])
+        else:
+            series = self.load()[col]
+        series.index = self.index
+        return series
+
+    def load(self, row_mask=None):
+        """退避した DataFrame を読み戻す。row_mask (bool 配列) を指定した場合は、その行だけを読み戻す。"""
+        if self.file_format == 'parquet':
+            table = self._read_table()
+            if row_mask is not None: table = table.filter(pa.array(row_mask))
+            df = table.to_pandas()
+            del table
+            for col in df.columns[df.dtypes == object]:
+                df[col] = self._restore_object_nans(df[col])
+        else:
+            with open(self.path, 'rb') as f:
+                df = pickle.load(f)
+            if row_mask is not None: df = df[row_mask]
+        df.index = self.index if row_mask is None else self.index[row_mask]
+        return df
+
+    def remove(self):
+        if not KEEP_SPILL_FILES and os.path.exists(self.path):
+            os.remove(self.path)
+
+def _unify_categories(pieces):
+    """カテゴリ型の Series のカテゴリを和集合にそろえる (pd.concat で object 型に戻らないようにする)。"""
+    if len(pieces) < 2 or not all(isinstance(piece.dtype, pd.CategoricalDtype) for piece in pieces):
+        return pieces
+    categories = pieces[0].cat.categories
+    for piece in pieces[1:]:
+        if not piece.cat.categories.equals(categories):
+            categories = categories.append(piece.cat.categories.difference(categories, sort=False))
+    return [piece if piece.cat.categories.equals(categories) else piece.cat.set_categories(categories) for piece in pieces]
+
+def concat_frames(parts):
+    """
+    DataFrame と SpilledFrame の混在したリストを、pd.concat(ignore_index=True) と同じ結果の1つの DataFrame にする
+    (ただしカテゴリ型の列は、カテゴリの異なる部分があっても和集合のカテゴリでカテゴリ型のまま結合する)。
+    退避した部分は1列ずつ読み戻して結合するため、全体を同時に読み戻すことはない。
+    """
+    in_memory = [part for part in parts if isinstance(part, pd.DataFrame)]
+    columns = parts[0].columns
+    if len(in_memory) == len(parts) or any(not part.columns.equals(columns) for part in parts):
+        frames = [part if isinstance(part, pd.DataFrame) else part.load() for part in parts]
+        for col in set.intersection(*(set(frame.columns) for frame in frames)):
+            for frame, piece in zip(frames, _unify_categories([frame[col] for frame in frames])):
+                if piece is not frame[col]: frame[col] = piece
+        return pd.concat(frames, ignore_index=True)
+    result = {}
+    for col in columns:
+        pieces = _unify_categories([part[col] if isinstance(part, pd.DataFrame) else part.load_column(col) for part in parts])
+        result[col] = pd.concat(pieces, ignore_index=True)
+        del pieces
+    return pd.DataFrame(result, copy=False)
+
+def duplicated_rows_spilled(spilled, subset):
+    """
+    退避した DataFrame の subset 列について、DataFrame.duplicated(keep='first') と同じ判定を1列ずつ読んで行う。
+    列ごとの値のコードを順に組み合わせて行のコードにするため、同時に読み込むのは1列分だけ。
+    """
+    row_codes = np.zeros(spilled.n_rows, dtype='int64')
+    for col in subset:
+        codes, uniques = pd.factorize(spilled.load_column(col), use_na_sentinel=True)
+        row_codes, _ = pd.factorize(row_codes * (len(uniques) + 1) + (codes + 1))
+    return pd.Series(row_codes).duplicated(keep='first').to_numpy()
+
+class MemoryBudget:
+    """
+    読み込み・前処理のメモリ予算。保持している DataFrame の大きさを見積もり、予算に近づいたら
+    数値列の縮小・文字列列のカテゴリ化 (共通辞書) を行い、それでも足りない中間データはディスクに退避する。
+    どこで縮小・退避したかは report() で表示する。
+
+    Args:
+        budget_mb (float): メモリ予算 (MB)。
+        spill_dir (str): 退避先のフォルダ。
+        pressure_ratio (float): 保持量の見積もりがこの割合を超えたら縮小・退避する。
+    """
+
+    def __init__(self, budget_mb, spill_dir=DEFAULT_SPILL_DIR, pressure_ratio=PRESSURE_RATIO):
+        self.budget_mb = float(budget_mb)
+        self.spill_dir = spill_dir
+        self.pressure_ratio = pressure_ratio
+        self.held_mb = 0.0
+        self.peak_held_mb = 0.0
+        self.events = []
+        self._spill_count = 0
+
+    @property
+    def limit_mb(self):
+        return self.budget_mb * self.pressure_ratio
+
+    def under_pressure(self, extra_mb=0.0):
+        return self.held_mb + extra_mb > self.limit_mb
+
+    def _record(self, stage, action, label, n_rows, before_mb, after_mb, path=None):
+        self.events.append({'段階': stage, '処理': action, '対象': label, '行数': n_rows,
+                            '処理前_MB': round(before_mb, 1), '処理後_MB': round(after_mb, 1), '退避先': path})
+
+    def hold(self, mb):
+        self.held_mb += mb
+        self.peak_held_mb = max(self.peak_held_mb, self.held_mb)
+
+    def release(self, mb):
+        self.held_mb = max(self.held_mb - mb, 0.0)
+
+    def shrink(self, df, stage, label, encode_strings=True):
+        """
+        df の数値列を縮小し、encode_strings=True なら BUDGET_TEXT_COLUMNS の文字列列を共通辞書のカテゴリ型にする (df を直接更新する)。
+        保持量の見積もりに df の大きさを加え、縮小後の MB を返す。
+        """
+        before_mb = frame_memory_mb(df)
+        downcast_numeric_columns(df)
+        if encode_strings:
+            encode_text_columns(df, columns=BUDGET_TEXT_COLUMNS)
+        after_mb = frame_memory_mb(df)
+        if after_mb < before_mb:
+            self._record(stage, '縮小', label, len(df), before_mb, after_mb)
+            print(f"  -> メモリ予算: {label} を縮小しました ({before_mb:.1f} MB -> {after_mb:.1f} MB)")
+        self.hold(after_mb)
+        return after_mb
+
+    def spill(self, df, stage, label):
+        """df をディスクに退避して SpilledFrame を返す (呼び出し側は df への参照を手放すこと)。"""
+        self._spill_count += 1
+        safe_label = re.sub(r'[^\w.-]+', '_', label)
+        spilled = SpilledFrame.write(df, os.path.join(self.spill_dir, f'{os.getpid()}_{self._spill_count:03d}_{safe_label}'), label)
+        self.release(spilled.size_mb)
+        self._record(stage, '退避', label, spilled.n_rows, spilled.size_mb, 0.0, spilled.path)
+        print(f"  -> メモリ予算: {label} ({spilled.size_mb:.1f} MB, {spilled.n_rows} 行) を {spilled.path} に退避しました")
+        return spilled
+
+    def keep_or_spill(self, df, stage, label):
+        """保持量が予算に近い場合は df を退避して SpilledFrame を、そうでなければ df をそのまま返す。"""
+        return self.spill(df, stage, label) if self.under_pressure() else df
+
+    def concat(self, parts):
+        """concat_frames で結合し、退避ファイルを削除する。保持量の見積もりは結合結果の大きさにする。"""
+        df = concat_frames(parts)
+        for part in parts:
+            if isinstance(part, SpilledFrame): part.remove()
+        self.held_mb = 0.0
+        self.hold(frame_memory_mb(df))
+        return df
+
+    def report(self):
+        """縮小・退避の記録を表示し、DataFrame で返す。"""
+        df_events = pd.DataFrame(self.events, columns=['段階', '処理', '対象', '行数', '処理前_MB', '処理後_MB', '退避先'])
+        peak_rss = _peak_rss_mb()
+        print(f"\n--- メモリ予算 {self.budget_mb:.0f} MB: 保持データの最大見積もり {self.peak_held_mb:.1f} MB"
+              + (f", プロセスの最大メモリ {peak_rss:.0f} MB" if peak_rss is not None else '') + " ---")
+        spilled = df_events[df_events['処理'] == '退避']
+        if spilled.empty:
+            print("退避はありませんでした。")
+        else:
+            print(f"退避 {len(spilled)} 件:")
+            print(spilled[['段階', '対象', '行数', '処理前_MB', '退避先']].to_string(index=False))
+        if peak_rss is not None and peak_rss > self.budget_mb:
+            print(f"★ プロセスの最大メモリが予算を超えました ({peak_rss:.0f} MB > {self.budget_mb:.0f} MB)")
+        return df_events
+
+_active_budget = None
+
+def set_memory_budget(budget):
+    """
+    以降の load_market_data / preprocess_market_data で使うメモリ予算を設定する。
+    budget は MB の数値・'2GB' などの文字列・MemoryBudget・None (無効) のいずれか。
+    """
+    global _active_budget
+    if budget is None or isinstance(budget, MemoryBudget):
+        _active_budget = budget
+    else:
+        budget_mb = parse_memory_size(budget) if isinstance(budget, str) else float(budget)
+        _active_budget = MemoryBudget(budget_mb) if budget_mb else None
+    return _active_budget
+
+def get_memory_budget():
+    """設定中のメモリ予算 (未設定の場合は None)。"""
+    return _active_budget
+
+set_memory_budget(os.environ.get('MARKET_MEMORY_BUDGET') or None)
+
+if __name__ == '__main__':
+    print("memory_budget.py を直接実行しています（テストモード）")
+    import tempfile
+    rng = np.random.default_rng(0)
+    n_rows = 200000
+    def make_part(seed):
+        part_rng = np.random.default_rng(seed)
+        return pd.DataFrame({
+            'ID': np.arange(n_rows),
+            '魚種（商品名）': part_rng.choice(['まぐろ（生鮮）', 'めばち（冷凍）', 'さば', None], n_rows),
+            '販売方法': pd.Categorical(part_rng.choice(['セリ', '相対', f'入札{seed}'], n_rows)),
+            '卸売数量': part_rng.integers(0, 500, n_rows).astype('float64'),
+            '中値（円）': part_rng.choice([np.nan, 1200.0, 3400.0, 5600.5], n_rows),
+        })
+    parts = [make_part(seed) for seed in range(3)]
+    expected = pd.concat(parts, ignore_index=True)
+    expected_duplicated = expected.duplicated(keep='first').to_numpy()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        budget = MemoryBudget(budget_mb=frame_memory_mb(parts[0]), spill_dir=tmp_dir)
+        held = []
+        for i, part in enumerate(parts):
+            budget.shrink(part, 'テスト', f'部分{i}', encode_strings=False)
+            held.append(budget.keep_or_spill(part, 'テスト', f'部分{i}'))
+        del part
+        combined = budget.concat(held)
+        # カテゴリの異なる 販売方法 は、pd.concat では object 型になる
+        pd.testing.assert_frame_equal(combined.astype({'販売方法': object}), pd.concat(parts, ignore_index=True))
+        spilled = budget.spill(combined, 'テスト', '重複削除前')
+        assert (duplicated_rows_spilled(spilled, combined.columns) == expected_duplicated).all()
+        deduplicated = spilled.load(~duplicated_rows_spilled(spilled, combined.columns))
+        pd.testing.assert_frame_equal(deduplicated, combined.drop_duplicates())
+        budget.report()
+    print("\npd.concat / drop_duplicates と同じ結果であることを確認しました。")
@@ -1,6 +1,6 @@
 import pandas as pd
-import glob
-import os
+
+from osaka_store import DEFAULT_STORE_PATH, load_yearly_reports
 
 # --- 設定 ---
 # 結合したいCSVファイル名のリスト
@@ -17,50 +17,20 @@ output_filename = "大阪市場日報_結合_R4_R6.csv"
 
 print("CSVファイルの結合を開始します...")
 
-# スクリプトがあるフォルダ内のCSVファイルを取得
-all_csv_files = glob.glob("*.csv")
-
-# 結合対象のファイルをフィルタリング
-files_to_merge = []
-found_files_set = set() # 重複を避けるため
+# 年別ファイル (main.py/main2.py の既定の保存先 大阪市場日報_年別/) を優先し、ない年だけスクリプトがあるフォルダのCSVを読む
+final_df, loaded_sources = load_yearly_reports(target_filenames)
 
-for f in all_csv_files:
-    base_name = os.path.basename(f)
-    if base_name in target_filenames and base_name not in found_files_set:
-        files_to_merge.append(f)
-        found_files_set.add(base_name)
-
-if not files_to_merge:
-    print("エラー: 結合対象のCSVファイルが見つかりませんでした。")
-    print(f"探したファイル名パターン: {target_filenames}")
+if not loaded_sources:
+    print("エラー: 結合対象のデータが見つかりませんでした。")
+    print(f"探したファイル名パターン: {target_filenames} (年別ファイル: {DEFAULT_STORE_PATH})")
     exit(1)
 
-print("以下のファイルを結合します:")
-# ファイル名でソートして表示（処理順ではない）
-files_to_merge.sort() 
-for f in files_to_merge:
-    print(f" - {f}")
-
-all_dataframes = []
-
-# 各CSVファイルを読み込んでリストに追加
-for file in files_to_merge:
-    try:
-        print(f"読み込み中: {file}")
-        # ★ 必ず encoding='utf_8_sig' を指定 ★
-        # これによりExcelで開いた際の文字化けを防ぎます
-        df = pd.read_csv(file, encoding='utf_8_sig')
-        all_dataframes.append(df)
-    except FileNotFoundError:
-        print(f"  -> 警告: {file} が見つかりませんでした。スキップします。")
-    except Exception as e:
-        print(f"  -> エラー: {file} の読み込みに失敗しました - {e}")
+print("以下のデータを結合しました:")
+for source in loaded_sources:
+    print(f" - {source}")
 
-# データフレームを結合
-if all_dataframes:
-    print("\nデータフレームを結合しています...")
-    # ignore_index=True で、結合後のインデックスを 0 から振り直します
-    final_df = pd.concat(all_dataframes, ignore_index=True)
+# 結合したデータを保存
+if not final_df.empty:
     print(f"結合後の総行数: {len(final_df)} 行")
 
     # 結合したデータを新しいCSVファイルとして保存
@@ -0,0 +1,203 @@
+# osaka_archive_audit.py
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from excel_cells import file_sha256, read_first_row
+from market_calendar import get_market_calendar
+from osaka_store import parse_japanese_date
+
+# --- 設定 ---
+report_folder_path = './04_大阪市場日報データ（水産）'
+PROBE_CACHE_PATH = 'osaka_archive_probe_cache.json'
+AUDIT_OUTPUT_PATH = '大阪日報_監査結果.csv'
+AUDIT_MARKET = '大阪（本場）'  # 営業日の判定に使う市場の暦
+# --- ここまで ---
+
+# 日報の日付のセル (1行目の列番号) と、その位置のレイアウト。process_excel_file と同じく I1 → H1 の順に探す
+DATE_CELLS = [(8, 'layout1'), (7, 'layout1'), (10, 'layout2')]
+_FOLDER_YEAR_PATTERN = re.compile(r'(\d{4})年')
+
+def find_archive_files(folder_path=report_folder_path):
+    """日報フォルダと 処理済み* サブフォルダ内のすべての日報ファイル (.xls/.xlsx) を返す (パス順)。"""
+    files = []
+    for root, _, names in os.walk(folder_path):
+        files += [os.path.join(root, name) for name in names if name.lower().endswith(('.xls', '.xlsx'))]
+    return sorted(files)
+
+def folder_year(file_path):
+    """'処理済み_2022年_3月' などのフォルダ名の西暦の年 (年のないフォルダは None)。"""
+    match = _FOLDER_YEAR_PATTERN.search(os.path.basename(os.path.dirname(file_path)))
+    return int(match.group(1)) if match else None
+
+def probe_report_file(file_path):
+    """
+    日報ファイルの1行目だけを読み、日付の文字列とレイアウトを調べる (ワーカープロセスで実行する)。
+
+    Returns:
+        dict: sha256・日付_和暦・レイアウト・エラー (読めない場合のメッセージ、それ以外は None)。
+    """
+    probe = {'sha256': None, 'date_text': None, 'layout': None, 'error': None}
+    try:
+        probe['sha256'] = file_sha256(file_path)
+        first_row = read_first_row(file_path)
+        for col, layout in DATE_CELLS:
+            if col < len(first_row) and '年' in str(first_row[col]):
+                probe['date_text'], probe['layout'] = str(first_row[col]), layout
+                break
+    except Exception as e:
+        probe['error'] = f"{type(e).__name__}: {e}"
+    return probe
+
+def _stamp(file_path):
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def load_probe_cache(path=PROBE_CACHE_PATH):
+    if not os.path.exists(path): return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_probe_cache(cache, path=PROBE_CACHE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def probe_archive(files, cache_path=PROBE_CACHE_PATH, max_workers=None):
+    """
+    日報ファイルの日付を調べ、日付 → ファイルの索引を作る関数。
+    サイズと更新日時が前回と同じファイルはキャッシュの結果を使い、それ以外 (と前回読めなかったファイル) だけを
+    プロセスプールで並列に読む。
+
+    Returns:
+        pandas.DataFrame: ファイルごとの ファイル・フォルダ・フォルダの年・日付_和暦・日付・レイアウト・sha256・エラー。
+    """
+    cache = load_probe_cache(cache_path) if cache_path else {}
+    stamps = {path: _stamp(path) for path in files}
+    keys = {path: os.path.abspath(path) for path in files}
+    # 読めなかったファイルは、ライブラリの追加 (openpyxl など) で読めるようになることがあるため毎回読み直す
+    to_probe = [path for path in files
+                if cache.get(keys[path], {}).get('stamp') != stamps[path] or cache[keys[path]].get('error') is not None]
+    if to_probe:
+        start = time.perf_counter()
+        max_workers = max_workers or min(len(to_probe), os.cpu_count() or 1)
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                probes = list(executor.map(probe_report_file, to_probe, chunksize=max(len(to_probe) // (max_workers * 4), 1)))
+        else:
+            probes = [probe_report_file(path) for path in to_probe]
+        for path, probe in zip(to_probe, probes):
+            cache[keys[path]] = dict(probe, stamp=stamps[path])
+        if cache_path: save_probe_cache(cache, cache_path)
+        print(f"{len(to_probe)} ファイルの日付を確認しました ({time.perf_counter() - start:.1f} 秒, キャッシュ利用 {len(files) - len(to_probe)} ファイル)")
+    else:
+        print(f"{len(files)} ファイルすべてキャッシュの結果を使用します。")
+
+    records = [cache[keys[path]] for path in files]
+    df_index = pd.DataFrame({
+        'ファイル': [os.path.basename(path) for path in files],
+        'フォルダ': [os.path.basename(os.path.dirname(path)) for path in files],
+        'フォルダの年': pd.array([folder_year(path) for path in files], dtype='Int64'),
+        '日付_和暦': [record['date_text'] for record in records],
+        'レイアウト': [record['layout'] for record in records],
+        'sha256': [record['sha256'] for record in records],
+        'エラー': [record['error'] for record in records],
+        'パス': files,
+    })
+    # 日報は1ファイル1日付のため、和暦の文字列ごとに1回だけ解析する
+    unique_texts = df_index['日付_和暦'].dropna().unique()
+    parsed = {text: parse_japanese_date(text) for text in unique_texts}
+    df_index.insert(4, '日付', pd.to_datetime(df_index['日付_和暦'].map(parsed)))
+    return df_index
+
+def audit_archive(df_index, market=AUDIT_MARKET, start=None, end=None):
+    """
+    probe_archive の索引から、日報の欠け・重複・年フォルダ違いなどを調べる関数。
+    営業日の判定は market の暦 (market_calendar) を使い、日付の比較はすべて配列の一括比較で行う。
+
+    Args:
+        start, end: 欠けを調べる期間。省略時は索引の最初の日付〜最後の日付。
+
+    Returns:
+        pandas.DataFrame: 種別・日付・ファイル・詳細 の表 (問題がなければ空)。
+    """
+    issues = []
+    dated = df_index[df_index['日付'].notna()]
+    market_calendar = get_market_calendar(market)
+
+    for _, row in df_index[df_index['エラー'].notna()].iterrows():
+        issues.append(('読み込み失敗', pd.NaT, row['パス'], row['エラー']))
+    for _, row in df_index[df_index['エラー'].isna() & df_index['日付'].isna()].iterrows():
+        issues.append(('日付不明', pd.NaT, row['パス'], f"1行目に日付がありません ({row['日付_和暦'] or '空'})"))
+
+    if not dated.empty:
+        days = market_calendar.trading_days(dated['日付'].min() if start is None else start,
+                                            dated['日付'].max() if end is None else end)
+        for day in days[~days.isin(dated['日付'])]:
+            issues.append(('データのない営業日', day, None, f"{day:%Y-%m-%d} ({'月火水木金土日'[day.dayofweek]}) の日報がありません"))
+
+        # 同じ日付のファイルが複数ある場合、内容 (sha256) が同じなら同じ日報の重複ダウンロード
+        duplicated = dated[dated.duplicated('日付', keep=False)].sort_values(['日付', 'パス'])
+        for day, df_day in duplicated.groupby('日付', sort=True):
+            kind = '重複日 (同一内容)' if df_day['sha256'].nunique() == 1 else '重複日 (内容が異なる)'
+            for path in df_day['パス']:
+                issues.append((kind, day, path, f"{len(df_day)} ファイル: {', '.join(df_day['ファイル'])}"))
+
+        out_of_year = dated[dated['フォルダの年'].notna() & (dated['日付'].dt.year != dated['フォルダの年'])]
+        for _, row in out_of_year.iterrows():
+            issues.append(('年フォルダ外', row['日付'], row['パス'], f"{row['フォルダ']} に {row['日付'].year} 年の日報 ({row['日付_和暦']})"))
+
+        closed = dated[~market_calendar.is_trading_day(dated['日付'])]
+        for _, row in closed.iterrows():
+            issues.append(('休市日の日報', row['日付'], row['パス'], f"{row['日付_和暦']} は {market} の暦では休市日です"))
+
+    return pd.DataFrame(issues, columns=['種別', '日付', 'ファイル', '詳細'])
+
+def summarize_audit(df_index, df_issues):
+    """監査結果の件数を表示する。"""
+    # 日付の読めたファイルが1つもない場合 (すべて読み込み失敗など) は期間を表示しない
+    date_range = (f"日付 {df_index['日付'].min():%Y-%m-%d} 〜 {df_index['日付'].max():%Y-%m-%d}"
+                  if df_index['日付'].notna().any() else "日付の読めたファイルなし")
+    print(f"\n--- 日報アーカイブの監査: {len(df_index)} ファイル, {date_range}, ユニークな日付 {df_index['日付'].nunique()} 日 ---")
+    if df_issues.empty:
+        print("問題は見つかりませんでした。")
+        return
+    print(df_issues['種別'].value_counts().to_string())
+    df_missing = df_issues[df_issues['種別'] == 'データのない営業日']
+    if not df_missing.empty:
+        print("\nデータのない営業日 (年別):")
+        print(df_missing['日付'].dt.year.value_counts().sort_index().to_string())
+        # 特定の曜日に偏る場合は、暦に入っていない定休日 (水曜の休開市日など) の可能性がある
+        weekday_counts = df_missing['日付'].dt.dayofweek.value_counts().reindex(range(7), fill_value=0)
+        print("データのない営業日 (曜日別): " + ', '.join(f"{'月火水木金土日'[day]} {count}" for day, count in weekday_counts.items()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='大阪日報アーカイブの欠け・重複・年フォルダ違いを調べる')
+    parser.add_argument('--folder', default=report_folder_path)
+    parser.add_argument('--output', default=AUDIT_OUTPUT_PATH)
+    parser.add_argument('--cache', default=PROBE_CACHE_PATH, help='日付の確認結果のキャッシュ (空文字でキャッシュしない)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--start', default=None, help='欠けを調べる期間の開始日 (例: 2015-01-05)')
+    parser.add_argument('--end', default=None)
+    args = parser.parse_args(argv)
+
+    files = find_archive_files(args.folder)
+    if not files:
+        print(f"エラー: '{args.folder}' に日報ファイルが見つかりませんでした。")
+        return None
+    df_index = probe_archive(files, cache_path=args.cache or None, max_workers=args.workers)
+    df_issues = audit_archive(df_index, start=args.start, end=args.end)
+    summarize_audit(df_index, df_issues)
+    df_issues.to_csv(args.output, index=False, encoding='utf_8_sig')
+    print(f"\n監査結果を {args.output} に保存しました ({len(df_issues)} 行)")
+    return df_issues
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# osaka_ingest.py
+
+import glob
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+# file_sha256 は取り込みマニフェスト (osaka_watcher) でも使う
+from excel_cells import DEFAULT_CELL_CACHE_DIR, file_sha256, read_report_sheet
+from lineage import LINEAGE_ROW_COL
+
+def process_excel_file(file_path, cell_cache_dir=DEFAULT_CELL_CACHE_DIR):
+    """[v4] 1つのExcelファイルを読み込み、日付を追加してクリーニングし、日付も返す"""
+    base_name = os.path.basename(file_path)
+    print(f"\n--- 処理開始: {base_name} ---")
+    try:
+        # 使う列 (A〜L列) のセルだけを取り出す (同じ内容のファイルは2回目以降キャッシュから読む)
+        df_full = read_report_sheet(file_path, cache_dir=cell_cache_dir)
+        print(f"  -> 読み込み完了: {df_full.shape[0]}行, {df_full.shape[1]}列")
+
+        date_value = "日付不明"
+        date_col_index = None
+
+        # I1(8) と H1(7) をチェック
+        try:
+            h1_value = df_full.iloc[0, 7] if df_full.shape[1] > 7 else None
+            i1_value = df_full.iloc[0, 8] if df_full.shape[1] > 8 else None
+            print(f"  -> H1(7): [{h1_value}], I1(8): [{i1_value}]")
+
+            if pd.notna(i1_value) and "年" in str(i1_value):
+                date_value = i1_value
+                date_col_index = 8
+                print(f"  -> 日付取得 (I1): {date_value}")
+            elif pd.notna(h1_value) and "年" in str(h1_value):
+                date_value = h1_value
+                date_col_index = 7
+                print(f"  -> 日付取得 (H1): {date_value}")
+            else:
+                print(f"  -> 警告: H1/I1 で日付が見つかりません。")
+        except Exception as e_date:
+            print(f"  -> エラー(日付取得): {base_name} - {e_date}")
+
+        df_data = df_full.iloc[8:].copy()
+
+        if date_col_index == 7: 
+            use_indices = [0, 2, 3, 4, 6, 8]
+            print("  -> フォーマット: 日付=H1, 産地=I1 を使用")
+        elif date_col_index == 8: 
+            use_indices = [0, 2, 3, 4, 6, 9]
+            print("  -> フォーマット: 日付=I1, 産地=J1 を使用")
+        else: 
+            use_indices = [0, 2, 3, 4, 6, 8]
+            print("  -> 警告: 日付位置不明、デフォルト形式 (産地=I1) で試行")
+
+        if not all(idx < df_data.shape[1] for idx in use_indices):
+             print(f"  -> ★★★ エラー: {base_name} は選択しようとした列({use_indices})が不足しています。スキップします。 ★★★")
+             return None, date_value
+
+        df_raw = df_data[use_indices].copy()
+
+        column_names = ['品目', '数量', '単位', '高値', '安値', '主な産地']
+        df_raw.columns = column_names
+        df_clean = df_raw.dropna(subset=['数量']).copy()
+        sheet_rows = df_clean.index.to_numpy() + 1 # Excel のシートの行番号 (1始まり)
+        df_clean.reset_index(drop=True, inplace=True)
+        df_clean['日付'] = date_value
+        df_clean['元ファイル'] = base_name
+        df_clean[LINEAGE_ROW_COL] = sheet_rows
+        print(f"  -> 処理成功: {base_name}")
+        return df_clean, date_value
+
+    except Exception as e:
+        print(f"  -> ★★★ 重大エラー: {base_name} - {e} ★★★")
+        return None, "日付不明"
+
+def process_excel_file_layout2(file_path, cell_cache_dir=DEFAULT_CELL_CACHE_DIR):
+    """[main2.py用] 新しいレイアウトのExcelを処理する関数"""
+    base_name = os.path.basename(file_path)
+    print(f"\n--- 処理開始 (新レイアウト): {base_name} ---")
+    try:
+        df_full = read_report_sheet(file_path, cache_dir=cell_cache_dir)
+        print(f"  -> 読み込み完了: {df_full.shape[0]}行, {df_full.shape[1]}列")
+
+        date_value = "日付不明"
+        try:
+            # ★ 日付を K1 (0, 10) から取得 ★
+            if df_full.shape[0] > 0 and df_full.shape[1] > 10: # K列(10)があるかチェック
+                k1_value = df_full.iloc[0, 10]
+                print(f"  -> K1 (0, 10) の値: [{k1_value}]")
+                if pd.notna(k1_value) and "年" in str(k1_value):
+                    date_value = k1_value
+                    print(f"  -> 日付取得成功 (K1): {date_value}")
+                else:
+                    print(f"  -> 警告: K1 で日付が見つかりません。")
+            else:
+                 print(f"  -> 警告: K1セル にアクセスできません。")
+        except Exception as e_date:
+            print(f"  -> エラー(日付取得): {base_name} - {e_date}")
+
+        df_data = df_full.iloc[8:].copy()
+
+        # ★★★ 新しいレイアウトの列インデックスを設定 ★★★
+        # 品目(0), 数量(2), 単位(3), 高値(4), 中値(6), 安値(8), 産地1(10), 産地2(11)
+        use_indices = [0, 2, 3, 4, 6, 8, 10, 11] 
+        column_names_raw = ['品目', '数量', '単位', '高値', '中値', '安値', '産地1', '産地2']
+        print(f"  -> フォーマット: 新レイアウト (中値あり, 産地=10+11) を使用")
+        # ★★★★★★★★★★★★★★★★★★★★★★★★★★★★
+
+        if not all(idx < df_data.shape[1] for idx in use_indices):
+             print(f"  -> ★★★ エラー: {base_name} は選択しようとした列({use_indices})が不足しています。スキップします。 ★★★")
+             return None, date_value
+
+        df_raw = df_data[use_indices].copy()
+
+        # データクリーニング
+        df_raw.columns = column_names_raw
+        df_clean = df_raw.dropna(subset=['数量']).copy()
+        
+        # ★ 産地を結合 ★
+        df_clean['主な産地'] = df_clean['産地1'].fillna('') + ' ' + df_clean['産地2'].fillna('')
+        df_clean['主な産地'] = df_clean['主な産地'].str.strip() # 前後の空白を削除
+        # 元の産地列を削除
+        df_clean = df_clean.drop(columns=['産地1', '産地2'])
+
+        sheet_rows = df_clean.index.to_numpy() + 1 # Excel のシートの行番号 (1始まり)
+        df_clean.reset_index(drop=True, inplace=True)
+        df_clean['日付'] = date_value
+        df_clean['元ファイル'] = base_name
+        df_clean[LINEAGE_ROW_COL] = sheet_rows
+        print(f"  -> 処理成功: {base_name}")
+        return df_clean, date_value
+
+    except Exception as e:
+        print(f"  -> ★★★ 重大エラー: {base_name} - {e} ★★★")
+        return None, "日付不明"
+
+# 日報のレイアウト名と処理関数の対応 (main.py は layout1、main2.py は layout2)
+REPORT_PARSERS = {
+    'layout1': process_excel_file,
+    'layout2': process_excel_file_layout2,
+}
+
+def find_report_files(report_folder_path, processed_folder_name='処理済み', include_processed=False):
+    """
+    日報フォルダ内のExcelファイル (.xls/.xlsx) を更新日時順に返す関数。
+    include_processed=True の場合は 処理済み* サブフォルダ内のファイルも対象にする。
+    """
+    patterns = ['*.xls', '*.xlsx']
+    all_files = [f for p in patterns for f in glob.glob(os.path.join(report_folder_path, p))]
+    if include_processed:
+        all_files += [f for p in patterns for f in glob.glob(os.path.join(report_folder_path, f'{processed_folder_name}*', p))]
+    return sorted(all_files, key=os.path.getmtime)
+
+def ingest_reports(files, target_year_str, layout='layout1'):
+    """
+    日報ファイル群を処理し、日付に target_year_str (例: "令和6年") を含むものだけを結合して返す関数。
+    main.py/main2.py と異なり、対象外の年が出ても停止せずスキップし、ファイルの移動も行わない。
+
+    Returns:
+        tuple: (結合したDataFrame (該当なしの場合は空), 失敗したファイル名のリスト)
+    """
+    parser = REPORT_PARSERS[layout]
+    all_dataframes = []
+    failed_files = []
+    for file in files:
+        processed_df, current_date_str = parser(file)
+        if current_date_str != "日付不明" and target_year_str not in str(current_date_str):
+            continue
+        if processed_df is not None:
+            all_dataframes.append(processed_df)
+        else:
+            failed_files.append(os.path.basename(file))
+    if not all_dataframes:
+        return pd.DataFrame(), failed_files
+    return pd.concat(all_dataframes, ignore_index=True), failed_files
+
+# --- 取り込みマニフェスト (どのファイルをいつ取り込んだかの記録) ---
+MANIFEST_FILENAME = 'ingest_manifest.json'
+
+def load_manifest(report_folder_path):
+    """日報フォルダの取り込みマニフェストを読み込む (なければ空のマニフェスト)。"""
+    manifest_path = os.path.join(report_folder_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(report_folder_path, manifest):
+    """マニフェストを一時ファイル経由で書き込む (書き込み途中で中断しても壊れないように)。"""
+    manifest_path = os.path.join(report_folder_path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def manifest_sha256_index(manifest):
+    """マニフェストの取り込み済み (status='ok') ファイルの sha256 -> ファイル名。"""
+    return {entry['sha256']: name for name, entry in manifest['files'].items()
+            if entry.get('sha256') and entry.get('status') == 'ok'}
+
+def dedupe_report_files(files, known_sha256=None):
+    """
+    日報ファイルのバイト列の sha256 を比べ、同じ内容のファイル (同じ日報の重複ダウンロード) を除く関数。
+    Excel は開かずにハッシュだけを計算し、files の順 (更新日時順) で最初のファイルを残す。
+
+    Args:
+        files (list): 日報ファイルのパス。
+        known_sha256 (dict): 取り込み済みの sha256 -> ファイル名 (manifest_sha256_index の結果など)。
+            これと同じ内容のファイルも除く。
+
+    Returns:
+        tuple: (残すファイルのリスト, 除いたファイル -> (同じ内容のファイル, sha256) の dict)
+    """
+    kept_by_sha256 = dict(known_sha256 or {})
+    unique_files, duplicates = [], {}
+    for file in files:
+        sha256 = file_sha256(file)
+        if sha256 in kept_by_sha256:
+            duplicates[file] = (kept_by_sha256[sha256], sha256)
+        else:
+            kept_by_sha256[sha256] = file
+            unique_files.append(file)
+    if duplicates:
+        print(f"同じ内容のファイル {len(duplicates)} 個を除外します (解析するファイル: {len(unique_files)} 個)")
+    return unique_files, duplicates
+
+def record_aliases(manifest, duplicates, report_folder_path):
+    """
+    dedupe_report_files で除いたファイルを、マニフェストの aliases に 同じ内容のファイルの別名として記録する。
+    名前は日報フォルダからの相対パス (フォルダ直下のファイルはファイル名) で記録する。
+    """
+    def name_of(path):
+        return os.path.relpath(path, report_folder_path) if os.path.dirname(path) else path
+    aliases = manifest.setdefault('aliases', {})
+    recorded_at = datetime.now().isoformat(timespec='seconds')
+    for file, (original, sha256) in duplicates.items():
+        aliases[name_of(file)] = {'alias_of': name_of(original), 'sha256': sha256, 'recorded_at': recorded_at}
+    return manifest
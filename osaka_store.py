@@ -0,0 +1,214 @@
+# osaka_store.py
+
+import glob
+import importlib.util
+import os
+import re
+
+import pandas as pd
+import numpy as np
+
+from lineage import LINEAGE_ROW_COL
+
+# --- 設定 ---
+DEFAULT_STORE_PATH = '大阪市場日報_年別'
+# --- ここまで ---
+
+NUMERIC_COLUMNS = ['数量', '高値', '中値', '安値']
+CATEGORY_COLUMNS = ['品目', '単位', '主な産地', '元ファイル']
+
+# 元号 -> 元年の前年 (西暦 = 基準年 + 和暦の年)
+ERA_BASE_YEARS = {'明治': 1867, '大正': 1911, '昭和': 1925, '平成': 1988, '令和': 2018}
+_JAPANESE_DATE_PATTERN = re.compile(r'(明治|大正|昭和|平成|令和)\s*(元|\d+)\s*年\s*(\d+)\s*月\s*(\d+)\s*日')
+
+def parquet_available():
+    """parquet の読み書きに必要なライブラリ (pyarrow / fastparquet) があるか。"""
+    return any(importlib.util.find_spec(name) is not None for name in ('pyarrow', 'fastparquet'))
+
+def parse_japanese_date(value):
+    """'令和6年1月6日（土）' '平成31年4月30日' '令和元年5月1日' などの和暦の日付を Timestamp にする (解析できなければ NaT)。"""
+    match = _JAPANESE_DATE_PATTERN.search(str(value).translate(str.maketrans('０１２３４５６７８９', '0123456789')))
+    if match is None: return pd.NaT
+    era, year, month, day = match.groups()
+    year = 1 if year == '元' else int(year)
+    try:
+        return pd.Timestamp(ERA_BASE_YEARS[era] + year, int(month), int(day))
+    except ValueError:
+        return pd.NaT
+
+def parse_japanese_dates(values):
+    """和暦の日付の列を datetime64 に変換する。日報は1ファイル1日付のため、ユニーク値ごとに1回だけ解析する。"""
+    labels, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    parsed = pd.DatetimeIndex([parse_japanese_date(value) for value in uniques] + [pd.NaT]).to_numpy()
+    return pd.Series(parsed[labels], index=getattr(values, 'index', None))
+
+def report_year_label(value):
+    """和暦の日付から年の部分 ('令和6年1月6日（土）' -> '令和6年'、'令和元年5月1日' -> '令和元年') を返す (なければ None)。"""
+    match = _JAPANESE_DATE_PATTERN.search(str(value).translate(str.maketrans('０１２３４５６７８９', '0123456789')))
+    return f"{match.group(1)}{match.group(2)}年" if match else None
+
+def _to_number(series):
+    if pd.api.types.is_numeric_dtype(series): return series.astype('float64')
+    return pd.to_numeric(series.astype('string').str.replace(',', '', regex=False).str.strip(), errors='coerce').astype('float64')
+
+def to_typed_report_frame(df_report):
+    """
+    日報の取り込み結果 (process_excel_file / process_excel_file_layout2 の出力) を型付きのDataFrameにする。
+    数量・価格は float64、日付は datetime64 (元の和暦文字列は 日付_和暦 に残す)、品目・単位などは category 型。
+    元ファイル (category 型、内部は整数コード) と 由来_行 (シートの行番号) で、各行を元のExcelの行に戻せる。
+    """
+    df_typed = df_report.copy()
+    for col in NUMERIC_COLUMNS:
+        if col in df_typed.columns:
+            df_typed[col] = _to_number(df_typed[col])
+    if '日付' in df_typed.columns and not pd.api.types.is_datetime64_any_dtype(df_typed['日付']):
+        df_typed['日付_和暦'] = df_typed['日付'].astype('string').astype('category')
+        df_typed['日付'] = parse_japanese_dates(df_typed['日付']).to_numpy()
+    for col in CATEGORY_COLUMNS:
+        if col in df_typed.columns:
+            df_typed[col] = df_typed[col].astype('string').astype('category')
+    if LINEAGE_ROW_COL in df_typed.columns:
+        df_typed[LINEAGE_ROW_COL] = df_typed[LINEAGE_ROW_COL].astype('int32')
+    return df_typed
+
+def _partition_dir(store_path, year):
+    return os.path.join(store_path, f'年={year}')
+
+def _read_part(path):
+    if path.endswith('.parquet'): return pd.read_parquet(path)
+    return to_typed_report_frame(pd.read_csv(path, encoding='utf_8_sig', parse_dates=['日付']))
+
+def write_report_partitions(df_report, store_path=DEFAULT_STORE_PATH, part_name='part', file_format='parquet', merge=False):
+    """
+    日報データを型付きに変換し、西暦の年ごとのフォルダ (年=2024/ など) に分けて保存する関数。
+    同じ年・同じ part_name のファイルは置き換える (例: part_name='令和6年' で再実行すると上書き)。
+    merge=True の場合は置き換えずに、既存のファイルから同じ 元ファイル の行を除いて追記する
+    (osaka_watcher が1日分ずつ年のファイルに加えるときに使う。取り込み直しても行は重複しない)。
+
+    Args:
+        df_report (pandas.DataFrame): 日報の取り込み結果。
+        store_path (str): 保存先のフォルダ。
+        part_name (str): 年フォルダ内のファイル名 (拡張子なし)。
+        file_format (str): 'parquet' (型を保持、既定) または 'csv' (utf_8_sig、Excel で開ける)。
+            parquet 用のライブラリがない場合は csv で保存する。
+
+    Returns:
+        list: 保存したファイルのパス。
+    """
+    if file_format == 'parquet' and not parquet_available():
+        print("pyarrow / fastparquet がないため、CSV形式で保存します。")
+        file_format = 'csv'
+    df_typed = to_typed_report_frame(df_report)
+    years = df_typed['日付'].dt.year
+    written = []
+    for year, df_year in df_typed.groupby(years.fillna(0).astype('int64'), sort=True):
+        year_label = year if year > 0 else '不明'
+        os.makedirs(_partition_dir(store_path, year_label), exist_ok=True)
+        path = os.path.join(_partition_dir(store_path, year_label), f'{part_name}.{file_format}')
+        if merge and os.path.exists(path):
+            df_existing = _read_part(path)
+            if '元ファイル' in df_year.columns and '元ファイル' in df_existing.columns:
+                df_existing = df_existing[~df_existing['元ファイル'].astype('object').isin(df_year['元ファイル'].astype('object').unique())]
+            if len(df_existing): df_year = _concat_typed([df_existing, df_year])
+        # 書き込み途中で中断しても既存のファイルが壊れないように、一時ファイル経由で置き換える
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        if file_format == 'parquet':
+            df_year.to_parquet(tmp_path, index=False)
+        else:
+            df_year.to_csv(tmp_path, index=False, encoding='utf_8_sig')
+        os.replace(tmp_path, path)
+        written.append(path)
+        print(f"  -> 保存しました: {path} ({len(df_year)} 行)")
+    return written
+
+def read_report_partitions(store_path=DEFAULT_STORE_PATH, years=None, columns=None, part_names=None):
+    """
+    write_report_partitions で保存した日報データを読み込む関数。
+    years を指定すると、その年のフォルダのファイルだけを読む (他の年のファイルは開かない)。
+
+    Args:
+        years (list): 読み込む西暦の年。None の場合はすべて。
+        columns (list): 読み込む列。None の場合はすべて (parquet では指定列のみディスクから読む)。
+        part_names (list): 読み込むファイル名 (拡張子なし、例: ['令和5年', '令和6年'])。None の場合はすべて。
+
+    Returns:
+        pandas.DataFrame: 型付きの日報データ (該当なしの場合は空)。
+    """
+    year_dirs = sorted(glob.glob(os.path.join(store_path, '年=*')))
+    if years is not None:
+        wanted = {str(year) for year in years}
+        year_dirs = [d for d in year_dirs if os.path.basename(d).split('=', 1)[1] in wanted]
+    dfs = []
+    for year_dir in year_dirs:
+        for path in sorted(glob.glob(os.path.join(year_dir, '*.parquet')) + glob.glob(os.path.join(year_dir, '*.csv'))):
+            if part_names is not None and os.path.splitext(os.path.basename(path))[0] not in part_names: continue
+            if path.endswith('.parquet'):
+                dfs.append(pd.read_parquet(path, columns=columns))
+            else:
+                df_csv = pd.read_csv(path, encoding='utf_8_sig', usecols=columns, parse_dates=['日付'] if columns is None or '日付' in columns else None)
+                dfs.append(to_typed_report_frame(df_csv))
+    if not dfs: return pd.DataFrame()
+    return _concat_typed(dfs)
+
+def _concat_typed(dfs):
+    df_all = pd.concat(dfs, ignore_index=True)
+    # ファイルごとにカテゴリが異なると object 型に戻るため、結合後にそろえ直す
+    for col in CATEGORY_COLUMNS + ['日付_和暦']:
+        if col in df_all.columns and not isinstance(df_all[col].dtype, pd.CategoricalDtype):
+            df_all[col] = df_all[col].astype('category')
+    return df_all
+
+def report_part_files(store_path=DEFAULT_STORE_PATH, part_names=None):
+    """年別ファイルのパスの一覧 (part_names を指定するとそのファイル名のものだけ)。"""
+    paths = sorted(glob.glob(os.path.join(store_path, '年=*', '*.parquet')) + glob.glob(os.path.join(store_path, '年=*', '*.csv')))
+    if part_names is None: return paths
+    return [path for path in paths if os.path.splitext(os.path.basename(path))[0] in part_names]
+
+def load_yearly_reports(csv_paths, store_path=DEFAULT_STORE_PATH):
+    """
+    年別の日報 (main.py/main2.py の出力、例: '令和6年大阪.csv') を読み込んで結合する関数。
+    年別ファイル (part_name='令和6年' で保存したもの) を優先し、年別ファイルにない年だけ従来のCSVを読む。
+    どちらも型付き (to_typed_report_frame) にそろえて返す。
+
+    Args:
+        csv_paths (list): 年別CSVのパス。ファイル名の '大阪' より前 ('令和6年') を年別ファイルの part_name とみなす。
+
+    Returns:
+        tuple: (結合したDataFrame (該当なしの場合は空), 読み込んだもの (年別ファイルの part_name またはCSVのパス) のリスト)
+    """
+    dfs, loaded = [], []
+    for csv_path in csv_paths:
+        part_name = os.path.basename(csv_path).rsplit('大阪', 1)[0]
+        df_part = read_report_partitions(store_path, part_names=[part_name]) if os.path.isdir(store_path) else pd.DataFrame()
+        if not df_part.empty:
+            loaded.append(f"{store_path}/年=*/{part_name}")
+        elif os.path.exists(csv_path):
+            try:
+                df_part = to_typed_report_frame(pd.read_csv(csv_path, encoding='utf_8_sig'))
+            except Exception as e:
+                print(f"  -> エラー: {csv_path} の読み込みに失敗しました - {e}")
+                continue
+            loaded.append(csv_path)
+        else:
+            continue
+        dfs.append(df_part)
+    if not dfs: return pd.DataFrame(), loaded
+    return _concat_typed(dfs), loaded
+
+if __name__ == '__main__':
+    print("osaka_store.py を直接実行しています（テストモード）")
+    for test_value in ['令和6年1月6日（土）', '平成31年4月30日', '令和元年5月1日（水）', '令和６年１２月２８日', '日付不明']:
+        print(f"  {test_value} -> {parse_japanese_date(test_value)}")
+    df_test = pd.DataFrame({
+        '品目': ['くろまぐろ', 'きわだ', 'くろまぐろ'], '数量': ['1,194', 1182, '-'], '単位': ['1Kg', '1Kg', '1Kg'],
+        '高値': [4104, '2700', 3000], '中値': [3780, 1944, np.nan], '安値': [2916, 1512, 2000],
+        '主な産地': ['長崎  他', '和歌山  沖縄  他', '長崎'],
+        '日付': ['令和5年12月28日（木）', '令和6年1月6日（土）', '令和6年1月6日（土）'],
+        '元ファイル': ['suiexcel (1).xls', 'suiexcel (120).xls', 'suiexcel (120).xls'],
+    })
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_report_partitions(df_test, tmp_dir, part_name='テスト')
+        df_read = read_report_partitions(tmp_dir, years=[2024])
+        print(df_read)
+        print(df_read.dtypes)
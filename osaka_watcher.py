@@ -0,0 +1,244 @@
+# osaka_watcher.py
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from market_query import append_osaka_report
+from osaka_ingest import REPORT_PARSERS, file_sha256, load_manifest, save_manifest, manifest_sha256_index, record_aliases
+from osaka_store import DEFAULT_STORE_PATH, report_year_label, write_report_partitions
+
+# --- 設定 ---
+report_folder_path = './04_大阪市場日報データ（水産）'
+consolidated_csv_path = '大阪市場日報_結合.csv'
+daily_aggregate_csv_path = '大阪市場日報_日次集計.csv'
+POLL_INTERVAL_SEC = 2.0
+# --- ここまで ---
+
+def _parse_report_quietly(layout, file_path):
+    """ワーカープロセスで日報を1ファイル処理する (ログ出力は抑制)。"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return REPORT_PARSERS[layout](file_path)
+
+def summarize_daily_report(df_report):
+    """1日分の日報から、日付・品目ごとの数量合計と高値/安値の日次集計を作る。"""
+    df_num = df_report.assign(
+        数量=pd.to_numeric(df_report['数量'], errors='coerce'),
+        高値=pd.to_numeric(df_report['高値'], errors='coerce'),
+        安値=pd.to_numeric(df_report['安値'], errors='coerce'),
+    )
+    return df_num.groupby(['日付', '品目'], sort=False).agg(
+        数量合計=('数量', 'sum'), 高値=('高値', 'max'), 安値=('安値', 'min'), 行数=('数量', 'size')
+    ).reset_index()
+
+def _append_csv(df, path):
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    df.to_csv(path, mode='a', header=write_header, index=False, encoding='utf_8_sig' if write_header else 'utf-8')
+
+class OsakaReportWatcher:
+    """
+    日報フォルダを監視し、新しく置かれた suiexcel*.xls を自動で取り込む常駐処理。
+    ファイルサイズが2回の確認で変わらなくなった (書き込みが終わった) ものから、
+    プロセスプールで解析し、(指定時) SQLite・年別の型付きファイル (osaka_store)・結合CSV・日次集計CSV に書き込んで、
+    マニフェストを更新する。年別ファイルは main.py/main2.py と同じ 年=YYYY/{和暦の年}.parquet に1日分ずつ加える。
+    取り込みに失敗したファイルはマニフェストに status='failed' (と エラー内容) を記録し、次回の起動時に取り込み直す。
+    """
+
+    def __init__(self, folder_path=report_folder_path, layout='layout2', max_workers=2,
+                 poll_interval=POLL_INTERVAL_SEC, db_path=None, store_path=DEFAULT_STORE_PATH):
+        self.folder_path = folder_path
+        self.layout = layout
+        self.poll_interval = poll_interval
+        self.db_path = db_path
+        self.store_path = store_path
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.manifest = load_manifest(folder_path)
+        self.pending_sizes = {}  # ファイル名 -> 前回確認時のサイズ
+        self.in_progress = set()
+        self.failed = set()  # この実行中に取り込みに失敗したファイル
+        self.in_flight_sha256 = {}  # 解析中のファイルの sha256 -> 取り込み完了を知らせる Event
+        self.write_lock = asyncio.Lock()
+
+    def _candidate_files(self):
+        names = []
+        for entry in os.scandir(self.folder_path):
+            if not entry.is_file(): continue
+            if not entry.name.startswith('suiexcel') or not entry.name.lower().endswith(('.xls', '.xlsx')): continue
+            if entry.name in self.manifest.get('aliases', {}) or entry.name in self.in_progress or entry.name in self.failed: continue
+            if self.manifest['files'].get(entry.name, {}).get('status') == 'ok': continue
+            names.append((entry.name, entry.stat().st_size))
+        return names
+
+    def _stable_files(self):
+        """前回の確認時からサイズが変わっていないファイルだけを返す。"""
+        stable = []
+        current = dict(self._candidate_files())
+        for name, size in current.items():
+            if self.pending_sizes.get(name) == size and size > 0:
+                stable.append(name)
+        self.pending_sizes = {name: size for name, size in current.items() if name not in stable}
+        return stable
+
+    async def _ingest_file(self, name):
+        file_path = os.path.join(self.folder_path, name)
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        sha256, claim = None, None
+        try:
+            try:
+                # 取り込み済みのファイルと同じ内容 (重複ダウンロード) なら解析せず、別名として記録する。
+                # 同じ内容のファイルが同時に届いた場合は、最初のファイルが sha256 を確保して解析し、
+                # 他のファイルはその取り込みが終わるのを待ってから判定する (失敗していれば自分で取り込む)
+                sha256 = await loop.run_in_executor(None, file_sha256, file_path)
+                while claim is None:
+                    async with self.write_lock:
+                        original = manifest_sha256_index(self.manifest).get(sha256)
+                        if original is not None:
+                            record_aliases(self.manifest, {name: (original, sha256)}, self.folder_path)
+                            save_manifest(self.folder_path, self.manifest)
+                            print(f"重複のためスキップ: {name} (= {original})")
+                            return
+                        in_flight = self.in_flight_sha256.get(sha256)
+                        if in_flight is None:
+                            claimed_sha256 = sha256
+                            claim = self.in_flight_sha256[claimed_sha256] = asyncio.Event()
+                    if claim is None:
+                        await in_flight.wait()
+                df_report, date_value = await self._parse_report(file_path)
+                parse_error = None
+            except Exception as e:
+                print(f"  -> ★★★ エラー: {name} - {e} ★★★")
+                df_report, date_value, parse_error = None, "日付不明", e
+
+            async with self.write_lock:
+                entry = {
+                    # 解析中の例外で失敗した場合、sha256 はマニフェストに記録しない (確保の解除には使う)
+                    'sha256': sha256 if parse_error is None else None, 'date': str(date_value), 'layout': self.layout,
+                    'ingested_at': datetime.now().isoformat(timespec='seconds'),
+                }
+                if df_report is None or df_report.empty:
+                    entry.update(status='failed', rows=0)
+                    print(f"取り込み失敗: {name} (日付: {date_value})")
+                else:
+                    try:
+                        self._write_report(df_report, date_value)
+                        entry.update(status='ok', rows=len(df_report))
+                        print(f"取り込み完了: {name} (日付: {date_value}, {len(df_report)} 行, {time.perf_counter() - start:.2f} 秒)")
+                    except Exception as e:
+                        entry.update(status='failed', rows=0, error=f"{type(e).__name__}: {e}")
+                        print(f"  -> ★★★ エラー(書き込み失敗): {name} - {e} ★★★")
+                if entry['status'] == 'failed':
+                    # 失敗したファイルはこの実行中は再試行しない (再起動すると取り込み直す)
+                    self.failed.add(name)
+                self.manifest['files'][name] = entry
+                save_manifest(self.folder_path, self.manifest)
+        finally:
+            if claim is not None:
+                # マニフェストの更新後に確保を解除し、同じ内容のファイルの待機を終わらせる
+                self.in_flight_sha256.pop(claimed_sha256, None)
+                claim.set()
+            self.in_progress.discard(name)
+
+    async def _parse_report(self, file_path):
+        """日報をプロセスプールで解析する。 (DataFrame または None, 日付) を返す。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _parse_report_quietly, self.layout, file_path)
+
+    def _write_report(self, df_report, date_value):
+        """
+        解析した日報を SQLite (指定時) → 年別ファイル → 結合CSV・日次集計CSV の順に書き込む。
+        年別ファイルは main.py/main2.py・ingest と同じく和暦の年ごとのファイル (年=2024/令和6年.parquet) に加える。
+        SQLite と年別ファイルは同じファイルの分を置き換えるため、取り込み直しても重複しない。
+        追記のみの CSV は最後に書くため、それより前で失敗した場合は CSV に行が残らない。
+        """
+        if self.db_path:
+            append_osaka_report(df_report, self.db_path)
+        write_report_partitions(df_report, self.store_path, part_name=report_year_label(date_value) or '日付不明', merge=True)
+        _append_csv(df_report, consolidated_csv_path)
+        _append_csv(summarize_daily_report(df_report), daily_aggregate_csv_path)
+
+    async def run(self, run_once=False):
+        print(f"監視を開始します: '{self.folder_path}' (間隔 {self.poll_interval} 秒, レイアウト {self.layout})")
+        tasks = set()
+        try:
+            while True:
+                for name in self._stable_files():
+                    self.in_progress.add(name)
+                    task = asyncio.create_task(self._ingest_file(name))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if run_once and not self.pending_sizes:
+                    if tasks: await asyncio.gather(*tasks)
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            if tasks: await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown()
+
+def run_self_test():
+    """
+    同じ内容の2ファイルが同時に届き、先に sha256 を確保したファイルの解析が例外で失敗する場合に、
+    もう一方が待ち続けずに自分で取り込むことを確認する (一時フォルダで実行し、日報の解析は合成データで置き換える)。
+    """
+    import tempfile
+
+    class FailFirstWatcher(OsakaReportWatcher):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.n_parsed = 0
+
+        async def _parse_report(self, file_path):
+            self.n_parsed += 1
+            if self.n_parsed == 1:
+                raise RuntimeError("テスト用の解析エラー")
+            df_report = pd.DataFrame({
+                '品目': ['くろまぐろ', 'きわだ'], '数量': [1194, 1182], '単位': ['1Kg', '1Kg'],
+                '高値': [4104, 2700], '中値': [3780, 1944], '安値': [2916, 1512], '主な産地': ['長崎  他', '和歌山  他'],
+                '日付': '令和6年1月6日（土）', '元ファイル': os.path.basename(file_path), '由来_行': [10, 11],
+            })
+            return df_report, '令和6年1月6日（土）'
+
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.chdir(tmp_dir):
+        os.makedirs('reports')
+        for name in ['suiexcel (1).xls', 'suiexcel (1) (2).xls']:
+            with open(os.path.join('reports', name), 'wb') as f:
+                f.write(b'same content')
+        watcher = FailFirstWatcher('reports', max_workers=1, poll_interval=0.05, store_path='store')
+        # 確保が解除されないと、2つ目のファイルが待ち続けて終わらない
+        asyncio.run(asyncio.wait_for(watcher.run(run_once=True), timeout=30))
+        statuses = sorted(entry['status'] for entry in watcher.manifest['files'].values())
+        assert statuses == ['failed', 'ok'], watcher.manifest
+        assert not watcher.in_flight_sha256 and not watcher.in_progress
+        failed_entry = next(entry for entry in watcher.manifest['files'].values() if entry['status'] == 'failed')
+        assert failed_entry['sha256'] is None
+    print("解析に失敗したファイルの sha256 の確保が解除され、同じ内容のファイルが取り込まれることを確認しました。")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='大阪日報フォルダを監視して自動で取り込む')
+    parser.add_argument('--folder', default=report_folder_path)
+    parser.add_argument('--layout', choices=sorted(REPORT_PARSERS), default='layout2')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL_SEC)
+    parser.add_argument('--db', default=None, help='追記先の SQLite (market_query.py のデータベース)')
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='年別の型付きファイルの保存先フォルダ')
+    parser.add_argument('--once', action='store_true', help='現在のファイルを取り込んだら終了する')
+    parser.add_argument('--self-test', action='store_true', help='重複ファイルの取り込みの動作確認を一時フォルダで実行する')
+    args = parser.parse_args(argv)
+    if args.self_test:
+        run_self_test()
+        return
+    watcher = OsakaReportWatcher(args.folder, args.layout, args.workers, args.interval, args.db, args.store)
+    try:
+        asyncio.run(watcher.run(run_once=args.once))
+    except KeyboardInterrupt:
+        print("\n監視を終了しました。")
+
+if __name__ == '__main__':
+    main()
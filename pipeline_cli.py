@@ -0,0 +1,323 @@
+# pipeline_cli.py
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from profiling import profile_stage
+
+# --- 設定 (各スクリプトの既定値と同じ) ---
+report_folder_path = './04_大阪市場日報データ（水産）'
+osaka_store_path = '大阪市場日報_年別'
+tokyo_file_paths = ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv']
+sapporo_file_path = 'Sapporo2014_2025.csv'
+osaka_file_path = 'Osaka2014_2025.csv'
+CACHE_DIR = '.pipeline_cache'
+export_dir = '分析結果_出力'
+# --- ここまで ---
+
+# ステージごとに、結果に影響するソースファイル (内容が変わるとキャッシュが無効になる)
+STAGE_CODE_FILES = {
+    'ingest': ['osaka_ingest.py', 'excel_cells.py'],
+    'consolidate': ['osaka_store.py'],
+    'preprocess': ['dataframe_loader.py', 'market_sources.py', 'lineage.py', 'data_preprocessor.py', 'string_dictionary.py', 'text_normalizer.py', 'memory_budget.py'],
+    'aggregate': ['price_aggregation.py', 'quantile_sketch.py'],
+    'report': [],
+    'verify': [],
+    'quality': ['data_quality.py'],
+    'forecast': ['maguro_subset.py', 'tuna_forecast.py'],
+    'export': [],
+}
+
+class StageCache:
+    """
+    ステージ出力の内容アドレス型キャッシュ。
+    ステージ名・入力ファイルの内容ハッシュ・上流ステージのキー・パラメータ・コードのハッシュから
+    キーを作り、同じキーの出力があれば再実行せずに再利用する (ビルドシステムのアクションキャッシュと同じ考え方)。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, force=False):
+        self.cache_dir = cache_dir
+        self.force = force
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self.index_path = os.path.join(cache_dir, 'file_hashes.json')
+        self.file_hashes = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.file_hashes = json.load(f)
+
+    def file_hash(self, path):
+        """ファイル内容の sha256。サイズと更新日時が同じ間は前回の計算結果を使う。"""
+        if not os.path.exists(path): return 'missing'
+        stat = os.stat(path)
+        stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+        cached = self.file_hashes.get(os.path.abspath(path))
+        if cached and cached['stamp'] == stamp: return cached['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.file_hashes[os.path.abspath(path)] = {'stamp': stamp, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def save_index(self):
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump(self.file_hashes, f, ensure_ascii=False)
+
+    def stage_key(self, stage_name, input_files=(), upstream_keys=(), params=None):
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+        payload = {
+            'stage': stage_name,
+            'inputs': sorted(self.file_hash(f) for f in input_files),
+            'upstream': list(upstream_keys),
+            'params': params or {},
+            'code': [self.file_hash(os.path.join(code_dir, f)) for f in STAGE_CODE_FILES.get(stage_name, [])],
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def run(self, stage_name, func, input_files=(), upstream_keys=(), params=None):
+        """
+        キャッシュがあれば読み込み、なければ func() を実行して保存する。
+        Returns:
+            tuple: (ステージ出力, ステージのキー)
+        """
+        key = self.stage_key(stage_name, input_files, upstream_keys, params)
+        object_path = os.path.join(self.cache_dir, 'objects', f"{stage_name}_{key[:16]}.pkl")
+        if os.path.exists(object_path) and not self.force:
+            print(f"[{stage_name}] 入力に変更がないため、キャッシュを使用します ({key[:12]})")
+            return pd.read_pickle(object_path), key
+        print(f"[{stage_name}] 実行します ({key[:12]})")
+        start = time.perf_counter()
+        with profile_stage(stage_name) as stage:
+            result = func()
+            stage.rows = len(result) if isinstance(result, pd.DataFrame) else None
+        pd.to_pickle(result, object_path)
+        self.save_index()
+        print(f"[{stage_name}] 完了: {time.perf_counter() - start:.1f} 秒")
+        return result, key
+
+# --- ステージ定義 (上流ステージはキャッシュ経由で呼び出す) ---
+
+def stage_ingest(cache, args):
+    from osaka_ingest import find_report_files, ingest_reports, dedupe_report_files, record_aliases, load_manifest, save_manifest
+    files = find_report_files(args.report_folder, include_processed=args.include_processed)
+    # 同じ内容のファイル (重複ダウンロード) は解析しない (除いたファイルはマニフェストに別名として記録)
+    files, duplicate_files = dedupe_report_files(files)
+    if duplicate_files:
+        save_manifest(args.report_folder, record_aliases(load_manifest(args.report_folder), duplicate_files, args.report_folder))
+    params = {'year': args.year, 'layout': args.layout}
+    df_year, _ = cache.run('ingest', lambda: ingest_reports(files, args.year, args.layout)[0], files, params=params)
+    if not df_year.empty:
+        from market_calendar import find_missing_trading_days
+        from osaka_store import parse_japanese_dates
+        # 日報の日付を大阪（本場）の営業日と比べ、日報のない営業日 (ファイルの取りこぼし) を表示する
+        missing_days = find_missing_trading_days(parse_japanese_dates(df_year['日付']), '大阪（本場）')
+        print(f"日報のない営業日: {len(missing_days)} 日" + (f" ({', '.join(missing_days[:10].strftime('%m/%d'))}{' ...' if len(missing_days) > 10 else ''})" if len(missing_days) else ''))
+    if not df_year.empty and args.format in ('parquet', 'both'):
+        from osaka_store import write_report_partitions
+        write_report_partitions(df_year, args.store, part_name=args.year)
+    if not df_year.empty and args.format in ('csv', 'both'):
+        output_filename = f"{args.year}大阪.csv"
+        df_year.to_csv(output_filename, index=False, encoding='utf_8_sig')
+        print(f"{output_filename} に保存しました ({len(df_year)} 行)")
+    return df_year
+
+def stage_audit(cache, args):
+    from osaka_archive_audit import find_archive_files, probe_archive, audit_archive, summarize_audit
+    # 日付の確認結果は osaka_archive_audit 側でファイル単位にキャッシュされ、変わったファイルだけ読み直す
+    files = find_archive_files(args.report_folder)
+    if not files:
+        print(f"'{args.report_folder}' に日報ファイルが見つかりませんでした。")
+        return pd.DataFrame()
+    df_index = probe_archive(files, max_workers=args.jobs)
+    df_issues = audit_archive(df_index)
+    summarize_audit(df_index, df_issues)
+    df_issues.to_csv(args.output, index=False, encoding='utf_8_sig')
+    print(f"\n監査結果を {args.output} に保存しました ({len(df_issues)} 行)")
+    return df_issues
+
+def stage_consolidate(cache, args):
+    from osaka_store import load_yearly_reports, report_part_files
+    # ingest の既定の保存先 (年別ファイル) を優先し、年別ファイルにない年だけCSVを読む
+    part_names = [os.path.basename(f).rsplit('大阪', 1)[0] for f in args.yearly_csvs]
+    input_files = list(args.yearly_csvs) + report_part_files(args.store, part_names)
+    df_merged, _ = cache.run('consolidate', lambda: load_yearly_reports(args.yearly_csvs, args.store)[0], input_files)
+    if not df_merged.empty:
+        df_merged.to_csv(args.output, index=False, encoding='utf_8_sig')
+        print(f"{args.output} に保存しました ({len(df_merged)} 行)")
+    return df_merged
+
+def stage_preprocess(cache, args):
+    from dataframe_loader import load_and_combine_market_data
+    from data_preprocessor import preprocess_market_data
+    from memory_budget import get_memory_budget
+    def preprocess():
+        # 由来 (元ファイル・行番号) を付けておき、quality などで見つかった行を元ファイルに戻せるようにする
+        df_raw = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path, encode_strings=True, lineage=True)
+        return preprocess_market_data(df_raw, n_jobs=args.jobs) if not df_raw.empty else df_raw
+    input_files = tokyo_file_paths + [sapporo_file_path, osaka_file_path]
+    # メモリ予算があると数値列・文字列列の型が変わる (値は同じ) ため、予算の有無でキャッシュを分ける
+    params = {'memory_budget': True} if get_memory_budget() is not None else None
+    return cache.run('preprocess', preprocess, input_files, params=params)
+
+def stage_aggregate(cache, args):
+    from price_aggregation import aggregate_market_prices
+    from quantile_sketch import build_group_sketches
+    df_cleaned, preprocess_key = stage_preprocess(cache, args)
+    def aggregate():
+        return {
+            'prices': aggregate_market_prices(df_cleaned, freq=args.freq),
+            'sketches': build_group_sketches(df_cleaned.dropna(subset=['卸売数量_kg換算', '単価_円perKg'])),
+        }
+    result, key = cache.run('aggregate', aggregate, upstream_keys=[preprocess_key], params={'freq': args.freq})
+    return df_cleaned, result, key
+
+def stage_report(cache, args):
+    from quantile_sketch import rollup_sketches, sketch_summary
+    df_cleaned, aggregates, _ = stage_aggregate(cache, args)
+    df_prices = aggregates['prices']
+    if df_prices.empty:
+        print("集計結果が空のため、レポートを作成できません。")
+        return
+    print("\n--- 魚種別 総取引数量ランキング (kg換算) ---")
+    print(df_prices.groupby('魚種（商品名）', observed=True)['総取引数量_kg'].sum().sort_values(ascending=False).head(10))
+    print("\n--- 市場別 総取引数量ランキング (kg換算) ---")
+    print(df_prices.groupby('市場名_正規化', observed=True)['総取引数量_kg'].sum().sort_values(ascending=False).head(10))
+    print("\n--- 市場別 単価の分位点 (スケッチ) ---")
+    print(sketch_summary(rollup_sketches(aggregates['sketches']['単価_円perKg'], level=0)))
+    df_prices.to_csv(args.output, index=False, encoding='utf_8_sig')
+    print(f"\n集計結果を {args.output} に保存しました ({len(df_prices)} 行)")
+
+def stage_verify(cache, args):
+    df_cleaned, _ = stage_preprocess(cache, args)
+    ton_unit_col = '数量単位（トン、箱、尾など）'
+    if ton_unit_col not in df_cleaned.columns:
+        print(f"元の数量単位列 '{ton_unit_col}' が見つかりません。")
+        return
+    df_ton = df_cleaned[
+        (df_cleaned['市場名_正規化'] == '札幌') &
+        (df_cleaned[ton_unit_col].fillna('').str.lower().isin(['トン', 't']))
+    ]
+    print(f"\n--- 札幌市場で元の単位が「トン」だったデータ: {len(df_ton)} 件 ---")
+    if df_ton.empty: return
+    print(df_ton['卸売数量'].describe())
+    print("\n--- 魚種別件数 (上位10) ---")
+    print(df_ton['魚種（商品名）'].value_counts().head(10))
+
+def stage_quality(cache, args):
+    from data_quality import screen_data_quality, summarize_quality_flags, QUALITY_FLAG_COL
+    from lineage import trace_rows
+    df_cleaned, preprocess_key = stage_preprocess(cache, args)
+    params = {'threshold': args.threshold}
+    df_flagged, _ = cache.run('quality', lambda: screen_data_quality(df_cleaned, threshold=args.threshold),
+                              upstream_keys=[preprocess_key], params=params)
+    print("\n--- 市場別 品質フラグ件数 ---")
+    print(summarize_quality_flags(df_flagged, group_col='市場名_正規化'))
+    df_flagged_rows = df_flagged[df_flagged[QUALITY_FLAG_COL] > 0]
+    # 元ファイルのパス・行番号を付けて保存する
+    pd.concat([df_flagged_rows, trace_rows(df_flagged_rows)], axis=1).to_csv(args.output, index=False, encoding='utf_8_sig')
+    print(f"\nフラグの付いた行を {args.output} に保存しました")
+    return df_flagged
+
+def stage_forecast(cache, args):
+    from maguro_subset import extract_maguro_data
+    from tuna_forecast import run_tuna_forecasts
+    df_cleaned, _ = stage_preprocess(cache, args)
+    # 系列ごとの推定結果は tuna_forecast 側でフィンガープリント単位にキャッシュされ、変わった系列だけ再推定される
+    df_forecast = run_tuna_forecasts(extract_maguro_data(df_cleaned), n_jobs=max(args.jobs, 1), output_path=args.output)
+    if not df_forecast.empty:
+        print(df_forecast[['市場名_正規化', '魚種（商品名）', '予測対象', '予測月', '予測値', 'バックテストMAPE(%)']].to_string(index=False))
+    return df_forecast
+
+def stage_export(cache, args):
+    from maguro_subset import extract_maguro_data
+    from maguro_rollup import maguro_rollup
+    from export_api import export_results
+    df_cleaned, aggregates, _ = stage_aggregate(cache, args)
+    df_maguro = extract_maguro_data(df_cleaned)
+    # 前処理済みデータはキャッシュから読んだ表をそのまま分割して書き込む (出力用のコピーは作らない)
+    frames = {'前処理済み_全市場': df_cleaned, 'マグロ_抽出データ': df_maguro,
+              'マグロ_階層別集計': maguro_rollup(df_maguro)[0],
+              f'市場別魚種別_集計_{args.freq}': aggregates['prices']}
+    print(f"\n--- {args.output_dir} に出力します ({args.format}) ---")
+    return export_results(frames, args.output_dir, args.format, compression=args.compression, chunk_rows=args.chunk_rows)
+
+STAGES = {
+    'ingest': stage_ingest,
+    'audit': stage_audit,
+    'consolidate': stage_consolidate,
+    'preprocess': stage_preprocess,
+    'aggregate': stage_aggregate,
+    'report': stage_report,
+    'verify': stage_verify,
+    'quality': stage_quality,
+    'forecast': stage_forecast,
+    'export': stage_export,
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='市場データ分析パイプライン (変更のあったステージのみ再実行)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='ステージ出力のキャッシュ先')
+    parser.add_argument('--force', action='store_true', help='キャッシュを使わず再実行する')
+    parser.add_argument('--memory-budget', default=None,
+                        help='読み込み・前処理のメモリ予算 (例: 2GB)。予算に近づくと型の縮小・中間データのディスク退避を行う (環境変数 MARKET_MEMORY_BUDGET と同じ)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('ingest', help='大阪日報Excelを年別ファイルにする (main.py/main2.py 相当)')
+    p.add_argument('--year', required=True, help='対象の年 (例: 令和6年)')
+    p.add_argument('--layout', choices=['layout1', 'layout2'], default='layout1', help='layout1=main.py, layout2=main2.py の形式')
+    p.add_argument('--report-folder', default=report_folder_path)
+    p.add_argument('--include-processed', action='store_true', help='処理済み* フォルダ内のファイルも対象にする')
+    p.add_argument('--format', choices=['parquet', 'csv', 'both'], default='parquet',
+                   help='parquet=年別の型付きファイル (大阪市場日報_年別/年=YYYY/), csv=従来の {年}大阪.csv')
+    p.add_argument('--store', default=osaka_store_path, help='年別ファイルの保存先フォルダ')
+
+    p = subparsers.add_parser('audit', help='大阪日報アーカイブ全体の日報の欠け・重複・年フォルダ違いを調べる')
+    p.add_argument('--report-folder', default=report_folder_path)
+    p.add_argument('--jobs', type=int, default=None, help='日付の確認の並列数 (既定は CPU 数)')
+    p.add_argument('--output', default='大阪日報_監査結果.csv')
+
+    p = subparsers.add_parser('consolidate', help='年別の日報を結合する (merged.py 相当)')
+    p.add_argument('yearly_csvs', nargs='+', help='年別CSV (例: 令和6年大阪.csv)。同じ年の年別ファイルがあればそちらを読む')
+    p.add_argument('--store', default=osaka_store_path, help='年別ファイルの保存先フォルダ')
+    p.add_argument('--output', default='大阪市場日報_結合.csv')
+
+    for name, help_text in [('preprocess', '全市場データの読み込みと前処理'),
+                            ('aggregate', '加重平均単価の集計と分位点スケッチ作成'),
+                            ('report', '集計結果のランキング表示とCSV出力'),
+                            ('verify', '札幌市場のトン単位データの検証'),
+                            ('quality', '全データの品質チェック (外れ値・単位の取り違え疑い)'),
+                            ('forecast', '全市場・全マグロ魚種の翌月の単価・数量予測'),
+                            ('export', '前処理済みデータ・マグロ抽出データ・集計結果を Parquet/CSV/Excel に出力')]:
+        p = subparsers.add_parser(name, help=help_text)
+        p.add_argument('--jobs', type=int, default=1, help='前処理 (forecast では予測) の並列数')
+        if name in ('aggregate', 'report', 'export'):
+            p.add_argument('--freq', default='M', help='集計頻度 (D/W/M)')
+        if name == 'report':
+            p.add_argument('--output', default='市場別魚種別_集計.csv')
+        if name == 'quality':
+            p.add_argument('--threshold', type=float, default=5.0, help='外れ値とみなすロバストzスコア')
+            p.add_argument('--output', default='品質フラグ_該当行.csv')
+        if name == 'forecast':
+            p.add_argument('--output', default='マグロ予測_結果.csv')
+        if name == 'export':
+            p.add_argument('--format', choices=['parquet', 'csv', 'xlsx'], default='parquet')
+            p.add_argument('--compression', default=None, help='parquet: snappy/zstd/gzip など, csv: gzip/bz2/xz')
+            p.add_argument('--chunk-rows', type=int, default=100_000, help='1回に書き込む行数 (メモリ使用量の上限の目安)')
+            p.add_argument('--output-dir', default=export_dir)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.memory_budget:
+        from memory_budget import set_memory_budget
+        set_memory_budget(args.memory_budget)
+    cache = StageCache(args.cache_dir, force=args.force)
+    STAGES[args.command](cache, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# preprocess_differential.py
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+import numpy as np
+
+from data_preprocessor import preprocess_market_data
+from market_sources import market_name_mapping
+from memory_budget import MemoryBudget
+from string_dictionary import StringDictionary, encode_text_columns
+from text_normalizer import normalize_width
+
+# --- 設定 ---
+N_TRIALS = 20
+N_ROWS = 3000
+BASE_SEED = 0
+# 不一致が見つかった入力 (縮小後) の保存先
+FAILURE_DIR = 'differential_failures'
+# --- ここまで ---
+
+# 生成する値の候補。前処理の規則 (data_preprocessor のステップ3〜6) の分岐をすべて通るように、
+# 同義語・全角/半角の別表記・空文字・欠損を含める。
+MARKET_VALUES = sorted(market_name_mapping()) + ['札幌', '大阪（本場）', '名古屋', '', np.nan]
+SPECIES_VALUES = [
+    'まぐろ（生鮮）', 'まぐろ（冷凍）', 'めばち（冷凍）', '本まぐろ', 'めばち', 'くろまぐろ', 'きわだ',
+    'さば', 'あじ', 'ｻﾊﾞ', '小計', ' 小計', 'くろまぐろ　', np.nan,
+]
+# 基準の実装 (最初の data_preprocessor、全角/半角の統一なし) の同義語リストのすべての値と、その出力。
+# 卸売数量 120・安値 1500・中値 2000 の行を1行ずつ入力したときの値で、基準の実装で求めて固定したもの。
+# 数量単位（kg、箱、尾など） の値 -> 卸売数量_kg換算 (数量単位（トン、箱、尾など） は空、価格単位は 円/kg)
+BASELINE_PRIMARY_UNIT_OUTPUTS = {
+    'kg': 120.0, 'キロ': 120.0, 'キログラム': 120.0, 'ｋｇ': 120.0, 'キログラム(kg)': 120.0, 'ｋｇ(キログラム)': 120.0,
+    '1kg': 120.0, '1ｋｇ': 120.0, '1キログラム': 120.0, '1ｋｇ(キログラム)': 120.0,
+    '箱': np.nan, '尾': np.nan, '束': np.nan, '枚': np.nan, 'ケース': np.nan, '袋': np.nan, 'パック': np.nan, 'ｹｰｽ': np.nan,
+    'p': np.nan, 'CS': np.nan, 'cs': np.nan, 'はい': np.nan, '連': np.nan, 'ｶｰﾄﾝ': np.nan, 'ｾｯﾄ': np.nan, 'ネット': np.nan,
+    'NETTO': np.nan, 'kg以外': np.nan, 'ｶｺﾞ': np.nan, 'トン': np.nan, 'ｔ': np.nan, 't': np.nan,
+}
+# 数量単位（トン、箱、尾など） の値 -> 卸売数量_kg換算 (数量単位（kg、箱、尾など） は空、価格単位は 円/kg)。トンも kg として扱う
+BASELINE_SECONDARY_UNIT_OUTPUTS = dict(BASELINE_PRIMARY_UNIT_OUTPUTS, **{'トン': 120.0, 'ｔ': 120.0, 't': 120.0})
+# 価格単位 の値 -> (価格単位_正規化, 単価_円perKg) (数量単位は kg)
+BASELINE_PRICE_UNIT_OUTPUTS = {
+    '円/kg': ('円/kg', 2000.0), '円/キロ': ('円/kg', 2000.0), '/キロ': ('円/kg', 2000.0), '円': ('円/kg', 2000.0),
+    '円/トン': ('円/kg', 2.0), '円/ｔ': ('円/kg', 2.0), '円/枚': ('円/枚', np.nan),
+    '円/箱': ('円/箱', np.nan), '円/尾': ('円/尾', np.nan), '円/束': ('円/束', np.nan), '円/ケース': ('円/ケース', np.nan),
+    '円/袋': ('円/袋', np.nan), '円/パック': ('円/パック', np.nan), '円/p': ('円/p', np.nan), '円/cs': ('円/cs', np.nan),
+}
+
+# ランダムな入力の単位の候補は、基準の実装の同義語リストのすべての値に、大文字・半角カナなどの別表記と空欄・欠損を加えたもの
+PRIMARY_UNIT_VALUES = list(BASELINE_PRIMARY_UNIT_OUTPUTS) + [
+    'KG', 'ｷﾛ', '1Kg', 'P', 'カートン', 'セット', 'netto', 'カゴ', '不明な単位', '', 'nan', np.nan,
+]
+SECONDARY_UNIT_VALUES = list(BASELINE_SECONDARY_UNIT_OUTPUTS) + ['T', '', np.nan, np.nan, np.nan]
+PRICE_UNIT_VALUES = list(BASELINE_PRICE_UNIT_OUTPUTS) + [
+    '円/KG', '円/t', '円/P', '円/ｹｰｽ', 'ドル/kg', '', 'nan', np.nan,
+]
+
+def generate_market_frame(n_rows, seed):
+    """
+    load_and_combine_market_data と同じ列の、ランダムな市場データを作る関数。
+    市場名・魚種・数量単位・価格単位の組み合わせを一様に選び、完全な重複行・文字列の数量・欠損も混ぜる。
+    """
+    rng = np.random.default_rng(seed)
+    def pick(values):
+        return rng.choice(np.array(values, dtype='object'), n_rows)
+    def maybe_missing(values, rate):
+        return np.where(rng.random(n_rows) < rate, np.nan, values)
+
+    dates = pd.Timestamp('2014-01-01') + pd.to_timedelta(rng.integers(0, 365 * 11, n_rows), unit='D')
+    date_text = np.where(rng.random(n_rows) < 0.5, dates.strftime('%Y-%m-%d'), dates.strftime('%Y/%m/%d')).astype('object')
+    date_text[rng.random(n_rows) < 0.01] = '日付不明'
+    quantity = maybe_missing(rng.integers(-5, 5000, n_rows).astype('float64'), 0.05).astype('object')
+    # 文字列の数量 (カンマ区切りは数値に変換できず欠損になる)
+    as_text = rng.random(n_rows) < 0.05
+    quantity[as_text] = [f"{value:,.0f}" if value == value else '' for value in quantity[as_text]]
+
+    df = pd.DataFrame({
+        'ID': rng.integers(0, max(n_rows // 2, 1), n_rows),
+        '日付': date_text,
+        '市場名': pick(MARKET_VALUES),
+        '魚種（商品名）': pick(SPECIES_VALUES),
+        '産地': pick(['長崎', '三重', 'ﾉﾙｳｪｰ', '', np.nan]),
+        '銘柄・規格（サイズ／グレード）': pick(['大', '小', 'Ｌ', np.nan]),
+        '販売方法': pick(['せり', '相対', np.nan]),
+        '卸売数量': quantity,
+        '数量単位（kg、箱、尾など）': pick(PRIMARY_UNIT_VALUES),
+        '数量単位（トン、箱、尾など）': pick(SECONDARY_UNIT_VALUES),
+        '安値（円）': maybe_missing(rng.integers(0, 9000, n_rows).astype('float64'), 0.2),
+        '中値（円）': maybe_missing(rng.integers(0, 9000, n_rows).astype('float64'), 0.3),
+        '高値（円）': maybe_missing(rng.integers(0, 9000, n_rows).astype('float64'), 0.1),
+        '平均価格（円）': np.nan,
+        '価格単位（円/kg、円/箱など）': pick(PRICE_UNIT_VALUES),
+        '備考（メモや特記事項など）': np.nan,
+        '卸売数量計': np.nan,
+    })
+    # 完全な重複行 (ステップ2で削除される)
+    n_duplicates = n_rows // 20
+    if n_duplicates:
+        df = pd.concat([df, df.sample(n_duplicates, random_state=seed)], ignore_index=True)
+    return df
+
+# --- 比較する実装 (エンジン) ---
+
+def _quiet(func, df):
+    # ログ出力と、日付の書式推定の警告 (ランダムな日付文字列で毎回出る) は表示しない
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        return func(df)
+
+def reference_engine(df):
+    """基準の実装: 逐次の preprocess_market_data。"""
+    return preprocess_market_data(df.copy(), n_jobs=1, normalization_cache_path=None)
+
+def parallel_engine(df):
+    """ステップ2〜6を市場名ごとにプロセスプールで並列実行する。"""
+    return preprocess_market_data(df.copy(), n_jobs=3, normalization_cache_path=None)
+
+def encoded_engine(df):
+    """文字列列を共通辞書の整数コード (category 型) にしてから前処理する (encode_strings=True と同じ)。"""
+    df_encoded = df.copy()
+    encode_text_columns(df_encoded, dictionary=StringDictionary())
+    return preprocess_market_data(df_encoded, n_jobs=1, normalization_cache_path=None)
+
+def budget_engine(df):
+    """メモリ予算を極端に小さくして、重複除去の前の表を Parquet に退避する経路で前処理する。"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        budget = MemoryBudget(0.001, spill_dir=spill_dir)
+        return preprocess_market_data(df.copy(), n_jobs=1, normalization_cache_path=None, memory_budget=budget)
+
+# 新しい実装は register_engine で追加する (基準の実装と同じ入力で実行し、出力が一致することを確認する)
+ENGINES = {
+    'parallel': parallel_engine,
+    'encoded': encoded_engine,
+    'budget': budget_engine,
+}
+
+def register_engine(name, func):
+    ENGINES[name] = func
+
+def _comparable(df):
+    """category 型は元の値 (object 型) に、縮小した数値型 (memory_budget の float32 など) は 64 ビットに戻して比較する。"""
+    df_out = df.copy()
+    for col in df_out.columns:
+        dtype = df_out[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            df_out[col] = df_out[col].astype('object')
+        elif dtype.kind == 'f':
+            df_out[col] = df_out[col].astype('float64')
+        elif dtype.kind in 'iu' and not pd.api.types.is_extension_array_dtype(dtype):
+            df_out[col] = df_out[col].astype('int64')
+    return df_out
+
+def compare_outputs(df_expected, df_actual):
+    """2つの前処理結果が (行・列・値・インデックスとも) 一致すれば None、違えばその内容を返す。"""
+    try:
+        # float32 程度の誤差も不一致として検出するため、許容誤差なしで比べる
+        pd.testing.assert_frame_equal(_comparable(df_actual), _comparable(df_expected), check_exact=True)
+    except AssertionError as e:
+        return str(e)
+    return None
+
+# --- 前処理の規則 (出力が満たすべき性質) ---
+
+def _normalized_text(series):
+    """ステップ1・5と同じく、全角/半角を統一して小文字の文字列にする。"""
+    return series.map(lambda value: normalize_width(value) if isinstance(value, str) else value).astype(str).str.lower()
+
+def check_properties(df_input, df_output):
+    """
+    前処理の主な規則が守られているかを確認し、違反の一覧 (説明文のリスト) を返す。
+    出力の各行は、インデックスで入力の行と対応させる。
+    """
+    violations = []
+    def expect(condition, message):
+        n_bad = int((~condition).sum())
+        if n_bad: violations.append(f"{message}: {n_bad} 行")
+
+    df_in = df_input.loc[df_output.index]
+    primary = _normalized_text(df_in['数量単位（kg、箱、尾など）'])
+    secondary = _normalized_text(df_in['数量単位（トン、箱、尾など）'])
+    price_unit = _normalized_text(df_in['価格単位（円/kg、円/箱など）'])
+    quantity = pd.to_numeric(df_in['卸売数量'], errors='coerce')
+    unit = df_output['数量単位_正規化'].astype('object')
+    kg_quantity = df_output['卸売数量_kg換算']
+    unit_price = df_output['単価_円perKg']
+    mid, low = df_output['中値（円）'], df_output['安値（円）']
+    species = df_output['魚種（商品名）'].astype('object')
+
+    expect(species != '小計', "「小計」の行が残っている")
+    # トン表記でも数量は1000倍しない (kg換算は卸売数量そのまま、または欠損)
+    expect(kg_quantity.isna() | (kg_quantity == quantity), "卸売数量_kg換算 が卸売数量と異なる")
+    expect((unit == 'kg') | kg_quantity.isna(), "kg 以外の単位に kg換算の数量がある")
+    is_ton_only = secondary.isin(['トン', 't']) & primary.isin(['nan', ''])
+    expect(~is_ton_only | (unit == 'kg'), "トン表記の行が kg として扱われていない")
+    # 両方の単位列が空で数量が正なら kg とみなす
+    is_default_kg = primary.isin(['nan', '']) & secondary.isin(['nan', '']) & (quantity > 0)
+    expect(~is_default_kg | (unit == 'kg'), "単位が空の行が kg として扱われていない")
+    # 大阪のくろまぐろ・きわだで価格単位が空なら円/kg
+    is_osaka_nan_price = ((df_output['市場名_正規化'].astype('object') == '大阪（本場）') & species.isin(['くろまぐろ', 'きわだ'])
+                          & price_unit.isin(['nan', '']))
+    expect(~is_osaka_nan_price | (df_output['価格単位_正規化'].astype('object') == '円/kg'), "大阪のマグロの空の価格単位が円/kgになっていない")
+    # 単価は中値 (なければ安値) を単位係数で割ったもの
+    base_price = mid.where(mid.notna(), low)
+    is_per_kg = price_unit.isin(['円/kg', '円/キロ', '/キロ', '円']) | is_osaka_nan_price
+    is_per_ton = price_unit.isin(['円/トン', '円/t'])
+    expect(~is_per_kg | np.isclose(unit_price, base_price, equal_nan=True), "円/kg の単価が中値/安値と異なる")
+    expect(~is_per_ton | np.isclose(unit_price, base_price / 1000, equal_nan=True), "円/トン の単価が中値/安値の1/1000でない")
+    expect(is_per_kg | is_per_ton | unit_price.isna(), "価格単位が kg/トン 以外の行に単価がある")
+    return violations
+
+# --- 基準の実装の固定出力との比較 ---
+
+def baseline_case_frame():
+    """
+    BASELINE_*_OUTPUTS の各値を1行ずつ入力にした DataFrame と、その期待する出力
+    (卸売数量_kg換算・価格単位_正規化・単価_円perKg) を返す。
+    """
+    cases = ([(unit, np.nan, '円/kg', kg_quantity, '円/kg', 2000.0) for unit, kg_quantity in BASELINE_PRIMARY_UNIT_OUTPUTS.items()]
+             + [(np.nan, unit, '円/kg', kg_quantity, '円/kg', 2000.0) for unit, kg_quantity in BASELINE_SECONDARY_UNIT_OUTPUTS.items()]
+             + [('kg', np.nan, price_unit, 120.0, normalized, unit_price)
+                for price_unit, (normalized, unit_price) in BASELINE_PRICE_UNIT_OUTPUTS.items()])
+    n_cases = len(cases)
+    df_input = pd.DataFrame({
+        'ID': np.arange(n_cases),
+        '日付': pd.date_range('2020-01-01', periods=n_cases).strftime('%Y-%m-%d'),  # 行ごとに日付を変えて重複行にしない
+        '市場名': '札幌', '魚種（商品名）': 'まぐろ', '産地': '長崎', '銘柄・規格（サイズ／グレード）': '大', '販売方法': 'せり',
+        '卸売数量': 120.0,
+        '数量単位（kg、箱、尾など）': [case[0] for case in cases],
+        '数量単位（トン、箱、尾など）': [case[1] for case in cases],
+        '安値（円）': 1500.0, '中値（円）': 2000.0, '高値（円）': 2500.0, '平均価格（円）': np.nan,
+        '価格単位（円/kg、円/箱など）': [case[2] for case in cases],
+        '備考（メモや特記事項など）': np.nan, '卸売数量計': np.nan,
+    })
+    df_expected = pd.DataFrame({
+        '卸売数量_kg換算': [case[3] for case in cases],
+        '価格単位_正規化': pd.array([case[4] for case in cases], dtype='object'),
+        '単価_円perKg': [case[5] for case in cases],
+    })
+    return df_input, df_expected
+
+def check_baseline_outputs(engine_names=None):
+    """
+    基準の実装 (reference) と各エンジンの出力が、最初の実装で求めて固定した出力 (BASELINE_*_OUTPUTS) と一致するか確認する。
+    reference は現在の逐次の実装のため、ランダムな入力の比較だけでは最初の実装からの変化を検出できない。
+
+    Returns:
+        list: (エンジン名, 説明) の不一致の一覧 (空ならすべて一致)。
+    """
+    df_input, df_expected = baseline_case_frame()
+    engines = dict(reference=reference_engine, **{name: ENGINES[name] for name in (list(ENGINES) if engine_names is None else engine_names)})
+    failures = []
+    for name, engine in engines.items():
+        df_output = _quiet(engine, df_input)
+        df_actual = _comparable(df_output.reindex(df_expected.index)[list(df_expected.columns)])
+        try:
+            pd.testing.assert_frame_equal(df_actual, df_expected, check_exact=True)
+            print(f"  基準の実装の固定出力 / {name}: 一致 ({len(df_expected)} 行)")
+        except AssertionError as e:
+            print(f"  基準の実装の固定出力 / {name}: ★不一致★")
+            print(f"    {str(e).splitlines()[0]}")
+            failures.append((name, str(e)))
+    return failures
+
+# --- 実行 ---
+
+def find_failure(df_input, engine):
+    """入力に対して基準の実装と engine を比較し、不一致 (または規則違反) があればその説明を返す。"""
+    df_expected = _quiet(reference_engine, df_input)
+    violations = check_properties(df_input, df_expected)
+    if violations:
+        return "基準の実装の規則違反: " + ' / '.join(violations)
+    try:
+        df_actual = _quiet(engine, df_input)
+    except Exception as e:
+        return f"実行時エラー: {e!r}"
+    return compare_outputs(df_expected, df_actual)
+
+def shrink_failure(df_input, engine, min_rows=1):
+    """
+    不一致が再現する範囲で入力の行を減らす (半分ずつ削る)。原因の調査がしやすい小さな入力を返す。
+    """
+    df_current = df_input
+    chunk = len(df_current) // 2
+    while chunk >= min_rows:
+        reduced = False
+        for start in range(0, len(df_current), chunk):
+            df_candidate = df_current.drop(df_current.index[start:start + chunk])
+            if len(df_candidate) and find_failure(df_candidate.reset_index(drop=True), engine) is not None:
+                df_current = df_candidate.reset_index(drop=True)
+                reduced = True
+                break
+        if not reduced: chunk //= 2
+    return df_current
+
+def run_differential_checks(engine_names=None, n_trials=N_TRIALS, n_rows=N_ROWS, base_seed=BASE_SEED, failure_dir=FAILURE_DIR):
+    """
+    ランダムな入力で、基準の実装と各エンジンの出力が一致するか、基準の実装が規則を満たすかを確認する関数。
+    不一致の入力は行を減らしてから failure_dir に pickle で保存する (pd.read_pickle で再現できる)。
+
+    Returns:
+        list: (エンジン名, シード, 説明) の不一致の一覧 (空ならすべて一致)。
+    """
+    engine_names = list(ENGINES) if engine_names is None else list(engine_names)
+    failures = []
+    for trial in range(n_trials):
+        seed = base_seed + trial
+        df_input = generate_market_frame(n_rows, seed)
+        for name in engine_names:
+            start = time.perf_counter()
+            failure = find_failure(df_input, ENGINES[name])
+            status = '一致' if failure is None else '★不一致★'
+            print(f"  シード {seed} / {name}: {status} ({time.perf_counter() - start:.1f} 秒)")
+            if failure is None: continue
+            print(f"    {failure.splitlines()[0] if failure else ''}")
+            df_small = shrink_failure(df_input, ENGINES[name])
+            os.makedirs(failure_dir, exist_ok=True)
+            path = os.path.join(failure_dir, f"{name}_seed{seed}.pkl")
+            df_small.to_pickle(path)
+            print(f"    -> {len(df_small)} 行まで縮小した入力を {path} に保存しました")
+            failures.append((name, seed, failure))
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='preprocess_market_data の基準の実装と高速化した実装 (エンジン) の出力を比較する')
+    parser.add_argument('--engines', nargs='*', choices=sorted(ENGINES), help='比較するエンジン (既定: すべて)')
+    parser.add_argument('--trials', type=int, default=N_TRIALS, help='ランダムな入力の数')
+    parser.add_argument('--rows', type=int, default=N_ROWS, help='1つの入力の行数')
+    parser.add_argument('--seed', type=int, default=BASE_SEED, help='最初のシード (シードごとに入力が決まる)')
+    args = parser.parse_args()
+
+    print(f"差分テスト: {args.trials} 入力 × {args.rows} 行, エンジン: {args.engines or sorted(ENGINES)}")
+    found = check_baseline_outputs(args.engines or None)
+    found += run_differential_checks(args.engines or None, args.trials, args.rows, args.seed)
+    if found:
+        print(f"\n★ {len(found)} 件の不一致が見つかりました。")
+        sys.exit(1)
+    print("\nすべてのエンジンの出力が基準の実装と一致しました。")
@@ -0,0 +1,82 @@
+# price_aggregation.py
+
+import pandas as pd
+import numpy as np
+
+from lineage import LINEAGE_FILE_COL, LINEAGE_RUN_COL
+
+DEFAULT_GROUP_KEYS = ['市場名_正規化', '魚種（商品名）']
+
+def aggregate_market_prices(df, freq='M', group_keys=None, date_col='日付',
+                            price_col='単価_円perKg', quantity_col='卸売数量_kg換算'):
+    """
+    前処理済みデータから、任意の頻度・任意のグループキーで数量加重平均単価などを集計する関数。
+    行レベルの単価を単純平均するのではなく、取引数量で重み付けした平均単価を
+    1回の groupby で計算する。
+
+    Args:
+        df (pandas.DataFrame): preprocess_market_data の出力。
+        freq (str): 集計頻度 ('D', 'W', 'M' など pandas のオフセット文字列)。
+        group_keys (list): 日付以外のグループキー。None の場合は市場・魚種。
+            空リストの場合は全体で1系列として集計し、取引のない期間も行として残す。
+        date_col (str): 日付列名。
+        price_col (str): 単価列名 (円/kg)。
+        quantity_col (str): 数量列名 (kg換算)。
+
+    Returns:
+        pandas.DataFrame: グループキー・日付ごとの
+            加重平均単価_円perKg, 単純平均単価_円perKg, 総取引数量_kg, 取引件数。
+            df に由来の列 (lineage) がある場合は、由来_ファイル (グループの全行が同じファイルならその番号、
+            複数のファイルにまたがる場合は -1) と 由来_実行 (最新の実行番号) も付ける。
+            必要な列がない場合は空のDataFrame。
+    """
+    group_keys = list(DEFAULT_GROUP_KEYS if group_keys is None else group_keys)
+    required_cols = group_keys + [date_col, price_col, quantity_col]
+    missing_cols = [col for col in required_cols if col not in df.columns]
+    if missing_cols:
+        print(f"集計に必要な列がありません: {missing_cols}")
+        return pd.DataFrame()
+
+    lineage_cols = [LINEAGE_FILE_COL, LINEAGE_RUN_COL] if all(col in df.columns for col in (LINEAGE_FILE_COL, LINEAGE_RUN_COL)) else []
+    df_work = df[required_cols + lineage_cols].dropna(subset=[date_col, price_col, quantity_col])
+    df_work = df_work.assign(_取引金額=df_work[price_col].to_numpy() * df_work[quantity_col].to_numpy())
+
+    grouped = df_work.groupby(group_keys + [pd.Grouper(key=date_col, freq=freq)], observed=True, sort=True)
+    aggregations = {
+        '総取引数量_kg': (quantity_col, 'sum'),
+        '_取引金額': ('_取引金額', 'sum'),
+        '_単価合計': (price_col, 'sum'),
+        '取引件数': (price_col, 'size'),
+    }
+    if lineage_cols:
+        aggregations.update({
+            '_由来_最小': (LINEAGE_FILE_COL, 'min'), '_由来_最大': (LINEAGE_FILE_COL, 'max'),
+            LINEAGE_RUN_COL: (LINEAGE_RUN_COL, 'max'),
+        })
+    df_agg = grouped.agg(**aggregations)
+
+    total_quantity = df_agg['総取引数量_kg'].where(df_agg['総取引数量_kg'] > 0)
+    trade_count = df_agg['取引件数'].where(df_agg['取引件数'] > 0)
+    df_agg['加重平均単価_円perKg'] = df_agg['_取引金額'] / total_quantity
+    df_agg['単純平均単価_円perKg'] = df_agg['_単価合計'] / trade_count
+    output_cols = ['加重平均単価_円perKg', '単純平均単価_円perKg', '総取引数量_kg', '取引件数']
+    if lineage_cols:
+        df_agg[LINEAGE_FILE_COL] = df_agg['_由来_最小'].where(df_agg['_由来_最小'] == df_agg['_由来_最大'], -1)
+        output_cols += lineage_cols
+    df_agg = df_agg[output_cols]
+    return df_agg.reset_index()
+
+if __name__ == '__main__':
+    print("price_aggregation.py を直接実行しています（テストモード）")
+    test_data = {
+        '日付': pd.to_datetime(['2023-01-05', '2023-01-20', '2023-01-25', '2023-02-03', '2023-02-10', '2023-04-01']),
+        '市場名_正規化': ['東京中央', '東京中央', '札幌', '東京中央', '札幌', '東京中央'],
+        '魚種（商品名）': ['まぐろ（生鮮）'] * 6,
+        '単価_円perKg': [3000.0, 1000.0, 2500.0, 2000.0, np.nan, 1800.0],
+        '卸売数量_kg換算': [10.0, 990.0, 50.0, 100.0, 20.0, 0.0],
+    }
+    df_test = pd.DataFrame(test_data)
+    print("\n市場・魚種別の月次集計:")
+    print(aggregate_market_prices(df_test, freq='M'))
+    print("\n全体1系列の月次集計 (取引のない月も残る):")
+    print(aggregate_market_prices(df_test, freq='M', group_keys=[]))
@@ -0,0 +1,272 @@
+# profiling.py
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import html
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 環境変数で有効化する (スクリプトの変更は不要)
+#   MARKET_PROFILE=1        ステージごとの時間・メモリ・行数を記録
+#   MARKET_PROFILE=cprofile  さらにステージごとに cProfile の上位関数を記録
+#   MARKET_PROFILE_REPORT   レポートの出力先 (拡張子なし、既定 profile_report → .json と .html)
+PROFILE_MODE = os.environ.get('MARKET_PROFILE', '').strip().lower()
+PROFILE_ENABLED = PROFILE_MODE not in ('', '0', 'false', 'off')
+PROFILE_CPROFILE = PROFILE_MODE == 'cprofile'
+DEFAULT_REPORT_PATH = os.environ.get('MARKET_PROFILE_REPORT', 'profile_report')
+CPROFILE_TOP_N = 20
+# 実行中のステージの常駐メモリを測る間隔 (秒、psutil がある場合)
+RSS_SAMPLE_INTERVAL_SEC = 0.05
+
+_records = []
+_stack = []
+_active_profiler = None
+_open_section = None
+_run_started = datetime.now()
+_run_started_perf = time.perf_counter()
+_rss_sampler = None
+
+def _current_rss_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024**2
+    return None
+
+def _peak_rss_mb():
+    """プロセス開始からの最大常駐メモリ (MB)。取得できない環境では None。"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024  # macOS はバイト、Linux は KB
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024**2
+    return None
+
+def _sample_rss_loop():
+    """実行中のすべてのステージについて、常駐メモリを一定間隔で測って最大値を更新し続ける (デーモンスレッド)。"""
+    while True:
+        rss = _current_rss_mb()
+        # 測定してからスタックを読むので、ここで更新するのは測定時点で実行中だったステージだけ
+        for record in list(_stack):
+            if record.peak_rss_mb is None or rss > record.peak_rss_mb:
+                record.peak_rss_mb = rss
+        time.sleep(RSS_SAMPLE_INTERVAL_SEC)
+
+def _start_rss_sampler():
+    global _rss_sampler
+    if psutil is not None and _rss_sampler is None:
+        _rss_sampler = threading.Thread(target=_sample_rss_loop, name='profiling-rss', daemon=True)
+        _rss_sampler.start()
+
+def _stage_peak_rss_mb(sampled_peak, rss_after, high_water_before, high_water_after):
+    """
+    ステージ自身の最大常駐メモリ (MB) を決める。
+    プロセスの最大常駐メモリ (high-water mark) がステージ中に更新された場合は、その値がステージ中の最大値そのもの。
+    更新されなかった場合は psutil で測った値 (ステージ開始・終了時と実行中の測定) の最大値を使い、
+    psutil がない環境では不明 (None) とする。
+    """
+    candidates = [value for value in (sampled_peak, rss_after) if value is not None]
+    if high_water_before is not None and high_water_after is not None and high_water_after > high_water_before:
+        candidates.append(high_water_after)
+    return max(candidates) if candidates else None
+
+def _count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)): return len(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], (pd.DataFrame, pd.Series)): return len(value[0])
+    return None
+
+class StageRecord:
+    """1ステージ分の計測値。with profile_stage(...) as stage: で受け取り、stage.rows に処理行数を設定できる。"""
+
+    def __init__(self, name, path, rows=None):
+        self.name = name
+        self.started_sec = None
+        self.path = path
+        self.rows = rows
+        self.wall_sec = None
+        self.cpu_sec = None
+        self.peak_rss_mb = None
+        self.rss_delta_mb = None
+        self.top_functions = None
+        self.error = None
+
+    def to_dict(self):
+        return {key: value for key, value in self.__dict__.items()}
+
+class _NullStage:
+    """計測が無効なときに返すダミー (属性の設定は無視される)。"""
+    rows = None
+
+@contextlib.contextmanager
+def profile_stage(name, rows=None):
+    """
+    ブロックの実行時間 (wall/CPU)・最大常駐メモリ・常駐メモリの増減・処理行数を記録するコンテキストマネージャ。
+    最大常駐メモリはプロセス全体の最大値ではなく、このステージの実行中の最大値。
+    ネストした場合は 'load/tokyo' のように親ステージの名前が付く。
+    MARKET_PROFILE が未設定の場合は何もしない。
+    """
+    global _active_profiler
+    if not PROFILE_ENABLED:
+        yield _NullStage()
+        return
+    record = StageRecord(name, '/'.join([r.name for r in _stack] + [name]), rows)
+    _stack.append(record)
+    profiler = None
+    if PROFILE_CPROFILE and _active_profiler is None:
+        # cProfile は同時に1つしか動かせないため、最も外側のステージでのみ取得する
+        profiler = _active_profiler = cProfile.Profile()
+        profiler.enable()
+    _start_rss_sampler()
+    rss_before = _current_rss_mb()
+    high_water_before = _peak_rss_mb()
+    record.peak_rss_mb = rss_before
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    record.started_sec = wall_start - _run_started_perf
+    try:
+        yield record
+    except BaseException as e:
+        record.error = repr(e)
+        raise
+    finally:
+        record.wall_sec = time.perf_counter() - wall_start
+        record.cpu_sec = time.process_time() - cpu_start
+        rss_after = _current_rss_mb()
+        record.peak_rss_mb = _stage_peak_rss_mb(record.peak_rss_mb, rss_after, high_water_before, _peak_rss_mb())
+        if rss_before is not None and rss_after is not None:
+            record.rss_delta_mb = rss_after - rss_before
+        if profiler is not None:
+            profiler.disable()
+            _active_profiler = None
+            record.top_functions = _top_functions(profiler)
+        _stack.pop()
+        _records.append(record)
+
+def profiled(name=None):
+    """
+    関数の呼び出しを1ステージとして記録するデコレータ。
+    戻り値が DataFrame (またはその先頭要素が DataFrame のタプル) の場合は、その行数を処理行数とする。
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILE_ENABLED:
+                return func(*args, **kwargs)
+            with profile_stage(stage_name) as stage:
+                result = func(*args, **kwargs)
+                stage.rows = _count_rows(result)
+                return result
+        return wrapper
+    return decorator
+
+def profile_section(name):
+    """
+    スクリプトの区切りごとに計測するための関数。呼び出すと直前の区間を閉じて新しい区間を開始する
+    (インデントを変えずに、スクリプトの各ステップの前に1行追加するだけで使える)。
+    """
+    global _open_section
+    if not PROFILE_ENABLED: return
+    end_section()
+    _open_section = profile_stage(name)
+    _open_section.__enter__()
+
+def end_section():
+    global _open_section
+    if _open_section is not None:
+        section, _open_section = _open_section, None
+        section.__exit__(None, None, None)
+
+def _top_functions(profiler, limit=CPROFILE_TOP_N):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, func_name), (_, n_calls, total_time, cumulative_time, _) in stats.stats.items():
+        rows.append({
+            'function': f"{os.path.basename(filename)}:{line}({func_name})",
+            'calls': n_calls, 'total_sec': total_time, 'cumulative_sec': cumulative_time,
+        })
+    rows.sort(key=lambda row: row['cumulative_sec'], reverse=True)
+    return rows[:limit]
+
+def get_records():
+    """記録したステージを開始順に返す (ネストしたステージは親の直後に並ぶ)。"""
+    return [record.to_dict() for record in sorted(_records, key=lambda record: record.started_sec)]
+
+def write_report(path=DEFAULT_REPORT_PATH):
+    """記録したステージの計測値を JSON と HTML に出力する。"""
+    end_section()
+    records = get_records()
+    if not records: return
+    payload = {
+        'started_at': _run_started.isoformat(timespec='seconds'),
+        'command': ' '.join(sys.argv),
+        'stages': records,
+    }
+    with open(f"{path}.json", 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    with open(f"{path}.html", 'w', encoding='utf-8') as f:
+        f.write(_render_html(payload))
+    print(f"\nプロファイル結果を保存しました: {path}.json / {path}.html")
+    print(_render_text(records))
+
+def _render_text(records):
+    lines = [f"{'ステージ':<60} {'wall(秒)':>9} {'CPU(秒)':>9} {'最大RSS(MB)':>12} {'RSS増減(MB)':>12} {'行数':>10}"]
+    for r in records:
+        peak = '' if r['peak_rss_mb'] is None else f"{r['peak_rss_mb']:.0f}"
+        delta = '' if r['rss_delta_mb'] is None else f"{r['rss_delta_mb']:+.0f}"
+        rows = '' if r['rows'] is None else f"{r['rows']:,}"
+        lines.append(f"{r['path']:<60} {r['wall_sec']:>9.2f} {r['cpu_sec']:>9.2f} {peak:>12} {delta:>12} {rows:>10}")
+    return '\n'.join(lines)
+
+def _render_html(payload):
+    records = payload['stages']
+    max_wall = max(r['wall_sec'] for r in records) or 1.0
+    rows = []
+    for r in records:
+        width = 300 * r['wall_sec'] / max_wall
+        peak = '' if r['peak_rss_mb'] is None else f"{r['peak_rss_mb']:.0f}"
+        delta = '' if r['rss_delta_mb'] is None else f"{r['rss_delta_mb']:+.0f}"
+        functions = ''
+        if r['top_functions']:
+            items = ''.join(
+                f"<tr><td>{html.escape(fn['function'])}</td><td>{fn['calls']}</td>"
+                f"<td>{fn['total_sec']:.3f}</td><td>{fn['cumulative_sec']:.3f}</td></tr>"
+                for fn in r['top_functions'])
+            functions = (f"<details><summary>cProfile 上位{len(r['top_functions'])}関数</summary><table>"
+                         f"<tr><th>関数</th><th>呼び出し</th><th>自身(秒)</th><th>累積(秒)</th></tr>{items}</table></details>")
+        rows.append(
+            f"<tr><td>{html.escape(r['path'])}{functions}</td>"
+            f"<td><div style='background:#4a90d9;width:{width:.0f}px'>&nbsp;</div>{r['wall_sec']:.2f}</td>"
+            f"<td>{r['cpu_sec']:.2f}</td>"
+            f"<td>{peak}</td>"
+            f"<td>{delta}</td>"
+            f"<td>{'' if r['rows'] is None else r['rows']}</td>"
+            f"<td>{html.escape(r['error'] or '')}</td></tr>")
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>プロファイル結果</title>"
+        "<style>body{font-family:sans-serif}table{border-collapse:collapse}td,th{border:1px solid #ccc;padding:4px;vertical-align:top}</style>"
+        f"</head><body><h1>プロファイル結果</h1><p>{html.escape(payload['command'])} ({payload['started_at']})</p>"
+        "<table><tr><th>ステージ</th><th>wall(秒)</th><th>CPU(秒)</th><th>最大RSS(MB)</th><th>RSS増減(MB)</th><th>行数</th><th>エラー</th></tr>"
+        + ''.join(rows) + "</table></body></html>")
+
+# プロセスプールのワーカーではレポートを書かない (メインプロセスのレポートを上書きしないため)
+if PROFILE_ENABLED and multiprocessing.parent_process() is None:
+    atexit.register(write_report)
@@ -0,0 +1,228 @@
+# quantile_sketch.py
+
+import json
+import math
+
+import pandas as pd
+import numpy as np
+
+DEFAULT_SKETCH_KEYS = ['市場名_正規化', '魚種（商品名）']
+DEFAULT_SKETCH_COLS = ['単価_円perKg', '卸売数量_kg換算']
+
+class KLLSketch:
+    """
+    KLL方式の分位点スケッチ。
+    各レベル h の値は 2**h 件分の重みを持ち、レベルが容量を超えると
+    ソートして1つおきに上位レベルへ昇格させる (圧縮)。
+    スケッチ同士はレベルごとに連結して圧縮するだけでマージできるため、
+    (市場, 魚種) ごとに作っておけば任意のグループの組み合わせの分位点を元データなしで求められる。
+    誤差はおおよそ順位で 1/k 程度。
+    """
+
+    def __init__(self, k=200):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min_value = np.nan
+        self.max_value = np.nan
+        self._compaction_count = 0
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, values):
+        """値の配列をまとめて追加する (NaN は無視)。"""
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if values.size == 0: return self
+        self.n += values.size
+        self.min_value = np.nanmin([self.min_value, values.min()])
+        self.max_value = np.nanmax([self.max_value, values.max()])
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if self.levels[level].size > self._capacity(level):
+                if level + 1 == len(self.levels): self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                leftover = items[:1] if items.size % 2 else items[:0]
+                items = items[leftover.size:]
+                # 昇格させる要素の偶奇を交互に切り替え、偏りを打ち消す (再現性のため乱数は使わない)
+                offset = self._compaction_count % 2
+                self._compaction_count += 1
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset::2]])
+                self.levels[level] = leftover
+                level = 0  # レベル数が増えると容量が変わるため最初から確認し直す
+            else:
+                level += 1
+
+    def merge(self, other):
+        """2つのスケッチをマージした新しいスケッチを返す。"""
+        merged = KLLSketch(k=max(self.k, other.k))
+        depth = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            np.concatenate([
+                self.levels[h] if h < len(self.levels) else np.empty(0),
+                other.levels[h] if h < len(other.levels) else np.empty(0),
+            ])
+            for h in range(depth)
+        ]
+        merged.n = self.n + other.n
+        merged.min_value = np.nanmin([self.min_value, other.min_value])
+        merged.max_value = np.nanmax([self.max_value, other.max_value])
+        merged._compaction_count = self._compaction_count + other._compaction_count
+        merged._compress()
+        return merged
+
+    def quantiles(self, qs):
+        """分位点 (0〜1) のリストに対する推定値の配列を返す。"""
+        qs = np.atleast_1d(np.asarray(qs, dtype='float64'))
+        if self.n == 0: return np.full(qs.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.size, 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, qs * cumulative[-1], side='left')
+        estimates = values[np.clip(positions, 0, values.size - 1)]
+        estimates = np.where(qs <= 0, self.min_value, estimates)
+        estimates = np.where(qs >= 1, self.max_value, estimates)
+        return estimates
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def box_stats(self, label=None, whis=1.5):
+        """
+        matplotlib の Axes.bxp に渡せる箱ひげ図の統計量を返す。
+        ひげは Q1 - whis*IQR / Q3 + whis*IQR を最小値・最大値で切り詰めた近似値。
+        """
+        q1, med, q3 = self.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        return {
+            'label': label, 'med': med, 'q1': q1, 'q3': q3,
+            'whislo': max(self.min_value, q1 - whis * iqr),
+            'whishi': min(self.max_value, q3 + whis * iqr),
+            'fliers': [],
+        }
+
+    def to_dict(self):
+        return {
+            'k': self.k, 'n': self.n,
+            'min': None if np.isnan(self.min_value) else float(self.min_value),
+            'max': None if np.isnan(self.max_value) else float(self.max_value),
+            'compactions': self._compaction_count,
+            'levels': [level.tolist() for level in self.levels],
+        }
+
+    @staticmethod
+    def from_dict(data):
+        sketch = KLLSketch(k=data['k'])
+        sketch.n = data['n']
+        sketch.min_value = np.nan if data['min'] is None else data['min']
+        sketch.max_value = np.nan if data['max'] is None else data['max']
+        sketch._compaction_count = data['compactions']
+        sketch.levels = [np.asarray(level, dtype='float64') for level in data['levels']]
+        return sketch
+
+def build_group_sketches(df, group_keys=None, value_cols=None, k=200):
+    """
+    グループ ((市場, 魚種) など) ごと・値の列ごとに KLLSketch を作る関数。
+
+    Returns:
+        dict: {列名: {グループキーのタプル: KLLSketch}}
+    """
+    group_keys = list(DEFAULT_SKETCH_KEYS if group_keys is None else group_keys)
+    value_cols = [col for col in (DEFAULT_SKETCH_COLS if value_cols is None else value_cols) if col in df.columns]
+    sketches = {col: {} for col in value_cols}
+    if df.empty or not value_cols: return sketches
+    group_indices = df.groupby(group_keys, observed=True, sort=True).indices
+    for col in value_cols:
+        col_values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        for key, idx in group_indices.items():
+            key = key if isinstance(key, tuple) else (key,)
+            sketch = KLLSketch(k=k).update(col_values[idx])
+            if sketch.n > 0: sketches[col][key] = sketch
+    n_groups = max((len(v) for v in sketches.values()), default=0)
+    print(f"分位点スケッチを作成しました: {n_groups} グループ × {len(value_cols)} 列")
+    return sketches
+
+def save_sketches(sketches, path, group_keys=None):
+    """スケッチをJSONファイルに保存する。"""
+    group_keys = list(DEFAULT_SKETCH_KEYS if group_keys is None else group_keys)
+    payload = {
+        'group_keys': group_keys,
+        'columns': {
+            col: [{'key': list(key), 'sketch': sketch.to_dict()} for key, sketch in col_sketches.items()]
+            for col, col_sketches in sketches.items()
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+    print(f"分位点スケッチを保存しました: {path}")
+
+def load_sketches(path):
+    """save_sketches で保存したスケッチを読み込む。 (スケッチ辞書, グループキー) を返す。"""
+    with open(path, encoding='utf-8') as f:
+        payload = json.load(f)
+    sketches = {
+        col: {tuple(item['key']): KLLSketch.from_dict(item['sketch']) for item in items}
+        for col, items in payload['columns'].items()
+    }
+    return sketches, payload['group_keys']
+
+def merge_sketches(col_sketches, key_filter=None):
+    """条件 key_filter(キーのタプル) を満たすグループのスケッチを1つにマージする。"""
+    merged = None
+    for key, sketch in col_sketches.items():
+        if key_filter is not None and not key_filter(key): continue
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged if merged is not None else KLLSketch()
+
+def rollup_sketches(col_sketches, level):
+    """
+    グループキーのうち level 番目 (0始まり) の値ごとにスケッチをマージする。
+    例: キーが (市場, 魚種) のとき level=0 で市場別、level=1 で魚種別。
+    """
+    rolled = {}
+    for key, sketch in col_sketches.items():
+        rolled[key[level]] = sketch if key[level] not in rolled else rolled[key[level]].merge(sketch)
+    return rolled
+
+def sketch_summary(rolled, qs=(0.25, 0.5, 0.75)):
+    """rollup_sketches の結果から、件数と分位点の表を作る。"""
+    rows = []
+    for label, sketch in rolled.items():
+        row = {'グループ': label, '件数': sketch.n}
+        row.update({f'q{q:g}': value for q, value in zip(qs, sketch.quantiles(qs))})
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('グループ') if rows else pd.DataFrame()
+
+def box_stats_list(rolled, order=None):
+    """rollup_sketches の結果を Axes.bxp 用の統計量リストにする。order 未指定時は中央値の降順。"""
+    if order is None:
+        order = sorted(rolled, key=lambda label: rolled[label].quantile(0.5), reverse=True)
+    return [rolled[label].box_stats(label=label) for label in order if label in rolled]
+
+if __name__ == '__main__':
+    print("quantile_sketch.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    n_rows = 200000
+    df_test = pd.DataFrame({
+        '市場名_正規化': rng.choice(['東京中央', '札幌', '大阪（本場）'], n_rows),
+        '魚種（商品名）': rng.choice(['まぐろ（生鮮）', 'めばち（冷凍）', 'さば'], n_rows),
+        '単価_円perKg': rng.lognormal(7.5, 0.6, n_rows),
+    })
+    sketches = build_group_sketches(df_test, value_cols=['単価_円perKg'])
+    by_market = rollup_sketches(sketches['単価_円perKg'], level=0)
+    print("\n市場別 単価の分位点 (スケッチ):")
+    print(sketch_summary(by_market))
+    print("\n市場別 単価の分位点 (厳密値):")
+    print(df_test.groupby('市場名_正規化')['単価_円perKg'].quantile([0.25, 0.5, 0.75]).unstack())
+    overall = merge_sketches(sketches['単価_円perKg'])
+    print("\n全体の1%/99%点 (スケッチ):", overall.quantiles([0.01, 0.99]))
+    print("全体の1%/99%点 (厳密値):", df_test['単価_円perKg'].quantile([0.01, 0.99]).to_numpy())
@@ -0,0 +1,199 @@
+# rolling_stats.py
+
+import bisect
+import math
+import pickle
+from collections import deque
+
+import pandas as pd
+import numpy as np
+
+from price_aggregation import aggregate_market_prices
+
+class RollingWindowStats:
+    """
+    1系列分の移動ウィンドウ状態。
+    値を1つ追加するごとに、合計・二乗和・最小/最大用の単調キュー・ソート済みリストを
+    差分更新するため、履歴全体を再計算する必要がない。
+    (平均・標準偏差・最小/最大は O(1)。分位点の参照は O(1) だが、ソート済みリストへの挿入・削除は
+    位置の探索が O(log w)、要素の移動がウィンドウ幅 w に対し O(w) (日次のウィンドウ幅では memmove 1回で十分速い))
+    """
+
+    # 浮動小数の誤差蓄積を防ぐため、この回数ごとに合計・二乗和を再計算する
+    RESYNC_INTERVAL = 10000
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.sorted_values = []
+        self.min_queue = deque()  # (通し番号, 値) 値が単調増加
+        self.max_queue = deque()  # (通し番号, 値) 値が単調減少
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.n_seen = 0
+        self.last_date = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        """値をウィンドウに追加し、ウィンドウ幅を超えた古い値を取り除く。"""
+        seq = self.n_seen
+        self.n_seen += 1
+
+        self.values.append(value)
+        bisect.insort(self.sorted_values, value)
+        self.total += value
+        self.total_sq += value * value
+        while self.min_queue and self.min_queue[-1][1] >= value: self.min_queue.pop()
+        self.min_queue.append((seq, value))
+        while self.max_queue and self.max_queue[-1][1] <= value: self.max_queue.pop()
+        self.max_queue.append((seq, value))
+
+        if len(self.values) > self.window:
+            old_value = self.values.popleft()
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, old_value)]
+            self.total -= old_value
+            self.total_sq -= old_value * old_value
+        oldest_seq = self.n_seen - len(self.values)
+        while self.min_queue[0][0] < oldest_seq: self.min_queue.popleft()
+        while self.max_queue[0][0] < oldest_seq: self.max_queue.popleft()
+
+        if self.n_seen % self.RESYNC_INTERVAL == 0:
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else np.nan
+
+    def std(self):
+        """標本標準偏差 (ddof=1)。pandas の rolling().std() と同じ定義。"""
+        n = len(self.values)
+        if n < 2: return np.nan
+        variance = (self.total_sq - self.total * self.total / n) / (n - 1)
+        return math.sqrt(variance) if variance > 0 else 0.0
+
+    def min(self):
+        return self.min_queue[0][1] if self.min_queue else np.nan
+
+    def max(self):
+        return self.max_queue[0][1] if self.max_queue else np.nan
+
+    def quantile(self, q):
+        """ウィンドウ内の分位点 (線形補間、pandas の既定と同じ)。"""
+        n = len(self.sorted_values)
+        if n == 0: return np.nan
+        pos = q * (n - 1)
+        lower = int(math.floor(pos))
+        upper = min(lower + 1, n - 1)
+        return self.sorted_values[lower] + (self.sorted_values[upper] - self.sorted_values[lower]) * (pos - lower)
+
+class RollingPriceMonitor:
+    """
+    市場・魚種などの系列ごとに RollingWindowStats を保持し、日次の値を追加するたびに
+    移動平均・標準偏差・最小/最大・zスコア・分位点を返す監視用コンポーネント。
+    """
+
+    def __init__(self, window=20, quantiles=(0.25, 0.5, 0.75), min_periods=None):
+        self.window = window
+        self.quantiles = tuple(quantiles)
+        self.min_periods = window if min_periods is None else min_periods
+        self.states = {}
+
+    def update(self, key, date, value):
+        """
+        系列 key に日付 date の値 value を追加し、その時点の統計量を dict で返す。
+        zスコアは追加前のウィンドウ (前日までの分布) に対する値。
+        既に処理済みの日付以前の値や NaN は追加せず None を返す。
+        """
+        if value is None or pd.isna(value): return None
+        state = self.states.get(key)
+        if state is None:
+            state = RollingWindowStats(self.window)
+            self.states[key] = state
+        date = pd.Timestamp(date)
+        if state.last_date is not None and date <= state.last_date:
+            print(f"警告: 系列 {key} の {date.date()} は処理済みの日付 ({state.last_date.date()}) 以前のためスキップします。")
+            return None
+
+        value = float(value)
+        zscore = np.nan
+        if len(state) >= self.min_periods:
+            prev_std = state.std()
+            if prev_std and not np.isnan(prev_std): zscore = (value - state.mean()) / prev_std
+
+        state.append(value)
+        state.last_date = date
+        enough = len(state) >= self.min_periods
+        row = {
+            '日付': date, '値': value, '件数': len(state),
+            '移動平均': state.mean() if enough else np.nan,
+            '移動標準偏差': state.std() if enough else np.nan,
+            '移動最小': state.min() if enough else np.nan,
+            '移動最大': state.max() if enough else np.nan,
+            'zスコア': zscore,
+        }
+        for q in self.quantiles:
+            row[f'移動分位点_{q:g}'] = state.quantile(q) if enough else np.nan
+        return row
+
+    def update_from_frame(self, df_daily, key_cols, date_col='日付', value_col='加重平均単価_円perKg'):
+        """
+        日次集計フレーム (aggregate_market_prices の出力など) の行を日付順に追加し、
+        各行の統計量をまとめたDataFrameを返す。
+        """
+        df_sorted = df_daily.sort_values(date_col, kind='stable')
+        keys = list(zip(*(df_sorted[col] for col in key_cols))) if key_cols else [()] * len(df_sorted)
+        results = []
+        for key, date, value in zip(keys, df_sorted[date_col], df_sorted[value_col]):
+            row = self.update(key, date, value)
+            if row is None: continue
+            row.update(dict(zip(key_cols, key)))
+            results.append(row)
+        if not results: return pd.DataFrame()
+        df_result = pd.DataFrame(results)
+        return df_result[list(key_cols) + [col for col in df_result.columns if col not in key_cols]]
+
+    def save(self, path):
+        """ウィンドウ状態をファイルに保存する (翌日の追加処理で再利用するため)。"""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+        print(f"移動統計の状態を保存しました: {path} ({len(self.states)} 系列)")
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def build_daily_price_monitor(df_cleaned, window=20, key_cols=None, quantiles=(0.25, 0.5, 0.75)):
+    """
+    前処理済みデータから市場・魚種別の日次加重平均単価を作り、全履歴で監視状態を構築する関数。
+
+    Returns:
+        tuple: (RollingPriceMonitor, 全履歴の統計量DataFrame)
+    """
+    key_cols = ['市場名_正規化', '魚種（商品名）'] if key_cols is None else list(key_cols)
+    df_daily = aggregate_market_prices(df_cleaned, freq='D', group_keys=key_cols)
+    monitor = RollingPriceMonitor(window=window, quantiles=quantiles)
+    if df_daily.empty:
+        print("日次集計が空のため、移動統計の構築をスキップします。")
+        return monitor, pd.DataFrame()
+    df_history = monitor.update_from_frame(df_daily, key_cols)
+    print(f"移動統計を構築しました: {len(monitor.states)} 系列, {len(df_history)} 行")
+    return monitor, df_history
+
+if __name__ == '__main__':
+    print("rolling_stats.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    test_values = pd.Series(rng.normal(3000, 300, 60), index=pd.date_range('2023-01-01', periods=60, freq='D'))
+    monitor = RollingPriceMonitor(window=10, quantiles=(0.5,))
+    rows = [monitor.update(('東京中央', 'まぐろ（生鮮）'), d, v) for d, v in test_values.items()]
+    df_stream = pd.DataFrame(rows).set_index('日付')
+    rolling = test_values.rolling(10)
+    print("\npandas の rolling との差 (最大絶対誤差):")
+    print("  平均:", np.nanmax(np.abs(df_stream['移動平均'] - rolling.mean())))
+    print("  標準偏差:", np.nanmax(np.abs(df_stream['移動標準偏差'] - rolling.std())))
+    print("  最小:", np.nanmax(np.abs(df_stream['移動最小'] - rolling.min())))
+    print("  最大:", np.nanmax(np.abs(df_stream['移動最大'] - rolling.max())))
+    print("  中央値:", np.nanmax(np.abs(df_stream['移動分位点_0.5'] - rolling.median())))
+    print(df_stream.tail())
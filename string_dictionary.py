@@ -0,0 +1,132 @@
+# string_dictionary.py
+
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+from text_normalizer import normalize_width
+
+DEFAULT_DICTIONARY_PATH = 'string_dictionary.json'
+
+# 整数コード化する文字列列 (東京・札幌の共通スキーマと大阪日報の列)
+DEFAULT_TEXT_COLUMNS = ['魚種（商品名）', '産地', '銘柄・規格（サイズ／グレード）', '品目', '主な産地']
+
+# 前処理・分析で fillna などに使う値は、常にカテゴリとして存在するよう最初に登録しておく
+RESERVED_VALUES = ['', '不明', '小計']
+
+class StringDictionary:
+    """
+    プロジェクト共通の文字列辞書 (値 <-> 整数コード)。
+    正規化は列の値ごとではなく「ユニーク値ごとに1回」だけ行い、
+    同じ辞書で符号化した列どうしはコードがそのまま比較・結合できる。
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.normalized_cache = {}
+        for value in RESERVED_VALUES:
+            self._code_for(value)
+
+    @staticmethod
+    def normalize(value):
+        """全角/半角の表記ゆれを統一し、前後の空白 (全角スペースを含む) を除去する。"""
+        return normalize_width(value)
+
+    def _code_for(self, normalized_value):
+        code = self.codes.get(normalized_value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(normalized_value)
+            self.codes[normalized_value] = code
+        return code
+
+    def encode(self, series):
+        """
+        Series を整数コードの配列 (int32、欠損は -1) に変換する。
+        pd.factorize で一度ユニーク値にまとめてから正規化・辞書引きするため、
+        コストは行数ではなくユニーク値の数に比例する。
+        """
+        labels, uniques = pd.factorize(series, use_na_sentinel=True)
+        unique_codes = np.empty(len(uniques), dtype='int32')
+        for i, raw_value in enumerate(uniques):
+            raw_value = str(raw_value)
+            normalized = self.normalized_cache.get(raw_value)
+            if normalized is None:
+                normalized = self.normalize(raw_value)
+                self.normalized_cache[raw_value] = normalized
+            unique_codes[i] = self._code_for(normalized)
+        codes = np.full(len(labels), -1, dtype='int32')
+        valid = labels >= 0
+        codes[valid] = unique_codes[labels[valid]]
+        return codes
+
+    def to_categorical(self, codes):
+        """整数コードから、辞書全体をカテゴリとする Categorical を作る (コピーは発生しない)。"""
+        return pd.Categorical.from_codes(codes, categories=pd.Index(self.values, dtype='object'))
+
+    def decode(self, codes):
+        """整数コードの配列を文字列の配列に戻す (欠損は None)。"""
+        values = np.asarray(self.values + [None], dtype='object')
+        return values[np.asarray(codes)]
+
+    def save(self, path=DEFAULT_DICTIONARY_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'values': self.values}, f, ensure_ascii=False)
+
+    @staticmethod
+    def load(path=DEFAULT_DICTIONARY_PATH):
+        """保存済みの辞書を読み込む (なければ新規作成)。既存の値のコードは変わらない。"""
+        dictionary = StringDictionary()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for value in json.load(f)['values']:
+                    dictionary._code_for(value)
+        return dictionary
+
+def encode_text_columns(df, columns=None, dictionary=None, dictionary_path=DEFAULT_DICTIONARY_PATH):
+    """
+    DataFrame の文字列列を、共通辞書をカテゴリとする category 型 (内部は整数コード) に変換する関数。
+    すべての列を符号化してからカテゴリを作るため、列どうしのカテゴリ (コード体系) は一致する。
+    == / isin / groupby / str.contains はコード (またはユニーク値) 上で行われるようになる。
+
+    Args:
+        df (pandas.DataFrame): 変換対象 (直接更新する)。
+        columns (list): 対象列。None の場合は DEFAULT_TEXT_COLUMNS のうち存在するもの。
+        dictionary (StringDictionary): 使用する辞書。None の場合は dictionary_path から読み込み、更新後に保存する。
+
+    Returns:
+        StringDictionary: 使用した辞書。
+    """
+    save_after = dictionary is None
+    if dictionary is None:
+        dictionary = StringDictionary.load(dictionary_path)
+    columns = [col for col in (DEFAULT_TEXT_COLUMNS if columns is None else columns) if col in df.columns]
+
+    encoded = {}
+    for col in columns:
+        before_mb = df[col].memory_usage(deep=True) / 1024**2
+        encoded[col] = (dictionary.encode(df[col]), before_mb)
+    for col, (codes, before_mb) in encoded.items():
+        df[col] = dictionary.to_categorical(codes)
+        after_mb = df[col].memory_usage(deep=True) / 1024**2
+        print(f"  -> {col}: {before_mb:.1f} MB -> {after_mb:.1f} MB (辞書サイズ {len(dictionary.values)})")
+
+    if save_after:
+        dictionary.save(dictionary_path)
+    return dictionary
+
+if __name__ == '__main__':
+    print("string_dictionary.py を直接実行しています（テストモード）")
+    df_test = pd.DataFrame({
+        '魚種（商品名）': ['まぐろ（生鮮）', ' まぐろ（生鮮）', '小計', np.nan, 'めばち　'],
+        '産地': ['長崎', '長崎 ', '三重', '不明', np.nan],
+    })
+    test_dictionary = StringDictionary()
+    encode_text_columns(df_test, dictionary=test_dictionary)
+    print(df_test)
+    print("\n魚種のコード:", df_test['魚種（商品名）'].cat.codes.tolist())
+    print("産地のコード:", df_test['産地'].cat.codes.tolist())
+    print("「小計」以外:", (df_test['魚種（商品名）'] != '小計').tolist())
@@ -0,0 +1,115 @@
+# text_normalizer.py
+
+import json
+import os
+import re
+import unicodedata
+
+import pandas as pd
+import numpy as np
+
+DEFAULT_CACHE_PATH = 'text_normalization_cache.json'
+
+# 正規化ルールを変更したら上げる (保存済みキャッシュが自動的に無効になる)
+NORMALIZATION_VERSION = 1
+
+# 半角カナ (濁点・半濁点を含む連続部分)、全角英数字、全角スペース、全角スラッシュ。
+# 全角括弧「（）」や中黒「・」は '大阪（本場）' 'まぐろ（生鮮）' などの値と一致させるため変換しない。
+_WIDTH_FOLD_PATTERN = re.compile('[｡-ﾟ]+|[０-９Ａ-Ｚａ-ｚ　／]+')
+
+def normalize_width(value):
+    """
+    文字列の全角/半角の表記ゆれを統一する。
+    半角カナは全角カナに、全角英数字・スペース・スラッシュは半角にし (NFKC)、前後の空白を除去する。
+    例: 'ｹｰｽ' -> 'ケース', 'ｋｇ' -> 'kg', '円/ｔ' -> '円/t'
+    """
+    folded = _WIDTH_FOLD_PATTERN.sub(lambda m: unicodedata.normalize('NFKC', m.group(0)), value)
+    return folded.strip(' \t\r\n')
+
+def load_normalization_cache(path=DEFAULT_CACHE_PATH):
+    """保存済みの {元の値: 正規化後の値} を読み込む。ルールのバージョンが異なる場合は空で始める。"""
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('version') == NORMALIZATION_VERSION:
+            return payload['values']
+    return {}
+
+def save_normalization_cache(cache, path=DEFAULT_CACHE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'version': NORMALIZATION_VERSION, 'values': cache}, f, ensure_ascii=False)
+
+def _normalize_uniques(uniques, cache):
+    normalized = []
+    for raw_value in uniques:
+        value = cache.get(raw_value)
+        if value is None:
+            value = normalize_width(raw_value)
+            cache[raw_value] = value
+        normalized.append(value)
+    return normalized
+
+def normalize_text_columns(df, columns=None, cache=None, cache_path=DEFAULT_CACHE_PATH):
+    """
+    DataFrame の文字列列の全角/半角を、列のユニーク値ごとに1回だけ正規化する関数。
+    正規化の結果はキャッシュファイルに保存され、次回以降は既知の値の変換をそのまま再利用する。
+    そのためコストは行数ではなくユニーク値の数に比例する。
+
+    Args:
+        df (pandas.DataFrame): 変換対象 (直接更新する)。
+        columns (list): 対象列。None の場合は object 型・category 型のすべての列。
+        cache (dict): 使用するキャッシュ。None の場合は cache_path から読み込み、更新後に保存する。
+        cache_path (str): キャッシュファイルのパス。None の場合は保存しない。
+
+    Returns:
+        int: 値が変化したユニーク値の数。
+    """
+    save_after = cache is None and cache_path is not None
+    if cache is None:
+        cache = load_normalization_cache(cache_path)
+    if columns is None:
+        columns = [col for col in df.columns
+                   if pd.api.types.is_object_dtype(df[col]) or isinstance(df[col].dtype, pd.CategoricalDtype)]
+
+    n_changed = 0
+    for col in columns:
+        if col not in df.columns: continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            normalized = _normalize_uniques([str(v) for v in categories], cache)
+            n_changed += sum(a != b for a, b in zip(categories, normalized))
+            if len(set(normalized)) == len(normalized):
+                df[col] = df[col].cat.rename_categories(normalized)
+            else:
+                # 正規化で同じ値になるカテゴリがある場合は、文字列に戻してから統合する
+                df[col] = df[col].astype('object').map(dict(zip(categories, normalized))).astype('category')
+            continue
+        labels, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        uniques = np.asarray(uniques, dtype='object')
+        is_text = np.array([isinstance(v, str) for v in uniques], dtype=bool)
+        if not is_text.any(): continue
+        normalized = uniques.copy()
+        normalized[is_text] = _normalize_uniques(uniques[is_text], cache)
+        changed = normalized != uniques
+        if not changed.any(): continue
+        n_changed += int(changed.sum())
+        # 値が変わる行だけを書き換える (欠損値などはそのまま)
+        rows = (labels >= 0) & changed[np.maximum(labels, 0)]
+        values = df[col].to_numpy(dtype='object', copy=True)
+        values[rows] = normalized[labels[rows]]
+        df[col] = values
+
+    if save_after:
+        save_normalization_cache(cache, cache_path)
+    return n_changed
+
+if __name__ == '__main__':
+    print("text_normalizer.py を直接実行しています（テストモード）")
+    df_test = pd.DataFrame({
+        '数量単位（kg、箱、尾など）': ['ｋｇ', 'kg', 'ｹｰｽ', 'ｶｺﾞ', np.nan, 'ﾊﾟｯｸ'],
+        '価格単位（円/kg、円/箱など）': ['円/ｔ', '円／ｋｇ', '円/kg', '円', '', np.nan],
+        '魚種（商品名）': ['まぐろ（生鮮）', 'めばち（冷凍）', '小計', 'ｻﾊﾞ', 'さば　', 'まぐろ（生鮮）'],
+    })
+    n_changed = normalize_text_columns(df_test, cache={})
+    print(df_test)
+    print(f"\n変化したユニーク値: {n_changed}")
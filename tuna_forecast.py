@@ -0,0 +1,192 @@
+# tuna_forecast.py
+
+import hashlib
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from price_aggregation import aggregate_market_prices
+
+DEFAULT_FORECAST_CACHE_PATH = 'tuna_forecast_cache.json'
+DEFAULT_FORECAST_OUTPUT_PATH = 'マグロ予測_結果.csv'
+
+# 予測対象 (月次集計の列名 -> 表示名)
+FORECAST_TARGETS = {'加重平均単価_円perKg': '単価', '総取引数量_kg': '数量'}
+
+# モデル設定 (変更するとキャッシュのキーが変わり、全系列が再推定される)
+MODEL_CONFIG = {
+    'trend': 'add', 'damped_trend': True, 'seasonal': 'add', 'seasonal_periods': 12,
+    'min_seasonal_months': 24, 'min_months': 6, 'backtest_months': 6, 'log_transform': True,
+}
+
+def build_monthly_series(df_maguro, group_keys=None):
+    """
+    マグロデータから (市場, 魚種, 予測対象) ごとの月次系列を作る関数。
+    取引のない月は、数量は 0、単価は前後の月から線形補間する。
+
+    Returns:
+        dict: {(市場, 魚種, 予測対象): pandas.Series (月末日付のインデックス)}
+    """
+    group_keys = ['市場名_正規化', '魚種（商品名）'] if group_keys is None else list(group_keys)
+    df_monthly = aggregate_market_prices(df_maguro, freq='M', group_keys=group_keys)
+    series = {}
+    if df_monthly.empty: return series
+    for key, df_group in df_monthly.groupby(group_keys, observed=True, sort=True):
+        df_group = df_group.set_index('日付').sort_index()
+        full_index = pd.date_range(df_group.index.min(), df_group.index.max(), freq=pd.offsets.MonthEnd())
+        df_group = df_group.reindex(full_index)
+        for target_col, target_name in FORECAST_TARGETS.items():
+            values = df_group[target_col]
+            values = values.fillna(0.0) if target_name == '数量' else values.interpolate(limit_area='inside')
+            series[tuple(key) + (target_name,)] = values.astype('float64')
+    return series
+
+def series_fingerprint(values, config=None):
+    """系列の日付・値とモデル設定から、キャッシュのキー (sha256) を作る。"""
+    digest = hashlib.sha256()
+    digest.update(np.asarray(values.index.asi8, dtype='int64').tobytes())
+    digest.update(np.asarray(values.to_numpy(), dtype='float64').tobytes())
+    digest.update(json.dumps(MODEL_CONFIG if config is None else config, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def _fit_and_forecast(values, horizon, config):
+    """指数平滑化モデル (Holt-Winters) を推定し、horizon か月先までの予測値と推定パラメータを返す。"""
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    seasonal = config['seasonal'] if len(values) >= config['min_seasonal_months'] else None
+    trend = config['trend'] if len(values) >= 4 else None
+    fit_values = np.log1p(np.maximum(values, 0.0)) if config['log_transform'] else values
+    model = ExponentialSmoothing(
+        fit_values, trend=trend, damped_trend=config['damped_trend'] and trend is not None,
+        seasonal=seasonal, seasonal_periods=config['seasonal_periods'] if seasonal else None,
+        initialization_method='estimated',
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        fitted = model.fit()
+    forecast = np.asarray(fitted.forecast(horizon), dtype='float64')
+    if config['log_transform']: forecast = np.expm1(forecast)
+    params = {name: float(value) for name, value in fitted.params.items()
+              if np.isscalar(value) and value is not None and np.isfinite(value)}
+    model_name = f"ETS(trend={trend}, seasonal={seasonal})"
+    return forecast, params, model_name
+
+def fit_series_task(task):
+    """
+    プロセスプールのワーカーで1系列を処理する: 直近 backtest_months か月を除いて推定したモデルで
+    その期間を予測して誤差を評価し、全期間で推定し直して翌月を予測する。
+    """
+    key, fingerprint, dates, raw_values, config = task
+    values = np.asarray(raw_values, dtype='float64')
+    result = {'fingerprint': fingerprint, 'n_months': len(values), 'last_month': str(dates[-1])[:10]}
+    try:
+        n_test = config['backtest_months']
+        if len(values) - n_test >= config['min_months']:
+            backtest, _, _ = _fit_and_forecast(values[:-n_test], n_test, config)
+            actual = values[-n_test:]
+            errors = backtest - actual
+            nonzero = actual != 0
+            result['backtest_mae'] = float(np.mean(np.abs(errors)))
+            result['backtest_rmse'] = float(np.sqrt(np.mean(errors ** 2)))
+            result['backtest_mape'] = float(np.mean(np.abs(errors[nonzero] / actual[nonzero])) * 100) if nonzero.any() else None
+        forecast, params, model_name = _fit_and_forecast(values, 1, config)
+        result.update(forecast=float(forecast[0]), params=params, model=model_name, status='ok')
+    except Exception as e:
+        result.update(forecast=None, params={}, model=None, status=f'error: {e}')
+    return key, result
+
+def load_forecast_cache(path=DEFAULT_FORECAST_CACHE_PATH):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_forecast_cache(cache, path=DEFAULT_FORECAST_CACHE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+
+def run_tuna_forecasts(df_maguro, n_jobs=4, cache_path=DEFAULT_FORECAST_CACHE_PATH,
+                       output_path=DEFAULT_FORECAST_OUTPUT_PATH, config=None):
+    """
+    全市場・全マグロ魚種の翌月の単価・数量を予測する関数。
+    系列ごとのモデル推定はプロセスプールで並列に行い、推定結果は系列のフィンガープリント
+    (日付・値・モデル設定のハッシュ) をキーにキャッシュするため、データの変わった系列だけが再推定される。
+
+    Args:
+        df_maguro (pandas.DataFrame): マグロ関連データ (extract_maguro_data の出力)。
+        n_jobs (int): 並列に推定するプロセス数。
+        cache_path (str): 推定結果のキャッシュファイル。None の場合はキャッシュしない。
+        output_path (str): 結果の保存先CSV。None の場合は保存しない。
+
+    Returns:
+        pandas.DataFrame: 系列ごとの予測値とバックテスト誤差 (MAE, RMSE, MAPE%)。
+    """
+    config = dict(MODEL_CONFIG if config is None else config)
+    start = time.perf_counter()
+    series = build_monthly_series(df_maguro)
+    cache = load_forecast_cache(cache_path) if cache_path else {}
+
+    results, tasks, n_skipped = {}, [], 0
+    for key, values in series.items():
+        values = values.dropna()
+        if len(values) < config['min_months']:
+            n_skipped += 1
+            continue
+        fingerprint = series_fingerprint(values, config)
+        cache_key = json.dumps(list(key), ensure_ascii=False)
+        cached = cache.get(cache_key)
+        if cached is not None and cached['fingerprint'] == fingerprint:
+            results[key] = dict(cached, cached=True)
+        else:
+            tasks.append((key, fingerprint, values.index.to_numpy(), values.to_numpy(), config))
+    print(f"予測対象: {len(series)} 系列 (キャッシュ使用 {len(results)}, 再推定 {len(tasks)}, データ不足 {n_skipped})")
+
+    if tasks:
+        if n_jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as executor:
+                fitted = list(executor.map(fit_series_task, tasks, chunksize=max(1, len(tasks) // (n_jobs * 4))))
+        else:
+            fitted = [fit_series_task(task) for task in tasks]
+        for key, result in fitted:
+            cache[json.dumps(list(key), ensure_ascii=False)] = result
+            results[key] = dict(result, cached=False)
+        if cache_path: save_forecast_cache(cache, cache_path)
+
+    rows = []
+    for (market, species, target), result in sorted(results.items()):
+        last_month = pd.Timestamp(result['last_month'])
+        rows.append({
+            '市場名_正規化': market, '魚種（商品名）': species, '予測対象': target,
+            '最終月': last_month.strftime('%Y-%m'),
+            '予測月': (last_month + pd.offsets.MonthEnd(1)).strftime('%Y-%m'),
+            '予測値': result['forecast'], 'モデル': result['model'], '観測月数': result['n_months'],
+            'バックテストMAE': result.get('backtest_mae'), 'バックテストRMSE': result.get('backtest_rmse'),
+            'バックテストMAPE(%)': result.get('backtest_mape'),
+            '状態': result['status'], 'キャッシュ使用': result['cached'],
+        })
+    df_forecast = pd.DataFrame(rows)
+    if output_path and not df_forecast.empty:
+        df_forecast.to_csv(output_path, index=False, encoding='utf_8_sig')
+        print(f"予測結果を {output_path} に保存しました ({len(df_forecast)} 行)")
+    print(f"予測処理が完了しました ({time.perf_counter() - start:.1f} 秒)")
+    return df_forecast
+
+if __name__ == '__main__':
+    print("tuna_forecast.py を直接実行しています（テストモード）")
+    rng = np.random.default_rng(0)
+    frames = []
+    for market in ['東京中央', '札幌', '大阪（本場）']:
+        for species in ['まぐろ（生鮮）', 'めばち（冷凍）']:
+            dates = pd.bdate_range('2016-01-01', '2024-12-31')
+            season = 1 + 0.2 * np.sin(2 * np.pi * dates.month / 12)
+            frames.append(pd.DataFrame({
+                '日付': dates, '市場名_正規化': market, '魚種（商品名）': species,
+                '単価_円perKg': 3000 * season * rng.lognormal(0, 0.1, len(dates)),
+                '卸売数量_kg換算': 500 / season * rng.lognormal(0, 0.3, len(dates)),
+            }))
+    df_test = pd.concat(frames, ignore_index=True)
+    print(run_tuna_forecasts(df_test, n_jobs=2, cache_path=None, output_path=None).to_string())
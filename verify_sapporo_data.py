@@ -6,6 +6,9 @@ import numpy as np
 # --- モジュールのインポート ---
 from dataframe_loader import load_and_combine_market_data
 from data_preprocessor import preprocess_market_data 
+from maguro_subset import extract_maguro_data, pattern_maguro
+from data_quality import screen_data_quality, summarize_quality_flags, has_flag, QUALITY_FLAG_COL, FLAG_SUSPECT_TON_QUANTITY
+from lineage import trace_rows
 
 # --- 1. ファイルパスの設定 ---
 tokyo_file_paths = ['Tokyo2014_2019.csv', 'Toyko2020_2025.csv']
@@ -14,7 +17,8 @@ osaka_file_path = 'Osaka2014_2025.csv'
 
 # --- 2. データの読み込み ---
 print("--- 全市場データの読み込み開始 ---")
-df_raw_combined = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path)
+# lineage=True: 各行に元ファイル・行番号の由来コードを付ける (検証で見つかった行を元ファイルに戻すため)
+df_raw_combined = load_and_combine_market_data(tokyo_file_paths, sapporo_file_path, osaka_file_path, encode_strings=True, lineage=True)
 if df_raw_combined.empty: exit("データフレームの読み込み失敗")
 print("--- 全市場データの読み込み完了 ---")
 
@@ -59,40 +63,7 @@ else:
 
 # --- 4. 「マグロ」関連データの抽出 (アプローチ1: 鮮度明確＋札幌・大阪特有) ---
 print("\n\n" + "="*20 + " マグロ関連データの抽出 (アプローチ1) " + "="*20)
-maguro_base_keywords_for_fresh_frozen = [
-    'まぐろ', 'きわだ', 'きはだ', 'めばち', 'いんど', 'みなみ', 
-    'まかじき', 'めかじき', 'びんちょう', 'びんなが', '本まぐろ', 'くろまぐろ'
-]
-sendo_keywords = ['生鮮', '冷凍']
-pattern_sendo = rf"({'|'.join(sendo_keywords)})"
-pattern_maguro = rf"({'|'.join(maguro_base_keywords_for_fresh_frozen)})" # 検証3でも使うのでここで定義
-
-df_maguro_sendo_clear = df_all_markets_cleaned[
-    df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False) &
-    df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_maguro, case=False, na=False)
-].copy()
-sapporo_main_maguro_names = ['本まぐろ', 'めばち'] 
-df_sapporo_specific_maguro = df_all_markets_cleaned[
-    (df_all_markets_cleaned['市場名_正規化'] == '札幌') &
-    (df_all_markets_cleaned['魚種（商品名）'].isin(sapporo_main_maguro_names)) &
-    (~df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False))
-].copy()
-osaka_main_maguro_names = ['くろまぐろ', 'きわだ'] 
-df_osaka_specific_maguro = df_all_markets_cleaned[
-    (df_all_markets_cleaned['市場名_正規化'] == '大阪（本場）') &
-    (df_all_markets_cleaned['魚種（商品名）'].isin(osaka_main_maguro_names)) &
-    (~df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_sendo, case=False, na=False))
-].copy()
-
-dfs_to_concat = []
-if not df_maguro_sendo_clear.empty: dfs_to_concat.append(df_maguro_sendo_clear)
-if not df_sapporo_specific_maguro.empty: dfs_to_concat.append(df_sapporo_specific_maguro)
-if not df_osaka_specific_maguro.empty: dfs_to_concat.append(df_osaka_specific_maguro)
-
-if dfs_to_concat:
-    df_maguro_all = pd.concat(dfs_to_concat, ignore_index=True).drop_duplicates().reset_index(drop=True)
-else:
-    df_maguro_all = pd.DataFrame()
+df_maguro_all = extract_maguro_data(df_all_markets_cleaned)
 if df_maguro_all.empty: exit("マグロ関連データなし(検証用)")
 print(f"検証用マグロデータの総行数: {len(df_maguro_all)}")
 
@@ -125,7 +96,7 @@ original_ton_unit_col = '数量単位（トン、箱、尾など）'
 if original_ton_unit_col in df_all_markets_cleaned.columns:
     df_sapporo_ton_candidates_v2 = df_all_markets_cleaned[ # 変数名変更
         (df_all_markets_cleaned['市場名_正規化'] == '札幌') &
-        (df_all_markets_cleaned[original_ton_unit_col].fillna('').str.lower().isin(['トン', 'ｔ', 't'])) &
+        (df_all_markets_cleaned[original_ton_unit_col].fillna('').str.lower().isin(['トン', 't'])) &
         (df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_maguro, case=False, na=False)) 
     ].copy()
     if not df_sapporo_ton_candidates_v2.empty:
@@ -153,7 +124,7 @@ print("\n\n" + "="*20 + " 検証3: 札幌「トン」単位レコードの卸売
 if original_ton_unit_col in df_all_markets_cleaned.columns: # original_ton_unit_col_v3 を original_ton_unit_col に統一
     df_sapporo_ton_records_v3 = df_all_markets_cleaned[ # 変数名変更
         (df_all_markets_cleaned['市場名_正規化'] == '札幌') &
-        (df_all_markets_cleaned[original_ton_unit_col].fillna('').str.lower().isin(['トン', 'ｔ', 't'])) &
+        (df_all_markets_cleaned[original_ton_unit_col].fillna('').str.lower().isin(['トン', 't'])) &
         (df_all_markets_cleaned['魚種（商品名）'].fillna('').str.contains(pattern_maguro, case=False, na=False)) 
     ].copy()
     if not df_sapporo_ton_records_v3.empty:
@@ -179,4 +150,19 @@ if original_ton_unit_col in df_all_markets_cleaned.columns: # original_ton_unit_
     else: print("札幌市場で元の単位が「トン」だったマグロデータは見つかりませんでした(v3)。")
 else: print(f"元の数量単位列 '{original_ton_unit_col}' が df_all_markets_cleaned に見つかりません。")
 
+# --- 検証4: 全データの品質チェック (市場・魚種・数量単位ごとのロバスト統計量) ---
+print("\n\n" + "="*20 + " 検証4: 全データの品質チェック " + "="*20)
+df_all_markets_flagged = screen_data_quality(df_all_markets_cleaned)
+print("\n--- 市場別 品質フラグ件数 ---")
+print(summarize_quality_flags(df_all_markets_flagged, group_col='市場名_正規化'))
+df_sapporo_ton_flagged = df_all_markets_flagged[
+    (df_all_markets_flagged['市場名_正規化'] == '札幌') &
+    has_flag(df_all_markets_flagged[QUALITY_FLAG_COL], FLAG_SUSPECT_TON_QUANTITY)
+]
+print(f"\n札幌市場でトン/kg取り違えが疑われる行: {len(df_sapporo_ton_flagged)}件")
+if not df_sapporo_ton_flagged.empty:
+    df_sapporo_ton_flagged_head = df_sapporo_ton_flagged[['日付', '魚種（商品名）', '卸売数量', original_ton_unit_col, quantity_col, '数量_ロバストz']].head(20)
+    # 由来 (元ファイルのパス・行番号) を付けて表示
+    print(pd.concat([df_sapporo_ton_flagged_head, trace_rows(df_sapporo_ton_flagged.head(20))], axis=1).to_string())
+
 print("\n\n検証処理が完了しました。")
\ No newline at end of file